@@ -0,0 +1,172 @@
+"""Backtesting de las predicciones de cosecha contra la producción real.
+
+Cada PrediccionCosecha se compara con el rendimiento real de su parcela, cultivo y
+temporada objetivo: el promedio de rendimiento_hectarea de los registros de esa
+temporada, la misma escala con la que se entrena el modelo. Solo cuentan las
+predicciones hechas antes de la primera cosecha registrada de la temporada.
+
+Una consulta une predicciones y producción real; los errores se calculan en bloque con
+pandas/numpy y se guardan por (modelo, cultivo, temporada) en backtesting_predicciones.
+Cada ejecución (`python -m backtesting`, p. ej. desde cron) procesa las temporadas de
+cada cultivo con alguna predicción sin resultado de su modelo o con registros creados o
+modificados (según `cambios`) después de su fecha_calculo: una temporada en curso se
+vuelve a calcular a medida que llegan cosechas. Los borrados físicos de registros no se
+detectan; `--temporada` vuelve a calcular temporadas concretas y `--recalcular` todas.
+"""
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, BacktestingTemporada
+
+COLUMNAS = ['modelo', 'cultivo_id', 'temporada', 'rendimiento_predicho', 'rango_minimo', 'rango_maximo',
+            'rendimiento_real']
+
+_SQL_PREDICCIONES_REALES = '''
+    WITH reales AS (
+        SELECT parcela_id, cultivo_id, temporada,
+               AVG(rendimiento_hectarea) AS rendimiento_real, MIN(fecha_registro) AS primera_cosecha
+        FROM registros_produccion r
+        WHERE {temporadas}
+        GROUP BY parcela_id, cultivo_id, temporada
+    )
+    SELECT COALESCE(p.modelo_utilizado, 'desconocido') AS modelo, p.cultivo_id, p.temporada_objetivo,
+           p.rendimiento_predicho, p.rango_minimo, p.rango_maximo, reales.rendimiento_real
+    FROM predicciones_cosecha p
+    JOIN reales ON reales.parcela_id = p.parcela_id AND reales.cultivo_id = p.cultivo_id
+               AND reales.temporada = p.temporada_objetivo
+    WHERE p.fecha_prediccion <= reales.primera_cosecha
+'''
+
+# Temporadas de cada cultivo con una predicción evaluable cuyo modelo no tiene resultado o
+# lo tiene calculado antes del último registro creado o modificado de la temporada
+_TEMPORADAS_PENDIENTES = '''
+    (r.cultivo_id, r.temporada) IN (
+        SELECT m.cultivo_id, m.temporada
+        FROM (
+            SELECT r2.parcela_id, r2.cultivo_id, r2.temporada, MIN(r2.fecha_registro) AS primera_cosecha,
+                   MAX(MAX(GREATEST(r2.fecha_creacion, c.fecha_cambio)))
+                       OVER (PARTITION BY r2.cultivo_id, r2.temporada) AS modificado
+            FROM registros_produccion r2
+            LEFT JOIN cambios c ON c.tabla = 'registros_produccion' AND c.fila_id = r2.id
+            GROUP BY r2.parcela_id, r2.cultivo_id, r2.temporada
+        ) m
+        JOIN predicciones_cosecha p ON p.parcela_id = m.parcela_id AND p.cultivo_id = m.cultivo_id
+                                   AND p.temporada_objetivo = m.temporada
+                                   AND p.fecha_prediccion <= m.primera_cosecha
+        WHERE NOT EXISTS (
+            SELECT 1 FROM backtesting_predicciones b
+            WHERE b.modelo = COALESCE(p.modelo_utilizado, 'desconocido') AND b.cultivo_id = m.cultivo_id
+              AND b.temporada = m.temporada AND b.fecha_calculo >= COALESCE(m.modificado, '-infinity')
+        )
+    )
+'''
+
+def errores(df):
+    """Sumas de error por (modelo, cultivo, temporada) de un DataFrame con COLUMNAS"""
+    error = df['rendimiento_predicho'] - df['rendimiento_real']
+    con_rango = df['rango_minimo'].notna() & df['rango_maximo'].notna()
+    df = df.assign(
+        error_absoluto=error.abs(),
+        error_cuadratico=np.square(error),
+        con_rango=con_rango,
+        dentro_rango=con_rango & df['rendimiento_real'].between(df['rango_minimo'], df['rango_maximo'])
+    )
+    return df.groupby(['modelo', 'cultivo_id', 'temporada'], as_index=False).agg(
+        predicciones=('error_absoluto', 'size'),
+        suma_error_absoluto=('error_absoluto', 'sum'),
+        suma_error_cuadratico=('error_cuadratico', 'sum'),
+        con_rango=('con_rango', 'sum'),
+        dentro_rango=('dentro_rango', 'sum')
+    )
+
+def ejecutar(temporadas=None, recalcular=False):
+    """Calcular y guardar los errores de las temporadas pendientes (o las indicadas).
+
+    Devuelve las filas (modelo, cultivo_id, temporada) guardadas.
+    """
+    parametros = {}
+    if temporadas:
+        condicion = 'r.temporada = ANY(:temporadas)'
+        parametros['temporadas'] = list(temporadas)
+    else:
+        condicion = 'TRUE' if recalcular else _TEMPORADAS_PENDIENTES
+    filas = db.session.execute(text(_SQL_PREDICCIONES_REALES.format(temporadas=condicion)), parametros).all()
+    if not filas:
+        return []
+
+    resumen = errores(pd.DataFrame(filas, columns=COLUMNAS))
+    resumen['fecha_calculo'] = datetime.utcnow()
+    valores = [{
+        'modelo': fila.modelo,
+        'cultivo_id': int(fila.cultivo_id),
+        'temporada': fila.temporada,
+        'predicciones': int(fila.predicciones),
+        'suma_error_absoluto': float(fila.suma_error_absoluto),
+        'suma_error_cuadratico': float(fila.suma_error_cuadratico),
+        'con_rango': int(fila.con_rango),
+        'dentro_rango': int(fila.dentro_rango),
+        'fecha_calculo': fila.fecha_calculo.to_pydatetime()
+    } for fila in resumen.itertuples(index=False)]
+
+    tabla = BacktestingTemporada.__table__
+    sentencia = insert(tabla).values(valores)
+    db.session.execute(sentencia.on_conflict_do_update(
+        index_elements=[tabla.c.modelo, tabla.c.cultivo_id, tabla.c.temporada],
+        set_={columna: sentencia.excluded[columna] for columna in (
+            'predicciones', 'suma_error_absoluto', 'suma_error_cuadratico', 'con_rango', 'dentro_rango',
+            'fecha_calculo')}
+    ))
+    db.session.commit()
+    return [(v['modelo'], v['cultivo_id'], v['temporada']) for v in valores]
+
+def metricas(cultivo_id=None, modelo=None):
+    """MAE, RMSE y cobertura del rango por modelo y cultivo, combinando las temporadas guardadas"""
+    query = db.session.query(
+        BacktestingTemporada.modelo,
+        BacktestingTemporada.cultivo_id,
+        db.func.count().label('temporadas'),
+        db.func.sum(BacktestingTemporada.predicciones).label('predicciones'),
+        db.func.sum(BacktestingTemporada.suma_error_absoluto).label('suma_error_absoluto'),
+        db.func.sum(BacktestingTemporada.suma_error_cuadratico).label('suma_error_cuadratico'),
+        db.func.sum(BacktestingTemporada.con_rango).label('con_rango'),
+        db.func.sum(BacktestingTemporada.dentro_rango).label('dentro_rango')
+    )
+    if cultivo_id:
+        query = query.filter(BacktestingTemporada.cultivo_id == cultivo_id)
+    if modelo:
+        query = query.filter(BacktestingTemporada.modelo == modelo)
+    grupos = query.group_by(BacktestingTemporada.modelo, BacktestingTemporada.cultivo_id).order_by(
+        BacktestingTemporada.cultivo_id, BacktestingTemporada.modelo
+    ).all()
+
+    return [{
+        'modelo': grupo.modelo,
+        'cultivo_id': grupo.cultivo_id,
+        'temporadas': grupo.temporadas,
+        'predicciones': int(grupo.predicciones),
+        'mae': grupo.suma_error_absoluto / grupo.predicciones,
+        'rmse': float(np.sqrt(grupo.suma_error_cuadratico / grupo.predicciones)),
+        'cobertura_rango': grupo.dentro_rango / grupo.con_rango if grupo.con_rango else None
+    } for grupo in grupos]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Backtesting de predicciones contra la producción real')
+    parser.add_argument('--temporada', action='append',
+                        help='Recalcular esta temporada (puede repetirse)')
+    parser.add_argument('--recalcular', action='store_true',
+                        help='Recalcular todas las temporadas, no solo las pendientes')
+    args = parser.parse_args(argv)
+
+    from app import app
+    with app.app_context():
+        guardadas = ejecutar(args.temporada, args.recalcular)
+    temporadas = sorted({temporada for _, _, temporada in guardadas})
+    print(f"{len(guardadas)} resultados guardados ({', '.join(temporadas) or 'sin temporadas pendientes'})")
+
+if __name__ == '__main__':
+    main()
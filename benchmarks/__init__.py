@@ -0,0 +1 @@
+# Paquete de benchmarks de rendimiento para la API de Control Agrícola
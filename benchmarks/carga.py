@@ -0,0 +1,230 @@
+"""Generador de carga concurrente con una mezcla ponderada de tráfico realista.
+
+Uso:
+    python app.py   # o el servidor de producción, en otra terminal
+    python -m benchmarks.carga --url http://localhost:5000 --tasa 200 --duracion 30 --salida carga.json
+
+Envía peticiones a ritmo constante (carga en lazo abierto: el envío no espera a que
+terminen las anteriores) y mide la latencia desde el instante programado, de modo que
+las esperas por saturación del servidor también cuentan. Se ejecuta en dos fases, sin
+y con tráfico de análisis, para ver si las predicciones y estadísticas pesadas
+degradan las operaciones CRUD. Requiere datos cargados (por ejemplo con benchmarks.datos).
+"""
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# clase: 'crud' (tablets de campo y altas) o 'analitica' (tableros y predicciones)
+Operacion = namedtuple('Operacion', ['nombre', 'peso', 'clase', 'metodo', 'ruta', 'cuerpo'])
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, round(p / 100 * (len(ordenados) - 1))))]
+
+def mezcla(muestra):
+    """Operaciones con su peso relativo; ruta y cuerpo son funciones del generador aleatorio"""
+    codigos, parcelas = muestra['codigos'], muestra['parcelas']
+    return [
+        Operacion('parcela_por_codigo', 60, 'crud', 'GET',
+                  lambda a: f'/parcelas/codigo/{a.choice(codigos)}', None),
+        Operacion('parcela_detalle', 8, 'crud', 'GET',
+                  lambda a: f'/parcelas/{a.choice(parcelas)[0]}', None),
+        Operacion('produccion_parcela', 8, 'crud', 'GET',
+                  lambda a: f'/produccion/series-temporales/{a.choice(parcelas)[0]}', None),
+        Operacion('registrar_produccion', 6, 'crud', 'POST', lambda a: '/produccion/', _cuerpo_produccion(parcelas)),
+        Operacion('tablero_parcelas', 6, 'analitica', 'GET', lambda a: '/parcelas/estadisticas', None),
+        Operacion('tablero_general', 6, 'analitica', 'GET', lambda a: '/analisis/estadisticas-generales', None),
+        Operacion('clasificacion', 4, 'analitica', 'GET', lambda a: '/analisis/clasificacion-rendimiento', None),
+        Operacion('prediccion_random_forest', 2, 'analitica', 'POST',
+                  lambda a: '/analisis/predicciones/crear', _cuerpo_prediccion(parcelas))
+    ]
+
+def _cuerpo_produccion(parcelas):
+    def cuerpo(aleatorio):
+        parcela_id, cultivo_id = aleatorio.choice(parcelas)
+        return {
+            'parcela_id': parcela_id, 'cultivo_id': cultivo_id, 'fecha_registro': '2024-03-01',
+            'temporada': '2024-1', 'cantidad_kg': round(aleatorio.uniform(1000, 50000), 2),
+            'temperatura_promedio': round(aleatorio.uniform(12, 34), 1)
+        }
+    return cuerpo
+
+def _cuerpo_prediccion(parcelas):
+    def cuerpo(aleatorio):
+        parcela_id, cultivo_id = aleatorio.choice(parcelas)
+        return {'parcela_id': parcela_id, 'cultivo_id': cultivo_id, 'temporada_objetivo': '2025-1',
+                'modelo': 'random_forest'}
+    return cuerpo
+
+class Cliente:
+    """Conexiones HTTP persistentes, una por hilo"""
+
+    def __init__(self, url, timeout):
+        partes = urlsplit(url)
+        self.host, self.puerto = partes.hostname, partes.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conexion(self):
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            conexion = self._local.conexion = http.client.HTTPConnection(self.host, self.puerto, timeout=self.timeout)
+        return conexion
+
+    def pedir(self, metodo, ruta, cuerpo=None):
+        datos = json.dumps(cuerpo).encode() if cuerpo is not None else None
+        cabeceras = {'Content-Type': 'application/json'} if datos else {}
+        conexion = self._conexion()
+        try:
+            conexion.request(metodo, ruta, body=datos, headers=cabeceras)
+            respuesta = conexion.getresponse()
+            respuesta.read()
+            return respuesta.status
+        except (OSError, http.client.HTTPException):
+            conexion.close()
+            self._local.conexion = None
+            raise
+
+def obtener_muestra(cliente, maximo=1000):
+    """Códigos e ids de parcelas existentes para construir las peticiones"""
+    conexion = http.client.HTTPConnection(cliente.host, cliente.puerto, timeout=60)
+    conexion.request('GET', '/parcelas/')
+    parcelas = json.loads(conexion.getresponse().read())
+    conexion.close()
+    parcelas = [p for p in parcelas if p.get('cultivo_id')][:maximo]
+    if not parcelas:
+        raise SystemExit('No hay parcelas con cultivo asignado: cargue datos con benchmarks.datos')
+    return {
+        'codigos': [p['codigo'] for p in parcelas],
+        'parcelas': [(p['id'], p['cultivo_id']) for p in parcelas]
+    }
+
+def ejecutar_fase(cliente, operaciones, tasa, duracion, concurrencia, semilla):
+    """Lanzar peticiones a `tasa` por segundo durante `duracion` segundos"""
+    aleatorio = random.Random(semilla)
+    pesos = [op.peso for op in operaciones]
+    mediciones = {op.nombre: [] for op in operaciones}
+    errores = {op.nombre: {} for op in operaciones}
+    lock = threading.Lock()
+
+    def ejecutar(operacion, ruta, cuerpo, programado):
+        try:
+            estado = cliente.pedir(operacion.metodo, ruta, cuerpo)
+        except Exception as e:
+            estado = type(e).__name__
+        # Latencia desde el instante programado: incluye la espera en cola si el servidor no da abasto
+        latencia = time.perf_counter() - programado
+        with lock:
+            mediciones[operacion.nombre].append(latencia)
+            # Los 4xx (p. ej. parcela sin registros) son respuestas válidas; se cuentan errores 5xx y fallos de red
+            if not (isinstance(estado, int) and estado < 500):
+                errores[operacion.nombre][str(estado)] = errores[operacion.nombre].get(str(estado), 0) + 1
+
+    total = int(tasa * duracion)
+    intervalo = 1.0 / tasa
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        for i in range(total):
+            programado = inicio + i * intervalo
+            espera = programado - time.perf_counter()
+            if espera > 0:
+                time.sleep(espera)
+            operacion = aleatorio.choices(operaciones, weights=pesos)[0]
+            cuerpo = operacion.cuerpo(aleatorio) if operacion.cuerpo else None
+            ejecutor.submit(ejecutar, operacion, operacion.ruta(aleatorio), cuerpo, programado)
+    transcurrido = time.perf_counter() - inicio
+
+    return resumir(operaciones, mediciones, errores, transcurrido, tasa)
+
+def _estadisticas(latencias, errores, transcurrido):
+    cantidad = len(latencias)
+    cantidad_errores = sum(errores.values())
+    return {
+        'peticiones': cantidad,
+        'por_segundo': round(cantidad / transcurrido, 2),
+        'errores': cantidad_errores,
+        'tasa_error': round(cantidad_errores / cantidad, 4) if cantidad else 0.0,
+        'latencia_ms': {
+            'p50': round(percentil(latencias, 50) * 1000, 2),
+            'p95': round(percentil(latencias, 95) * 1000, 2),
+            'p99': round(percentil(latencias, 99) * 1000, 2),
+            'max': round(max(latencias) * 1000, 2)
+        } if latencias else None
+    }
+
+def resumir(operaciones, mediciones, errores, transcurrido, tasa):
+    por_ruta = {}
+    por_clase = {}
+    for op in operaciones:
+        por_ruta[op.nombre] = dict(_estadisticas(mediciones[op.nombre], errores[op.nombre], transcurrido),
+                                   clase=op.clase, codigos_error=errores[op.nombre])
+        clase = por_clase.setdefault(op.clase, {'latencias': [], 'errores': {}})
+        clase['latencias'].extend(mediciones[op.nombre])
+        for codigo, cantidad in errores[op.nombre].items():
+            clase['errores'][codigo] = clase['errores'].get(codigo, 0) + cantidad
+
+    todas = [l for valores in mediciones.values() for l in valores]
+    todos_errores = {}
+    for valores in errores.values():
+        for codigo, cantidad in valores.items():
+            todos_errores[codigo] = todos_errores.get(codigo, 0) + cantidad
+    return {
+        'tasa_objetivo': tasa,
+        'duracion_s': round(transcurrido, 2),
+        'total': _estadisticas(todas, todos_errores, transcurrido),
+        'por_clase': {nombre: _estadisticas(c['latencias'], c['errores'], transcurrido) for nombre, c in por_clase.items()},
+        'por_ruta': por_ruta
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--tasa', type=float, default=100, help='Peticiones por segundo')
+    parser.add_argument('--duracion', type=float, default=30, help='Segundos por fase')
+    parser.add_argument('--concurrencia', type=int, default=200, help='Peticiones en vuelo como máximo')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--fases', default='sin_analitica,con_analitica',
+                        help='Fases a ejecutar: sin_analitica, con_analitica o ambas')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, salida estándar)')
+    args = parser.parse_args(argv)
+
+    cliente = Cliente(args.url, args.timeout)
+    operaciones = mezcla(obtener_muestra(cliente))
+
+    resultado = {'url': args.url, 'concurrencia': args.concurrencia, 'fases': {}}
+    for fase in args.fases.split(','):
+        seleccion = [op for op in operaciones if fase == 'con_analitica' or op.clase == 'crud']
+        print(f'Fase {fase}: {args.tasa} peticiones/s durante {args.duracion} s', file=sys.stderr)
+        resultado['fases'][fase] = ejecutar_fase(
+            cliente, seleccion, args.tasa, args.duracion, args.concurrencia, args.semilla
+        )
+
+    # Degradación del tráfico CRUD cuando hay análisis en curso
+    fases = resultado['fases']
+    if 'sin_analitica' in fases and 'con_analitica' in fases:
+        base = fases['sin_analitica']['por_clase']['crud']['latencia_ms']
+        con = fases['con_analitica']['por_clase']['crud']['latencia_ms']
+        if base and con:
+            resultado['degradacion_crud'] = {
+                percentil_nombre: round(con[percentil_nombre] / base[percentil_nombre], 2) if base[percentil_nombre] else None
+                for percentil_nombre in ('p50', 'p95', 'p99')
+            }
+
+    salida = json.dumps(resultado, indent=2)
+    if args.salida:
+        with open(args.salida, 'w') as archivo:
+            archivo.write(salida)
+    else:
+        print(salida)
+    return resultado
+
+if __name__ == '__main__':
+    main()
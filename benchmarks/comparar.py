@@ -0,0 +1,69 @@
+"""Comparar dos resultados de benchmarks.rutas y señalar regresiones.
+
+Uso:
+    python -m benchmarks.comparar base.json nuevo.json --umbral 0.2
+
+Empareja rutas por escala, ruta, método y variante, y compara la latencia p50, las
+consultas SQL por petición y el pico de memoria. Sale con código 1 si alguna métrica
+empeora más que el umbral relativo (20% por defecto), para poder usarlo en CI.
+"""
+import argparse
+import json
+import sys
+
+METRICAS = (
+    ('latencia_p50_ms', lambda r: r['latencia_ms']['p50']),
+    ('consultas_sql_por_peticion', lambda r: r['consultas_sql_por_peticion']),
+    ('pico_memoria_kb', lambda r: r['pico_memoria_kb'])
+)
+
+def _indexar(resultado):
+    indice = {}
+    for escala in resultado['escalas']:
+        for ruta in escala['rutas']:
+            indice[(escala['registros'], ruta['ruta'], ruta['metodo'], ruta['variante'])] = ruta
+    return indice
+
+def comparar(base, nuevo, umbral):
+    indice_base = _indexar(base)
+    filas, regresiones = [], []
+    for clave, ruta in sorted(_indexar(nuevo).items()):
+        anterior = indice_base.get(clave)
+        if anterior is None:
+            continue
+        for nombre, obtener in METRICAS:
+            valor_base, valor_nuevo = obtener(anterior), obtener(ruta)
+            cambio = (valor_nuevo - valor_base) / valor_base if valor_base else 0.0
+            fila = {
+                'registros': clave[0], 'ruta': clave[1], 'metodo': clave[2], 'variante': clave[3],
+                'metrica': nombre, 'base': valor_base, 'nuevo': valor_nuevo, 'cambio': round(cambio, 4)
+            }
+            filas.append(fila)
+            if cambio > umbral:
+                regresiones.append(fila)
+    return filas, regresiones
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('base')
+    parser.add_argument('nuevo')
+    parser.add_argument('--umbral', type=float, default=0.2, help='Empeoramiento relativo tolerado')
+    args = parser.parse_args(argv)
+
+    with open(args.base) as archivo:
+        base = json.load(archivo)
+    with open(args.nuevo) as archivo:
+        nuevo = json.load(archivo)
+
+    filas, regresiones = comparar(base, nuevo, args.umbral)
+    print(json.dumps({
+        'base': base.get('commit'),
+        'nuevo': nuevo.get('commit'),
+        'umbral': args.umbral,
+        'regresiones': regresiones,
+        'comparaciones': len(filas)
+    }, indent=2))
+    return 1 if regresiones else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""Generador determinista de datos sintéticos para benchmarks.
+
+Uso:
+    DATABASE_URL=postgresql://... python -m benchmarks.datos --registros 1000000 --borrar-datos
+
+Crea las tablas si no existen, las vacía y carga cultivos, parcelas, registros de
+producción y predicciones con COPY por bloques. Requiere PostgreSQL: el esquema usa
+JSONB, secuencias e índices GIN/BRIN. Con la misma semilla y las mismas cantidades el
+contenido generado es idéntico.
+"""
+import argparse
+import csv
+import io
+import json
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from models import db, Cultivo, Parcela, RegistroProduccion, PrediccionCosecha
+import invalidacion
+import sincronizacion
+import versiones
+
+TAMANO_BLOQUE = 50000
+FECHA_BASE = datetime(2024, 1, 1)
+INICIO_REGISTROS = date(2018, 1, 1)
+DIAS_REGISTROS = 7 * 365
+
+TIPOS_CULTIVO = ('cereales', 'hortalizas', 'frutales', 'leguminosas', 'tubérculos')
+NOMBRES_CULTIVO = ('Maíz', 'Trigo', 'Arroz', 'Tomate', 'Papa', 'Frijol', 'Café', 'Cacao', 'Mango', 'Aguacate')
+TIPOS_SUELO = ('arcilloso', 'arenoso', 'limoso', 'franco')
+CALIDADES = ('A', 'B', 'C')
+
+def escala(registros):
+    """Cantidades de cada tabla para un número de registros de producción"""
+    parcelas = max(100, registros // 200)
+    return {
+        'cultivos': 50,
+        'parcelas': parcelas,
+        'registros': registros,
+        'predicciones': parcelas
+    }
+
+def temporada_de(fecha):
+    return f'{fecha.year}-{1 if fecha.month <= 6 else 2}'
+
+def filas_cultivos(cantidad, aleatorio):
+    for i in range(1, cantidad + 1):
+        nombre = NOMBRES_CULTIVO[(i - 1) % len(NOMBRES_CULTIVO)]
+        yield {
+            'id': i,
+            'nombre': f'{nombre} {i:03d}',
+            'variedad': f'Variedad {aleatorio.randint(1, 20)}',
+            'tipo': TIPOS_CULTIVO[(i - 1) % len(TIPOS_CULTIVO)],
+            'ciclo_dias': aleatorio.randint(60, 365),
+            'rendimiento_esperado': round(aleatorio.uniform(2000, 12000), 2),
+            'descripcion': None,
+            'activo': True,
+            'fecha_creacion': FECHA_BASE
+        }
+
+def filas_parcelas(cantidad, cultivos, aleatorio):
+    for i in range(1, cantidad + 1):
+        siembra = INICIO_REGISTROS + timedelta(days=aleatorio.randint(0, DIAS_REGISTROS))
+        yield {
+            'id': i,
+            'codigo': f'P{i:07d}',
+            'nombre': f'Parcela {i}',
+            'area_hectareas': round(aleatorio.uniform(0.5, 50), 2),
+            'ubicacion_lat': round(aleatorio.uniform(-4, 12), 6),
+            'ubicacion_lng': round(aleatorio.uniform(-79, -67), 6),
+            'tipo_suelo': aleatorio.choice(TIPOS_SUELO),
+            'ph_suelo': round(aleatorio.uniform(4.5, 8.5), 2),
+            'cultivo_id': aleatorio.randint(1, cultivos),
+            'fecha_siembra': siembra,
+            'fecha_cosecha_estimada': siembra + timedelta(days=aleatorio.randint(60, 365)),
+            'activa': aleatorio.random() < 0.95,
+            'fecha_creacion': FECHA_BASE
+        }
+
+def filas_registros(cantidad, parcelas, aleatorio, rendimientos, cultivo_de, area_de):
+    for i in range(1, cantidad + 1):
+        parcela_id = aleatorio.randint(1, parcelas)
+        cultivo_id = cultivo_de[parcela_id]
+        fecha = INICIO_REGISTROS + timedelta(days=aleatorio.randint(0, DIAS_REGISTROS))
+        esperado = rendimientos[cultivo_id]
+        rendimiento = max(0.0, aleatorio.gauss(esperado, esperado * 0.15))
+        desviacion = rendimiento - esperado
+        yield {
+            'id': i,
+            'parcela_id': parcela_id,
+            'cultivo_id': cultivo_id,
+            'fecha_registro': fecha,
+            'temporada': temporada_de(fecha),
+            'cantidad_kg': round(rendimiento * area_de[parcela_id], 2),
+            'rendimiento_hectarea': round(rendimiento, 2),
+            'calidad': aleatorio.choice(CALIDADES),
+            'temperatura_promedio': round(aleatorio.uniform(12, 34), 1),
+            'precipitacion_mm': round(aleatorio.uniform(0, 250), 1),
+            'humedad_relativa': round(aleatorio.uniform(30, 95), 1),
+            'desviacion_esperada': round(desviacion, 2),
+            'anomalia_detectada': abs(desviacion) > esperado * 0.3,
+            'notas_anomalia': None,
+            'datos_adicionales': {'lote': f'L{aleatorio.randint(1, 500)}', 'riego': aleatorio.choice(('goteo', 'aspersion'))}
+                if aleatorio.random() < 0.2 else None,
+            'fecha_creacion': FECHA_BASE + timedelta(seconds=i)
+        }
+
+def filas_predicciones(cantidad, parcelas, aleatorio, rendimientos, cultivo_de):
+    for i in range(1, cantidad + 1):
+        parcela_id = (i - 1) % parcelas + 1
+        cultivo_id = cultivo_de[parcela_id]
+        predicho = max(0.0, aleatorio.gauss(rendimientos[cultivo_id], rendimientos[cultivo_id] * 0.1))
+        margen = predicho * aleatorio.uniform(0.05, 0.2)
+        yield {
+            'id': i,
+            'parcela_id': parcela_id,
+            'cultivo_id': cultivo_id,
+            'fecha_prediccion': date(2024, 6, 1),
+            'temporada_objetivo': '2025-1',
+            'rendimiento_predicho': round(predicho, 2),
+            'confianza_prediccion': round(aleatorio.uniform(0.3, 0.95), 3),
+            'rango_minimo': round(max(0.0, predicho - margen), 2),
+            'rango_maximo': round(predicho + margen, 2),
+            'modelo_utilizado': aleatorio.choice(('linear', 'random_forest')),
+            'parametros_modelo': {'sintetico': True},
+            'fecha_creacion': FECHA_BASE
+        }
+
+def _bloques(filas, tamano=TAMANO_BLOQUE):
+    bloque = []
+    for fila in filas:
+        bloque.append(fila)
+        if len(bloque) >= tamano:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+def _valor_csv(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, dict):
+        return json.dumps(valor)
+    return valor
+
+def _copiar(conexion_dbapi, tabla, filas):
+    """Cargar filas con COPY ... FROM STDIN en bloques de TAMANO_BLOQUE.
+
+    Solo se copian las columnas que emite el generador; el resto queda en NULL o con
+    su valor por defecto del servidor.
+    """
+    total = 0
+    with conexion_dbapi.cursor() as cursor:
+        for bloque in _bloques(filas):
+            columnas = [columna.name for columna in tabla.columns if columna.name in bloque[0]]
+            sentencia = f'COPY {tabla.name} ({", ".join(columnas)}) FROM STDIN WITH (FORMAT csv)'
+            buffer = io.StringIO()
+            escritor = csv.writer(buffer)
+            for fila in bloque:
+                escritor.writerow([_valor_csv(fila[columna]) for columna in columnas])
+            buffer.seek(0)
+            cursor.copy_expert(sentencia, buffer)
+            total += len(bloque)
+    return total
+
+def generar(cultivos, parcelas, registros, predicciones, semilla=42):
+    """Vaciar las tablas y cargar datos sintéticos; requiere contexto de aplicación y PostgreSQL"""
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        raise ValueError(f'El generador requiere PostgreSQL (DATABASE_URL apunta a {engine.dialect.name})')
+    db.create_all()
+    aleatorio = random.Random(semilla)
+    tablas = [Cultivo.__table__, Parcela.__table__, RegistroProduccion.__table__, PrediccionCosecha.__table__]
+    tiempos = {}
+
+    # Datos de referencia necesarios para generar registros coherentes
+    lista_cultivos = list(filas_cultivos(cultivos, aleatorio))
+    lista_parcelas = list(filas_parcelas(parcelas, cultivos, aleatorio))
+    rendimientos = {c['id']: c['rendimiento_esperado'] for c in lista_cultivos}
+    cultivo_de = {p['id']: p['cultivo_id'] for p in lista_parcelas}
+    area_de = {p['id']: p['area_hectareas'] for p in lista_parcelas}
+
+    contenido = (
+        (Cultivo.__table__, lista_cultivos),
+        (Parcela.__table__, lista_parcelas),
+        (RegistroProduccion.__table__, filas_registros(registros, parcelas, aleatorio, rendimientos, cultivo_de, area_de)),
+        (PrediccionCosecha.__table__, filas_predicciones(predicciones, parcelas, aleatorio, rendimientos, cultivo_de))
+    )
+
+    with engine.begin() as conexion:
+        conexion.execute(text('TRUNCATE {} RESTART IDENTITY CASCADE'.format(
+            ', '.join([t.name for t in tablas] + ['cambios', 'eventos_anomalia']))))
+
+        for tabla, filas in contenido:
+            inicio = time.perf_counter()
+            total = _copiar(conexion.connection.dbapi_connection, tabla, filas)
+            # COPY con ids explícitos no avanza la secuencia
+            conexion.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{tabla.name}', 'id'), GREATEST(MAX(id), 1)) FROM {tabla.name}"
+            ))
+            tiempos[tabla.name] = {'filas': total, 'segundos': round(time.perf_counter() - inicio, 3)}
+
+        # COPY no pasa por el ORM: anotar las filas cargadas para /sync
+        inicio = time.perf_counter()
+        total = sincronizacion.inicializar(conexion)
+        tiempos['cambios'] = {'filas': total, 'segundos': round(time.perf_counter() - inicio, 3)}
+
+        # Nuevos ETag de catálogo y caches vacías en los servidores en marcha (tras el commit)
+        for tabla in versiones.TABLAS_VERSIONADAS:
+            versiones.incrementar_version(conexion, tabla)
+        for modelo in invalidacion.MODELOS_OBSERVADOS:
+            invalidacion.notificar_todo(conexion, modelo.__tablename__)
+
+    # El NOTIFY propio no vuelve a este proceso
+    for modelo in invalidacion.MODELOS_OBSERVADOS:
+        invalidacion.despachar({'tabla': modelo.__tablename__, 'todo': True})
+
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conexion:
+        conexion.execute(text('ANALYZE'))
+    return tiempos
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--registros', type=int, default=10000)
+    parser.add_argument('--cultivos', type=int)
+    parser.add_argument('--parcelas', type=int)
+    parser.add_argument('--predicciones', type=int)
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--borrar-datos', action='store_true', help='Confirmar que se vaciarán las tablas existentes')
+    args = parser.parse_args(argv)
+    if not args.borrar_datos:
+        parser.error('el generador vacía las tablas de DATABASE_URL; confirme con --borrar-datos')
+
+    cantidades = escala(args.registros)
+    for nombre in ('cultivos', 'parcelas', 'predicciones'):
+        if getattr(args, nombre) is not None:
+            cantidades[nombre] = getattr(args, nombre)
+
+    from app import app
+    with app.app_context():
+        try:
+            tiempos = generar(semilla=args.semilla, **cantidades)
+        except ValueError as e:
+            parser.error(str(e))
+    print(json.dumps({'cantidades': cantidades, 'carga': tiempos}, indent=2))
+
+if __name__ == '__main__':
+    main()
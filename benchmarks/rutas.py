@@ -0,0 +1,308 @@
+"""Benchmark de todas las rutas de la API a varias escalas de datos.
+
+Uso:
+    DATABASE_URL=postgresql://.../control_agricola_bench \\
+        python -m benchmarks.rutas --escalas 10000,1000000,10000000 --borrar-datos --salida resultados.json
+
+Para cada escala vacía la base de datos, la carga con benchmarks.datos y mide cada
+ruta registrada por los namespaces de routes/*.py con el cliente de pruebas de Flask
+(sin red ni servidor WSGI): latencia (p50/p95/p99), rendimiento secuencial, consultas
+SQL por petición y pico de memoria asignada (tracemalloc, en una petición aparte).
+El resultado es JSON e incluye el commit actual para comparar ejecuciones con
+benchmarks.comparar. Un escenario con alguna respuesta 4xx/5xx no se mide: queda en
+`fallidas` con el estado y el inicio del cuerpo.
+"""
+import argparse
+import json
+import platform
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from urllib.parse import urlencode
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from benchmarks.datos import escala, generar
+from cache import caches
+
+# Rutas que cambian datos: solo se miden con --escrituras
+METODOS_ESCRITURA = ('PUT', 'DELETE')
+
+_contador_consultas = [0]
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _contar_consulta(conn, cursor, statement, parameters, context, executemany):
+    _contador_consultas[0] += 1
+
+def _muestra(app, registros):
+    """Valores de ejemplo presentes en los datos generados"""
+    from sqlalchemy import func
+    from models import db, Cultivo, Parcela, RegistroProduccion
+    with app.app_context():
+        parcela = Parcela.query.get(1)
+        cultivo = Cultivo.query.get(1)
+        cultivo_parcela = parcela.cultivo_id
+        # Cuerpos completos para los PUT: los handlers leen todos los campos obligatorios
+        cuerpo_cultivo = {campo: getattr(cultivo, campo) for campo in (
+            'nombre', 'variedad', 'tipo', 'ciclo_dias', 'rendimiento_esperado')}
+        cuerpo_parcela = {campo: getattr(parcela, campo) for campo in (
+            'codigo', 'nombre', 'area_hectareas', 'ubicacion_lat', 'ubicacion_lng', 'tipo_suelo', 'ph_suelo', 'cultivo_id')}
+        cuerpo_parcela.update(fecha_siembra=parcela.fecha_siembra and parcela.fecha_siembra.isoformat(),
+                              fecha_cosecha_estimada=parcela.fecha_cosecha_estimada and parcela.fecha_cosecha_estimada.isoformat())
+        # Los dos cultivos con más registros, para que la comparación tenga muestras
+        cultivos = [fila[0] for fila in db.session.query(RegistroProduccion.cultivo_id).group_by(
+            RegistroProduccion.cultivo_id
+        ).order_by(func.count().desc()).limit(2)]
+        db.session.remove()
+    return {
+        'cultivo_id': 1,
+        'parcela_id': 1,
+        'cultivo_parcela': cultivo_parcela,
+        'cultivos_comparados': cultivos,
+        'registro_id': max(1, registros // 2),
+        'codigo': 'P0000001',
+        'temporada': '2022-1',
+        'cuerpo_cultivo': cuerpo_cultivo,
+        'cuerpo_parcela': cuerpo_parcela
+    }
+
+def escenarios(m):
+    """Variantes por (regla, método): nombre, parámetros de consulta, cuerpo JSON y límite de escala.
+
+    Los cuerpos pueden ser funciones del número de iteración para generar claves únicas.
+    Las rutas que no aparecen aquí se miden sin parámetros (GET) si sus argumentos de
+    ruta están en la muestra.
+    """
+    ids_lote = list(range(1, 101))
+    return {
+        ('/cultivos/buscar', 'GET'): [
+            ('difuso', {'q': 'maiz'}, None, None),
+            ('prefijo', {'q': 'ma', 'modo': 'prefijo'}, None, None)
+        ],
+        ('/parcelas/', 'GET'): [('completo', {}, None, 1000000)],
+        ('/parcelas/lote', 'GET'): [('100_ids', {'ids': ','.join(map(str, ids_lote))}, None, None)],
+        ('/parcelas/lote', 'POST'): [('100_ids', {}, {'ids': ids_lote}, None)],
+        ('/produccion/', 'GET'): [
+            ('por_parcela', {'parcela_id': m['parcela_id']}, None, None),
+            ('por_cultivo_temporada', {'cultivo_id': m['cultivo_id'], 'temporada': m['temporada']}, None, None),
+            ('sin_filtros', {}, None, 100000)
+        ],
+        ('/produccion/anomalias', 'GET'): [('todas', {}, None, 1000000)],
+        ('/analisis/predicciones', 'GET'): [
+            ('por_parcela', {'parcela_id': m['parcela_id']}, None, None),
+            ('todas', {}, None, 1000000)
+        ],
+        ('/telemetria/parcela/<int:parcela_id>', 'GET'): [('temperatura', {'metrica': 'temperatura'}, None, None)],
+        ('/analisis/clasificacion-rendimiento', 'GET'): [
+            ('todas', {}, None, None),
+            ('por_temporada', {'temporada': m['temporada']}, None, None)
+        ],
+        ('/analisis/comparar-variedades', 'POST'): [
+            ('todas_temporadas', {}, {'cultivo_id_1': m['cultivos_comparados'][0],
+                                      'cultivo_id_2': m['cultivos_comparados'][1]}, None),
+            ('por_temporada', {}, {'cultivo_id_1': m['cultivos_comparados'][0], 'cultivo_id_2': m['cultivos_comparados'][1],
+                                   'temporada': m['temporada']}, None)
+        ],
+        ('/analisis/predicciones/crear', 'POST'): [
+            (modelo, {}, {'parcela_id': m['parcela_id'], 'cultivo_id': m['cultivo_parcela'], 'temporada_objetivo': '2025-1',
+                          'modelo': modelo}, None)
+            for modelo in ('linear', 'random_forest')
+        ],
+        # Escrituras (POST de alta): solo con --escrituras
+        ('/cultivos/', 'POST'): [('alta', {}, lambda i: {
+            'nombre': f'Bench {i} {time.time_ns()}', 'variedad': 'bench', 'tipo': 'cereales',
+            'ciclo_dias': 120, 'rendimiento_esperado': 5000}, None)],
+        ('/parcelas/', 'POST'): [('alta', {}, lambda i: {
+            'codigo': f'B{time.time_ns() % 10**12}{i}'[:20], 'nombre': 'Bench', 'area_hectareas': 3.5,
+            'cultivo_id': m['cultivo_id']}, None)],
+        ('/produccion/', 'POST'): [('alta', {}, lambda i: {
+            'parcela_id': m['parcela_id'], 'cultivo_id': m['cultivo_parcela'], 'fecha_registro': '2024-03-01',
+            'temporada': '2024-1', 'cantidad_kg': 12000 + i, 'temperatura_promedio': 22}, None)],
+        ('/cultivos/<int:cultivo_id>', 'PUT'): [('actualizar', {}, dict(m['cuerpo_cultivo'], descripcion='bench'), None)],
+        ('/parcelas/<int:parcela_id>', 'PUT'): [('actualizar', {}, dict(m['cuerpo_parcela'], tipo_suelo='franco'), None)]
+    }
+
+ESCRITURAS = {('/cultivos/', 'POST'), ('/parcelas/', 'POST'), ('/produccion/', 'POST')}
+
+# Rutas que no se pueden medir como petición-respuesta
+SIN_MEDIR = {('/produccion/anomalias/stream', 'GET'): 'stream SSE (la respuesta no termina)'}
+
+def rutas_api(app, api):
+    """(regla, método) de las rutas registradas por los namespaces de la API"""
+    prefijos = tuple(f'{ns.name}_' for ns in api.namespaces if ns.name != 'default')
+    rutas = []
+    for regla in app.url_map.iter_rules():
+        if not regla.endpoint.startswith(prefijos):
+            continue
+        for metodo in sorted(regla.methods - {'HEAD', 'OPTIONS'}):
+            rutas.append((regla, metodo))
+    return sorted(rutas, key=lambda r: (r[0].rule, r[1]))
+
+class EscenarioFallido(Exception):
+    """Una petición del escenario respondió con un estado de error: no se mide"""
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+def medir(cliente, metodo, url, cuerpo, repeticiones, calentamiento):
+    def peticion(i):
+        datos = cuerpo(i) if callable(cuerpo) else cuerpo
+        return cliente.open(url, method=metodo, json=datos)
+
+    for cache in caches.values():
+        cache.limpiar()
+
+    inicio = time.perf_counter()
+    respuesta = peticion(0)
+    primera = time.perf_counter() - inicio
+    if respuesta.status_code >= 400:
+        raise EscenarioFallido(f'{respuesta.status_code}: {respuesta.get_data(as_text=True)[:200]}')
+    for i in range(1, calentamiento):
+        peticion(i)
+
+    latencias = []
+    estados = {}
+    consultas_inicio = _contador_consultas[0]
+    inicio_total = time.perf_counter()
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        respuesta = peticion(calentamiento + i)
+        latencias.append(time.perf_counter() - inicio)
+        estados[respuesta.status_code] = estados.get(respuesta.status_code, 0) + 1
+    total = time.perf_counter() - inicio_total
+    errores = {estado: cantidad for estado, cantidad in estados.items() if estado >= 400}
+    if errores:
+        raise EscenarioFallido(f'respuestas con error durante la medición: {errores}')
+    consultas = (_contador_consultas[0] - consultas_inicio) / repeticiones
+
+    tracemalloc.start()
+    peticion(calentamiento + repeticiones)
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'estados': {str(k): v for k, v in estados.items()},
+        'bytes_respuesta': len(respuesta.get_data()),
+        'primera_ms': round(primera * 1000, 3),
+        'latencia_ms': {
+            'min': round(min(latencias) * 1000, 3),
+            'p50': round(percentil(latencias, 50) * 1000, 3),
+            'p95': round(percentil(latencias, 95) * 1000, 3),
+            'p99': round(percentil(latencias, 99) * 1000, 3),
+            'max': round(max(latencias) * 1000, 3),
+            'media': round(sum(latencias) / len(latencias) * 1000, 3)
+        },
+        'peticiones_por_segundo': round(repeticiones / total, 2),
+        'consultas_sql_por_peticion': round(consultas, 2),
+        'pico_memoria_kb': round(pico / 1024, 1)
+    }
+
+def ejecutar_escala(app, api, registros, args):
+    cantidades = escala(registros)
+    with app.app_context():
+        carga = generar(semilla=args.semilla, **cantidades)
+
+    m = _muestra(app, registros)
+    definidos = escenarios(m)
+    filtro = re.compile(args.rutas) if args.rutas else None
+    cliente = app.test_client()
+    resultados, omitidas, fallidas = [], [], []
+
+    for regla, metodo in rutas_api(app, api):
+        clave = (regla.rule, metodo)
+        if filtro and not filtro.search(regla.rule):
+            continue
+        if clave in SIN_MEDIR:
+            omitidas.append({'ruta': regla.rule, 'metodo': metodo, 'motivo': SIN_MEDIR[clave]})
+            continue
+        if not args.escrituras and (metodo in METODOS_ESCRITURA or clave in ESCRITURAS):
+            omitidas.append({'ruta': regla.rule, 'metodo': metodo, 'motivo': 'escritura (usar --escrituras)'})
+            continue
+        variantes = definidos.get(clave)
+        if variantes is None:
+            if metodo != 'GET':
+                omitidas.append({'ruta': regla.rule, 'metodo': metodo, 'motivo': 'sin escenario definido'})
+                continue
+            variantes = [('base', {}, None, None)]
+        if any(argumento not in m for argumento in regla.arguments):
+            omitidas.append({'ruta': regla.rule, 'metodo': metodo, 'motivo': 'argumentos de ruta sin muestra'})
+            continue
+
+        ruta = regla.rule
+        for argumento in regla.arguments:
+            ruta = re.sub(rf'<(?:\w+:)?{argumento}>', str(m[argumento]), ruta)
+
+        for nombre, consulta, cuerpo, max_registros in variantes:
+            if max_registros is not None and registros > max_registros:
+                omitidas.append({'ruta': regla.rule, 'metodo': metodo, 'variante': nombre,
+                                 'motivo': f'solo hasta {max_registros} registros'})
+                continue
+            url = f'{ruta}?{urlencode(consulta)}' if consulta else ruta
+            print(f'[{registros}] {metodo} {url} ({nombre})', file=sys.stderr)
+            try:
+                medicion = medir(cliente, metodo, url, cuerpo, args.repeticiones, args.calentamiento)
+            except EscenarioFallido as e:
+                print(f'[{registros}] FALLIDO {metodo} {url} ({nombre}): {e}', file=sys.stderr)
+                fallidas.append({'ruta': regla.rule, 'metodo': metodo, 'variante': nombre, 'url': url, 'error': str(e)})
+                continue
+            resultados.append({'ruta': regla.rule, 'metodo': metodo, 'variante': nombre, 'url': url, **medicion})
+
+    return {'registros': registros, 'cantidades': cantidades, 'carga': carga, 'rutas': resultados, 'omitidas': omitidas,
+            'fallidas': fallidas}
+
+def _commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--escalas', default='10000', help='Registros de producción por escala, separados por coma')
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--calentamiento', type=int, default=2)
+    parser.add_argument('--rutas', help='Expresión regular para filtrar rutas')
+    parser.add_argument('--escrituras', action='store_true', help='Medir también altas y actualizaciones')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, salida estándar)')
+    parser.add_argument('--borrar-datos', action='store_true', help='Confirmar que se vaciarán las tablas existentes')
+    args = parser.parse_args(argv)
+    if not args.borrar_datos:
+        parser.error('el benchmark vacía las tablas de DATABASE_URL en cada escala; confirme con --borrar-datos')
+
+    from app import app, api
+
+    resultado = {
+        'commit': _commit_actual(),
+        'fecha': datetime.utcnow().isoformat(),
+        'entorno': {
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'motor': None
+        },
+        'parametros': {'repeticiones': args.repeticiones, 'calentamiento': args.calentamiento, 'semilla': args.semilla},
+        'escalas': []
+    }
+    with app.app_context():
+        from models import db
+        resultado['entorno']['motor'] = db.engine.dialect.name
+
+    for registros in (int(e) for e in args.escalas.split(',')):
+        resultado['escalas'].append(ejecutar_escala(app, api, registros, args))
+
+    salida = json.dumps(resultado, indent=2)
+    if args.salida:
+        with open(args.salida, 'w') as archivo:
+            archivo.write(salida)
+    else:
+        print(salida)
+    return resultado
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Microbenchmark de serialización de listados: to_dict() + marshal frente a SerializadorFilas.
+
+Uso:
+    python -m benchmarks.serializacion --filas 10000 --repeticiones 5
+
+No requiere base de datos: genera filas sintéticas en memoria. Mide solo el costo de
+serialización (la hidratación de objetos ORM del camino anterior no se incluye).
+"""
+import argparse
+import json
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from flask_restx import marshal
+
+from models import RegistroProduccion
+from routes.produccion import registro_response, serializador_registros
+
+def _generadores(aleatorio, i):
+    """Valor sintético de cada atributo de RegistroProduccion para la fila i"""
+    inicio = date(2020, 1, 1)
+    return {
+        'id': lambda: i + 1,
+        'parcela_id': lambda: aleatorio.randint(1, 500),
+        'cultivo_id': lambda: aleatorio.randint(1, 50),
+        'fecha_registro': lambda: inicio + timedelta(days=aleatorio.randint(0, 1500)),
+        'temporada': lambda: f'{2020 + aleatorio.randint(0, 4)}-{aleatorio.randint(1, 2)}',
+        'cantidad_kg': lambda: aleatorio.uniform(1000, 50000),
+        'rendimiento_hectarea': lambda: aleatorio.uniform(2000, 12000),
+        'calidad': lambda: aleatorio.choice(['A', 'B', 'C', None]),
+        'temperatura_promedio': lambda: aleatorio.uniform(10, 35),
+        'precipitacion_mm': lambda: aleatorio.uniform(0, 200),
+        'humedad_relativa': lambda: aleatorio.uniform(30, 90),
+        'anomalia_detectada': lambda: aleatorio.random() < 0.1,
+        'desviacion_esperada': lambda: aleatorio.uniform(-3000, 3000),
+        'datos_adicionales': lambda: aleatorio.choice([None, {'metodo_riego': aleatorio.choice(['goteo', 'aspersion'])}]),
+        'fecha_creacion': lambda: datetime(2024, 1, 1) + timedelta(seconds=i)
+    }
+
+def generar_filas(cantidad, semilla=42):
+    """Tuplas en el orden de serializador_registros.columnas (None en columnas sin generador)"""
+    aleatorio = random.Random(semilla)
+    nombres = [columna.key for columna in serializador_registros.columnas]
+    filas = []
+    for i in range(cantidad):
+        generadores = _generadores(aleatorio, i)
+        filas.append(tuple(generadores[nombre]() if nombre in generadores else None for nombre in nombres))
+    return filas
+
+def a_objetos(filas):
+    """Objetos RegistroProduccion transitorios equivalentes a las filas"""
+    nombres = [columna.key for columna in serializador_registros.columnas]
+    return [RegistroProduccion(**dict(zip(nombres, f))) for f in filas]
+
+def camino_anterior(objetos):
+    return json.dumps(marshal([o.to_dict() for o in objetos], registro_response)).encode()
+
+def camino_rapido(filas):
+    return serializador_registros.serializar(filas)
+
+def medir(funcion, argumento, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(argumento)
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--filas', type=int, default=10000)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    filas = generar_filas(args.filas)
+    objetos = a_objetos(filas)
+
+    t_anterior = medir(camino_anterior, objetos, args.repeticiones)
+    t_rapido = medir(camino_rapido, filas, args.repeticiones)
+
+    resultado = {
+        'filas': args.filas,
+        'to_dict_marshal': {'segundos': t_anterior, 'filas_por_segundo': args.filas / t_anterior},
+        'serializador_filas': {'segundos': t_rapido, 'filas_por_segundo': args.filas / t_rapido},
+        'aceleracion': t_anterior / t_rapido
+    }
+    print(json.dumps(resultado, indent=2))
+    return resultado
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Índice de búsqueda de cultivos en memoria basado en trigramas.
+
+Permite búsqueda tolerante a errores tipográficos (similitud de trigramas al estilo
+pg_trgm), autocompletado por prefijo y ranking por relevancia sin recorrer la tabla.
+El índice se reconstruye de forma perezosa cuando el bus de invalidación informa
+de escrituras en cultivos (en este u otro proceso).
+"""
+import bisect
+import threading
+import unicodedata
+from collections import defaultdict
+
+from invalidacion import suscribir
+from models import Cultivo
+
+def normalizar(texto):
+    """Minúsculas y sin tildes, para comparar 'Maíz' con 'maiz'"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower().strip()
+
+def trigramas(texto):
+    """Trigramas de cada palabra, con relleno como en pg_trgm ('  m', ' ma', 'mai', ...)"""
+    resultado = set()
+    for palabra in normalizar(texto).split():
+        palabra = f'  {palabra} '
+        resultado.update(palabra[i:i + 3] for i in range(len(palabra) - 2))
+    return resultado
+
+class IndiceTrigramas:
+    """Índice invertido trigrama -> ids de cultivos activos, más lista ordenada de palabras para prefijos"""
+
+    def __init__(self, umbral=0.5):
+        self.umbral = umbral
+        self._lock = threading.RLock()
+        self._lock_construccion = threading.Lock()
+        self._vigente = False
+        self._generacion = 0
+        self._documentos = {}
+        self._campos = {}
+        self._posting = defaultdict(set)
+        self._palabras = []
+
+    def invalidar(self):
+        with self._lock:
+            self._vigente = False
+            self._generacion += 1
+
+    def _construir(self):
+        generacion = self._generacion
+        cultivos = Cultivo.query.filter_by(activo=True).all()
+
+        documentos = {}
+        campos = {}
+        posting = defaultdict(set)
+        palabras = []
+        for cultivo in cultivos:
+            documentos[cultivo.id] = cultivo.to_dict()
+            campos[cultivo.id] = [
+                (normalizar(cultivo.nombre), trigramas(cultivo.nombre)),
+                (normalizar(cultivo.variedad), trigramas(cultivo.variedad))
+            ]
+            for texto, trigramas_campo in campos[cultivo.id]:
+                for trigrama in trigramas_campo:
+                    posting[trigrama].add(cultivo.id)
+                palabras.extend((palabra, cultivo.id) for palabra in texto.split())
+        palabras.sort()
+
+        with self._lock:
+            # Si hubo escrituras durante la construcción, se reconstruirá en la próxima búsqueda
+            self._documentos = documentos
+            self._campos = campos
+            self._posting = posting
+            self._palabras = palabras
+            self._vigente = generacion == self._generacion
+
+    def _asegurar_vigente(self):
+        if self._vigente:
+            return
+        # Una sola reconstrucción a la vez; el resto de hilos espera y reutiliza el resultado
+        with self._lock_construccion:
+            if not self._vigente:
+                self._construir()
+
+    def _puntuar(self, cultivo_id, consulta, trigramas_consulta):
+        mejor = 0.0
+        for texto, trigramas_campo in self._campos[cultivo_id]:
+            compartidos = len(trigramas_consulta & trigramas_campo)
+            if not compartidos:
+                continue
+            # Cobertura de la consulta (similar a word_similarity) y similitud de Jaccard
+            cobertura = compartidos / len(trigramas_consulta)
+            similitud = compartidos / len(trigramas_consulta | trigramas_campo)
+            puntaje = 0.7 * cobertura + 0.3 * similitud
+            if texto.startswith(consulta):
+                puntaje += 1.0
+            elif consulta in texto:
+                puntaje += 0.5
+            mejor = max(mejor, puntaje if cobertura >= self.umbral else 0.0)
+        return mejor
+
+    def buscar(self, consulta, tipo=None, limite=20):
+        """Búsqueda difusa: candidatos que comparten trigramas, ordenados por relevancia"""
+        self._asegurar_vigente()
+        consulta = normalizar(consulta)
+        trigramas_consulta = trigramas(consulta)
+        if not trigramas_consulta:
+            return []
+
+        with self._lock:
+            candidatos = set()
+            for trigrama in trigramas_consulta:
+                candidatos.update(self._posting.get(trigrama, ()))
+
+            resultados = []
+            for cultivo_id in candidatos:
+                documento = self._documentos[cultivo_id]
+                if tipo and documento['tipo'] != tipo:
+                    continue
+                puntaje = self._puntuar(cultivo_id, consulta, trigramas_consulta)
+                if puntaje > 0:
+                    resultados.append((puntaje, documento))
+
+        resultados.sort(key=lambda r: (-r[0], r[1]['nombre']))
+        return [dict(documento, relevancia=round(puntaje, 4)) for puntaje, documento in resultados[:limite]]
+
+    def autocompletar(self, prefijo, tipo=None, limite=10):
+        """Cultivos con alguna palabra de nombre o variedad que empieza por el prefijo"""
+        self._asegurar_vigente()
+        prefijo = normalizar(prefijo)
+        if not prefijo:
+            return []
+
+        with self._lock:
+            encontrados = {}
+            inicio = bisect.bisect_left(self._palabras, (prefijo,))
+            for palabra, cultivo_id in self._palabras[inicio:]:
+                if not palabra.startswith(prefijo):
+                    break
+                documento = self._documentos[cultivo_id]
+                if tipo and documento['tipo'] != tipo:
+                    continue
+                # Las coincidencias más cortas (más completas) tienen mayor relevancia
+                relevancia = len(prefijo) / len(palabra)
+                if normalizar(documento['nombre']).startswith(prefijo):
+                    relevancia += 1.0
+                encontrados[cultivo_id] = max(relevancia, encontrados.get(cultivo_id, 0))
+
+            resultados = sorted(
+                encontrados.items(),
+                key=lambda r: (-r[1], self._documentos[r[0]]['nombre'])
+            )[:limite]
+            return [dict(self._documentos[cultivo_id], relevancia=round(relevancia, 4)) for cultivo_id, relevancia in resultados]
+
+indice_cultivos = IndiceTrigramas()
+
+suscribir('cultivos', lambda evento: indice_cultivos.invalidar())
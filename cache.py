@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from cachetools import TTLCache
+
+# Registro de caches en proceso, indexado por nombre
+caches = {}
+
+def _escucha_activa():
+    # Importación diferida: invalidacion importa metricas, que importa este módulo
+    from invalidacion import escucha_activa
+    return escucha_activa()
+
+class CacheConsultas:
+    """Cache LRU con expiración (TTL) y contadores de aciertos/fallos, segura entre hilos.
+
+    Con `ttl_sin_escucha`, mientras el hilo de escucha de invalidación no está activo
+    (INVALIDACION_ESCUCHA=0 o pooler externo sin DATABASE_URL_DIRECTA) las entradas vencen
+    a esos segundos: las escrituras de otros procesos no llegan como invalidación.
+    """
+
+    def __init__(self, nombre, maxsize=1024, ttl=300, ttl_sin_escucha=None):
+        self.nombre = nombre
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttl_sin_escucha = ttl_sin_escucha
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.RLock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+        # Se incrementa en cada invalidación; evita guardar valores leídos antes de ella
+        self._generacion = 0
+
+    def obtener(self, clave):
+        """Retorna el valor almacenado o None si no está en cache"""
+        with self._lock:
+            entrada = self._cache.get(clave)
+            if (entrada is not None and self.ttl_sin_escucha is not None
+                    and time.monotonic() - entrada[1] > self.ttl_sin_escucha and not _escucha_activa()):
+                del self._cache[clave]
+                entrada = None
+            valor = entrada[0] if entrada is not None else None
+            if valor is None:
+                self.fallos += 1
+            else:
+                self.aciertos += 1
+            return valor
+
+    def generacion(self):
+        """Marca a capturar antes de leer de la base de datos, para pasarla a guardar()"""
+        with self._lock:
+            return self._generacion
+
+    def guardar(self, clave, valor, generacion=None):
+        """Guardar un valor; se descarta si hubo invalidaciones desde `generacion`"""
+        with self._lock:
+            if generacion is not None and generacion != self._generacion:
+                return
+            self._cache[clave] = (valor, time.monotonic())
+
+    def invalidar(self, *claves):
+        """Eliminar claves específicas de la cache"""
+        with self._lock:
+            self._generacion += 1
+            for clave in claves:
+                if self._cache.pop(clave, None) is not None:
+                    self.invalidaciones += 1
+
+    def limpiar(self):
+        """Vaciar completamente la cache"""
+        with self._lock:
+            self._generacion += 1
+            self.invalidaciones += len(self._cache)
+            self._cache.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'nombre': self.nombre,
+                'entradas': len(self._cache),
+                'capacidad': self.maxsize,
+                'ttl_segundos': self.ttl,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'invalidaciones': self.invalidaciones,
+                'tasa_aciertos': (self.aciertos / consultas) if consultas > 0 else 0.0
+            }
+
+def crear_cache(nombre, maxsize=1024, ttl=300, ttl_sin_escucha=None):
+    """Crear (o reutilizar) una cache registrada; tamaño y TTL configurables por entorno.
+
+    Las variables CACHE_<NOMBRE>_MAXSIZE y CACHE_<NOMBRE>_TTL sobrescriben los valores por defecto.
+    """
+    if nombre not in caches:
+        prefijo = f'CACHE_{nombre.upper()}'
+        caches[nombre] = CacheConsultas(
+            nombre,
+            maxsize=int(os.environ.get(f'{prefijo}_MAXSIZE', maxsize)),
+            ttl=float(os.environ.get(f'{prefijo}_TTL', ttl)),
+            ttl_sin_escucha=ttl_sin_escucha
+        )
+    return caches[nombre]
+
+def estadisticas_caches():
+    """Estadísticas de todas las caches registradas en este proceso"""
+    return [cache.estadisticas() for cache in caches.values()]
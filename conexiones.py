@@ -0,0 +1,102 @@
+"""Configuración e instrumentación del pool de conexiones a la base de datos.
+
+Las opciones del engine se leen del entorno (DB_POOL_SIZE, DB_MAX_OVERFLOW,
+DB_POOL_TIMEOUT, DB_POOL_PRE_PING, DB_POOL_RECYCLE). El pool registra cuánto espera
+cada petición para obtener una conexión y expone en /metrics las conexiones en uso y
+el overflow. Con DB_POOLER_EXTERNO=1 (PgBouncer u otro pooler en modo transacción) el
+pool local se desactiva y el hilo de LISTEN usa DATABASE_URL_DIRECTA.
+"""
+import logging
+import os
+import time
+import weakref
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+from metricas import registro
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_ESPERA = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0)
+
+espera_pool = registro.histograma(
+    'control_agricola_pool_espera_segundos', 'Tiempo de espera para obtener una conexión del pool',
+    buckets=BUCKETS_ESPERA)
+timeouts_pool = registro.contador(
+    'control_agricola_pool_timeouts_total', 'Peticiones que agotaron pool_timeout esperando una conexión')
+conexiones_en_uso = registro.medidor(
+    'control_agricola_pool_conexiones_en_uso', 'Conexiones prestadas por el pool')
+conexiones_libres = registro.medidor(
+    'control_agricola_pool_conexiones_libres', 'Conexiones abiertas disponibles en el pool')
+conexiones_overflow = registro.medidor(
+    'control_agricola_pool_overflow', 'Conexiones abiertas por encima de pool_size (negativo: pool sin llenar)')
+tamano_pool = registro.medidor(
+    'control_agricola_pool_tamano', 'pool_size configurado')
+
+_pools = weakref.WeakSet()
+
+class PoolInstrumentado(QueuePool):
+    """QueuePool que mide la espera de cada checkout"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _pools.add(self)
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timeouts_pool.incrementar()
+            raise
+        finally:
+            espera_pool.observar(time.perf_counter() - inicio)
+
+@registro.recolector
+def _recolectar_pool():
+    pools = list(_pools)
+    conexiones_en_uso.establecer(sum(p.checkedout() for p in pools))
+    conexiones_libres.establecer(sum(p.checkedin() for p in pools))
+    conexiones_overflow.establecer(sum(p.overflow() for p in pools))
+    tamano_pool.establecer(sum(p.size() for p in pools))
+
+def _entero(nombre, defecto):
+    return int(os.environ.get(nombre, defecto))
+
+def pooler_externo():
+    return os.environ.get('DB_POOLER_EXTERNO', '0') == '1'
+
+def opciones_engine(uri):
+    """SQLALCHEMY_ENGINE_OPTIONS para la URI de la base de datos"""
+    url = make_url(uri)
+    if url.get_backend_name() != 'postgresql':
+        return {}
+
+    opciones = {}
+    if url.get_driver_name() == 'psycopg':
+        # Los prepared statements de psycopg 3 no sobreviven a un pooler en modo transacción
+        opciones['connect_args'] = {'prepare_threshold': None}
+
+    if pooler_externo():
+        # El pooler externo ya reutiliza conexiones: mantener otro pool aquí solo retiene servidores
+        opciones['poolclass'] = NullPool
+        return opciones
+
+    opciones.update({
+        'poolclass': PoolInstrumentado,
+        'pool_size': _entero('DB_POOL_SIZE', 5),
+        'max_overflow': _entero('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': _entero('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _entero('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    })
+    return opciones
+
+def url_directa():
+    """URL para conexiones de sesión (LISTEN) que no pueden pasar por el pooler externo"""
+    url = os.environ.get('DATABASE_URL_DIRECTA')
+    if url is None and pooler_externo():
+        logger.warning('DB_POOLER_EXTERNO=1 sin DATABASE_URL_DIRECTA: LISTEN no funciona a través del pooler')
+    return url
@@ -0,0 +1,154 @@
+"""Registro de consultas lentas con captura asíncrona del plan de ejecución.
+
+Se activa con CONSULTAS_LENTAS_UMBRAL_MS. Cada sentencia que supera el umbral se guarda
+en un buffer circular (sentencia, parámetros, ruta de origen y duración) y un hilo en
+segundo plano obtiene su plan con EXPLAIN (ANALYZE, BUFFERS) en una transacción que se
+revierte. Solo las lecturas puras se ejecutan con ANALYZE: una sentencia que escribe
+(también un WITH con INSERT/UPDATE/DELETE, un SELECT ... FOR UPDATE o que consume
+secuencias) tomaría bloqueos frente a los escritores reales aunque se revierta, así que
+de ella se captura el plan estimado. Los registros se consultan en /admin/consultas-lentas;
+los valores de los parámetros no se exponen salvo con CONSULTAS_LENTAS_PARAMETROS=1.
+"""
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_contexto_hilo = threading.local()
+
+# Sentencias que admiten EXPLAIN (el DDL se registra sin plan)
+SENTENCIAS_EXPLICABLES = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'VALUES')
+
+# Palabras que indican que una sentencia SELECT/WITH escribe o bloquea filas
+_ESCRITURA = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|NEXTVAL|SETVAL|PG_NOTIFY)\b', re.IGNORECASE)
+
+def es_solo_lectura(sentencia):
+    """Si la sentencia puede ejecutarse con EXPLAIN ANALYZE sin escribir ni bloquear filas"""
+    comando = sentencia.lstrip().split(None, 1)[0].upper() if sentencia.strip() else ''
+    return comando in ('SELECT', 'WITH', 'VALUES') and not _ESCRITURA.search(sentencia)
+
+class RegistroConsultasLentas:
+    """Buffer circular de consultas lentas y cola de captura de planes"""
+
+    def __init__(self, umbral_ms, capacidad=200, capturar_plan=True, timeout_plan_ms=10000,
+                 mostrar_parametros=False):
+        self.umbral_ms = umbral_ms
+        self.capturar_plan = capturar_plan
+        self.mostrar_parametros = mostrar_parametros
+        self.timeout_plan_ms = timeout_plan_ms
+        self._registros = deque(maxlen=capacidad)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._cola = queue.Queue(maxsize=100)
+        self._hilo = None
+
+    def registrar(self, engine, sentencia, parametros, duracion_ms, executemany):
+        registro = {
+            'id': next(self._ids),
+            'fecha': datetime.utcnow().isoformat(),
+            'duracion_ms': round(duracion_ms, 3),
+            'sentencia': sentencia,
+            # Los valores pueden ser datos personales o secretos: solo se listan si se pide
+            'parametros': json.loads(json.dumps(parametros, default=str)) if self.mostrar_parametros else None,
+            'ruta': f'{request.method} {request.path}' if has_request_context() else None,
+            'endpoint': request.url_rule.rule if has_request_context() and request.url_rule else None,
+            'plan': None,
+            'estado_plan': 'pendiente'
+        }
+        with self._lock:
+            self._registros.append(registro)
+        logger.warning('Consulta lenta (%.1f ms) en %s: %s', duracion_ms, registro['ruta'], sentencia)
+
+        comando = sentencia.lstrip().split(None, 1)[0].upper() if sentencia.strip() else ''
+        if (not self.capturar_plan or executemany or engine.dialect.name != 'postgresql'
+                or comando not in SENTENCIAS_EXPLICABLES):
+            registro['estado_plan'] = 'omitido'
+            return
+        try:
+            self._cola.put_nowait((engine, registro, sentencia, parametros))
+            self._asegurar_hilo()
+        except queue.Full:
+            registro['estado_plan'] = 'omitido'
+
+    def _asegurar_hilo(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._capturar_planes, name='explain-consultas-lentas', daemon=True)
+            self._hilo.start()
+
+    def _capturar_planes(self):
+        _contexto_hilo.capturando = True
+        while True:
+            engine, registro, sentencia, parametros = self._cola.get()
+            try:
+                registro['plan'] = self._explicar(engine, sentencia, parametros)
+                registro['estado_plan'] = 'capturado'
+            except Exception as e:
+                registro['estado_plan'] = 'error'
+                registro['plan'] = str(e)
+
+    def _explicar(self, engine, sentencia, parametros):
+        opciones = 'ANALYZE, BUFFERS, FORMAT JSON' if es_solo_lectura(sentencia) else 'FORMAT JSON'
+        with engine.connect() as conexion:
+            transaccion = conexion.begin()
+            try:
+                conexion.exec_driver_sql(f'SET LOCAL statement_timeout = {int(self.timeout_plan_ms)}')
+                resultado = conexion.exec_driver_sql(f'EXPLAIN ({opciones}) {sentencia}', parametros)
+                return resultado.scalar()
+            finally:
+                # ANALYZE ejecuta la sentencia: nunca se confirma
+                transaccion.rollback()
+
+    def listar(self, limite=50):
+        with self._lock:
+            return list(reversed(self._registros))[:limite]
+
+    def limpiar(self):
+        with self._lock:
+            self._registros.clear()
+
+registro_consultas_lentas = None
+
+def activar_consultas_lentas():
+    """Activar el registro si CONSULTAS_LENTAS_UMBRAL_MS está definido.
+
+    CONSULTAS_LENTAS_CAPACIDAD (200) limita el buffer, CONSULTAS_LENTAS_EXPLAIN=0
+    desactiva la captura de planes y CONSULTAS_LENTAS_PARAMETROS=1 incluye los valores
+    de los parámetros en /admin/consultas-lentas.
+    """
+    global registro_consultas_lentas
+    umbral = os.environ.get('CONSULTAS_LENTAS_UMBRAL_MS')
+    if not umbral or registro_consultas_lentas is not None:
+        return registro_consultas_lentas
+
+    registro_consultas_lentas = RegistroConsultasLentas(
+        umbral_ms=float(umbral),
+        capacidad=int(os.environ.get('CONSULTAS_LENTAS_CAPACIDAD', 200)),
+        capturar_plan=os.environ.get('CONSULTAS_LENTAS_EXPLAIN', '1') == '1',
+        mostrar_parametros=os.environ.get('CONSULTAS_LENTAS_PARAMETROS', '0') == '1'
+    )
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        context.consulta_lenta_inicio = time.perf_counter()
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def _despues(conn, cursor, statement, parameters, context, executemany):
+        if getattr(_contexto_hilo, 'capturando', False):
+            return
+        duracion_ms = (time.perf_counter() - context.consulta_lenta_inicio) * 1000
+        if duracion_ms >= registro_consultas_lentas.umbral_ms:
+            registro_consultas_lentas.registrar(conn.engine, statement, parameters, duracion_ms, executemany)
+
+    return registro_consultas_lentas
@@ -0,0 +1,295 @@
+"""Instantánea precalculada del dashboard (KPIs, gráficos y alertas recientes).
+
+Un hilo por proceso recalcula el documento cada DASHBOARD_INTERVALO segundos. Solo
+un proceso lo calcula a la vez (pg_try_advisory_xact_lock) y lo guarda serializado en
+`instantaneas_dashboard`; los demás detectan la nueva fecha de generación y cargan el
+documento. Cada sección queda codificada en memoria, de modo que abrir el dashboard
+es una lectura de memoria sin consultas a la base de datos.
+"""
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import orjson
+from sqlalchemy import case, func, select, text
+from sqlalchemy.orm import Session
+
+from models import db, Cultivo, Parcela, RegistroProduccion, InstantaneaDashboard
+
+logger = logging.getLogger(__name__)
+
+NOMBRE = 'principal'
+SECCIONES = ('stats', 'kpis', 'graficos', 'alertas')
+# Clave del advisory lock que serializa el recálculo entre procesos
+CLAVE_BLOQUEO = 7301
+MAX_ALERTAS = 20
+
+# secciones: nombre -> bytes JSON ('completo' incluye todo el documento)
+Instantanea = namedtuple('Instantanea', ['fecha_generacion', 'secciones'])
+
+_actual = None
+_lock = threading.Lock()
+_hilo = None
+
+def intervalo_refresco():
+    return int(os.environ.get('DASHBOARD_INTERVALO', 60))
+
+def _porcentaje(parte, total):
+    return round(parte / total * 100, 2) if total else 0.0
+
+def _cambio(actual, anterior):
+    return round((actual - anterior) / anterior * 100, 2) if anterior else 0.0
+
+def _tendencia(cambio):
+    if abs(cambio) < 1:
+        return 'stable'
+    return 'up' if cambio > 0 else 'down'
+
+def calcular_documento(session, hoy=None):
+    """Calcular el documento completo del dashboard en un lote de consultas agregadas"""
+    hoy = hoy or date.today()
+    inicio_actual = hoy - timedelta(days=30)
+    inicio_anterior = hoy - timedelta(days=60)
+    R = RegistroProduccion
+    actual = R.fecha_registro > inicio_actual
+    anterior = (R.fecha_registro > inicio_anterior) & (R.fecha_registro <= inicio_actual)
+    eficiencia = R.rendimiento_hectarea / func.nullif(Cultivo.rendimiento_esperado, 0) * 100
+
+    # Producción: totales y ventanas de 30 días en una sola pasada
+    p = session.query(
+        func.count(R.id).label('registros'),
+        func.coalesce(func.sum(R.cantidad_kg), 0).label('produccion'),
+        func.avg(R.rendimiento_hectarea).label('rendimiento'),
+        func.count(R.id).filter(R.anomalia_detectada == True).label('anomalias'),
+        func.avg(eficiencia).label('eficiencia'),
+        func.coalesce(func.sum(R.cantidad_kg).filter(actual), 0).label('produccion_actual'),
+        func.coalesce(func.sum(R.cantidad_kg).filter(anterior), 0).label('produccion_anterior'),
+        func.avg(R.rendimiento_hectarea).filter(actual).label('rendimiento_actual'),
+        func.avg(R.rendimiento_hectarea).filter(anterior).label('rendimiento_anterior'),
+        func.count(R.id).filter(actual & (R.anomalia_detectada == True)).label('anomalias_actual'),
+        func.count(R.id).filter(anterior & (R.anomalia_detectada == True)).label('anomalias_anterior'),
+        func.avg(eficiencia).filter(actual).label('eficiencia_actual'),
+        func.avg(eficiencia).filter(anterior).label('eficiencia_anterior')
+    ).join(Cultivo, R.cultivo_id == Cultivo.id).one()
+
+    parcelas = session.query(
+        func.count(Parcela.id).label('total'),
+        func.count(Parcela.id).filter(Parcela.activa == True).label('activas'),
+        func.coalesce(func.sum(Parcela.area_hectareas), 0).label('area_total'),
+        func.coalesce(func.sum(Parcela.area_hectareas).filter(
+            (Parcela.activa == True) & Parcela.cultivo_id.isnot(None)
+        ), 0).label('area_cultivada')
+    ).one()
+    total_cultivos = session.query(func.count(Cultivo.id)).filter(Cultivo.activo == True).scalar()
+
+    calidades = dict(session.query(func.coalesce(R.calidad, 'Sin calidad'), func.count(R.id)).group_by(
+        func.coalesce(R.calidad, 'Sin calidad')
+    ).all())
+
+    mes = func.date_trunc('month', R.fecha_registro)
+    inicio_serie = date(hoy.year - 1, hoy.month, 1)
+    produccion_mensual = session.query(mes, func.sum(R.cantidad_kg)).filter(
+        R.fecha_registro >= inicio_serie
+    ).group_by(mes).order_by(mes).all()
+
+    por_cultivo = session.query(Cultivo.nombre, func.avg(R.rendimiento_hectarea)).join(
+        R, R.cultivo_id == Cultivo.id
+    ).group_by(Cultivo.id, Cultivo.nombre).order_by(func.avg(R.rendimiento_hectarea).desc()).limit(10).all()
+
+    por_temporada = session.query(R.temporada, func.sum(R.cantidad_kg)).group_by(R.temporada).order_by(
+        R.temporada.desc()
+    ).limit(8).all()
+
+    severidad = case(
+        (func.abs(R.desviacion_esperada) > Cultivo.rendimiento_esperado * 0.5, 'alta'),
+        else_='media'
+    )
+    alertas = session.query(
+        R.id, R.fecha_registro, R.rendimiento_hectarea, R.desviacion_esperada, R.notas_anomalia,
+        Parcela.id, Parcela.nombre, Parcela.codigo, Cultivo.nombre, severidad
+    ).join(Parcela, R.parcela_id == Parcela.id).join(Cultivo, R.cultivo_id == Cultivo.id).filter(
+        R.anomalia_detectada == True
+    ).order_by(R.fecha_registro.desc(), R.id.desc()).limit(MAX_ALERTAS).all()
+
+    cambio_produccion = _cambio(float(p.produccion_actual), float(p.produccion_anterior))
+    cambio_rendimiento = _cambio(float(p.rendimiento_actual or 0), float(p.rendimiento_anterior or 0))
+    cambio_anomalias = _cambio(p.anomalias_actual, p.anomalias_anterior)
+    cambio_eficiencia = _cambio(float(p.eficiencia_actual or 0), float(p.eficiencia_anterior or 0))
+
+    return {
+        'stats': {
+            'total_parcelas': parcelas.total,
+            'parcelas_activas': parcelas.activas,
+            'total_cultivos': total_cultivos,
+            'total_registros_produccion': p.registros,
+            'produccion_total_kg': float(p.produccion),
+            'rendimiento_promedio': float(p.rendimiento or 0),
+            'area_total_hectareas': float(parcelas.area_total),
+            'area_cultivada_hectareas': float(parcelas.area_cultivada),
+            'anomalias_detectadas': p.anomalias,
+            'porcentaje_anomalias': _porcentaje(p.anomalias, p.registros),
+            'distribucion_calidades': calidades,
+            'crecimiento_mensual': cambio_produccion,
+            'eficiencia_promedio': round(float(p.eficiencia or 0), 2)
+        },
+        'kpis': [
+            {
+                'nombre': 'Producción (30 días)', 'valor': round(float(p.produccion_actual), 2), 'unidad': 'kg',
+                'tendencia': _tendencia(cambio_produccion), 'cambio_porcentual': cambio_produccion,
+                'descripcion': 'Producción registrada en los últimos 30 días'
+            },
+            {
+                'nombre': 'Rendimiento promedio', 'valor': round(float(p.rendimiento_actual or 0), 2), 'unidad': 'kg/ha',
+                'tendencia': _tendencia(cambio_rendimiento), 'cambio_porcentual': cambio_rendimiento,
+                'descripcion': 'Rendimiento por hectárea de los últimos 30 días'
+            },
+            {
+                'nombre': 'Eficiencia', 'valor': round(float(p.eficiencia_actual or 0), 2), 'unidad': '%',
+                'tendencia': _tendencia(cambio_eficiencia), 'cambio_porcentual': cambio_eficiencia,
+                'descripcion': 'Rendimiento obtenido frente al esperado por cultivo'
+            },
+            {
+                'nombre': 'Anomalías (30 días)', 'valor': p.anomalias_actual, 'unidad': '',
+                'tendencia': _tendencia(cambio_anomalias), 'cambio_porcentual': cambio_anomalias,
+                'descripcion': 'Registros con desviación significativa del rendimiento esperado'
+            }
+        ],
+        'graficos': {
+            'produccion_mensual': [
+                {'fecha': fecha.strftime('%Y-%m'), 'valor': float(valor)} for fecha, valor in produccion_mensual
+            ],
+            'rendimiento_por_cultivo': [
+                {'etiqueta': nombre, 'valor': float(valor)} for nombre, valor in por_cultivo
+            ],
+            'distribucion_calidades': [
+                {'etiqueta': calidad, 'valor': cantidad, 'porcentaje': _porcentaje(cantidad, p.registros)}
+                for calidad, cantidad in calidades.items()
+            ],
+            'produccion_por_temporada': [
+                {'etiqueta': temporada, 'valor': float(valor)} for temporada, valor in reversed(por_temporada)
+            ]
+        },
+        'alertas': [
+            {
+                'tipo': 'anomalia',
+                'severidad': a[9],
+                'titulo': f'Anomalía en {a[6]} ({a[7]})',
+                'descripcion': a[4] or (
+                    f'{a[8]}: rendimiento de {a[2]:.1f} kg/ha, {a[3] or 0:+.1f} kg/ha respecto al esperado'
+                ),
+                'fecha': a[1].isoformat(),
+                'registro_id': a[0],
+                'parcela_id': a[5]
+            } for a in alertas
+        ]
+    }
+
+def _codificar(texto, fecha_generacion):
+    documento = orjson.loads(texto)
+    secciones = {nombre: orjson.dumps(documento[nombre]) for nombre in SECCIONES}
+    secciones['completo'] = texto.encode() if isinstance(texto, str) else texto
+    return Instantanea(fecha_generacion, secciones)
+
+def refrescar(forzar=False, esperar=False):
+    """Recalcular y guardar la instantánea si está vencida; requiere contexto de aplicación.
+
+    Si otro proceso la está calculando retorna False sin esperar, salvo con esperar=True.
+    Retorna True si este proceso la recalculó.
+    """
+    intervalo = timedelta(seconds=intervalo_refresco())
+    with db.engine.begin() as conexion:
+        if conexion.dialect.name == 'postgresql':
+            if esperar:
+                conexion.execute(text('SELECT pg_advisory_xact_lock(:clave)'), {'clave': CLAVE_BLOQUEO})
+            elif not conexion.execute(text('SELECT pg_try_advisory_xact_lock(:clave)'), {'clave': CLAVE_BLOQUEO}).scalar():
+                return False
+        fecha = conexion.execute(
+            select(InstantaneaDashboard.fecha_generacion).where(InstantaneaDashboard.nombre == NOMBRE)
+        ).scalar()
+        ahora = datetime.utcnow()
+        if not forzar and fecha is not None and ahora - fecha < intervalo:
+            return False
+
+        inicio = time.perf_counter()
+        with Session(bind=conexion) as session:
+            documento = calcular_documento(session)
+        duracion_ms = (time.perf_counter() - inicio) * 1000
+        documento['generado'] = ahora.isoformat()
+        documento['duracion_ms'] = round(duracion_ms, 1)
+
+        conexion.execute(text(
+            'INSERT INTO instantaneas_dashboard (nombre, documento, fecha_generacion, duracion_ms) '
+            'VALUES (:nombre, :documento, :fecha, :duracion) '
+            'ON CONFLICT (nombre) DO UPDATE SET documento = EXCLUDED.documento, '
+            'fecha_generacion = EXCLUDED.fecha_generacion, duracion_ms = EXCLUDED.duracion_ms'
+        ), {'nombre': NOMBRE, 'documento': orjson.dumps(documento).decode(), 'fecha': ahora, 'duracion': duracion_ms})
+    logger.info('Instantánea del dashboard recalculada en %.1f ms', duracion_ms)
+    return True
+
+def sincronizar():
+    """Cargar la instantánea guardada si es más reciente que la de este proceso"""
+    global _actual
+    fecha = db.session.query(InstantaneaDashboard.fecha_generacion).filter(
+        InstantaneaDashboard.nombre == NOMBRE
+    ).scalar()
+    if fecha is None or (_actual is not None and _actual.fecha_generacion >= fecha):
+        db.session.remove()
+        return _actual
+    fila = db.session.get(InstantaneaDashboard, NOMBRE)
+    db.session.remove()
+    with _lock:
+        if _actual is None or _actual.fecha_generacion < fila.fecha_generacion:
+            _actual = _codificar(fila.documento, fila.fecha_generacion)
+    return _actual
+
+def obtener(seccion='completo'):
+    """Bytes JSON de una sección de la instantánea; requiere contexto de aplicación"""
+    instantanea = _actual
+    vencida = instantanea is not None and (
+        datetime.utcnow() - instantanea.fecha_generacion > timedelta(seconds=2 * intervalo_refresco())
+    )
+    if instantanea is None or (vencida and (_hilo is None or not _hilo.is_alive())):
+        # Sin hilo de refresco (o antes de su primera vuelta): recalcular en la petición
+        instantanea = sincronizar()
+        if instantanea is None or vencida:
+            refrescar(esperar=True)
+            instantanea = sincronizar()
+    return instantanea.secciones[seccion], instantanea.fecha_generacion
+
+class RefrescoDashboard(threading.Thread):
+    """Hilo que recalcula la instantánea cuando vence y carga las de otros procesos"""
+
+    def __init__(self, app, intervalo):
+        super().__init__(name='refresco-dashboard', daemon=True)
+        self.app = app
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+
+    def detener(self):
+        self._detener.set()
+
+    def run(self):
+        # Sondeo más frecuente que el intervalo para cargar pronto las instantáneas ajenas
+        sondeo = max(5, self.intervalo / 4)
+        while not self._detener.is_set():
+            try:
+                with self.app.app_context():
+                    refrescar()
+                    sincronizar()
+            except Exception:
+                logger.exception('Error al refrescar la instantánea del dashboard')
+            self._detener.wait(sondeo)
+
+def iniciar_refresco_dashboard(app):
+    """Iniciar el hilo de refresco de este proceso; se desactiva con DASHBOARD_REFRESCO=0"""
+    global _hilo
+    if os.environ.get('DASHBOARD_REFRESCO', '1') == '0':
+        return None
+    if _hilo is not None and _hilo.is_alive():
+        return _hilo
+    _hilo = RefrescoDashboard(app, intervalo_refresco())
+    _hilo.start()
+    return _hilo
@@ -0,0 +1,100 @@
+"""Filtros sobre RegistroProduccion.datos_adicionales (JSONB) e índices que los sirven.
+
+`filtro_datos` admite dos formas, y puede repetirse (se combinan con AND):
+    filtro_datos={"metodo_riego": "goteo"}   contención: datos_adicionales @> '{...}'
+    filtro_datos=fertilizacion.lote          la ruta existe: datos_adicionales @? '$."fertilizacion"."lote"'
+
+Ambos operadores usan el índice GIN jsonb_path_ops de la columna (que no admite el
+operador ?, por eso la existencia de claves se expresa como jsonpath). Las claves de
+primer nivel muy consultadas pueden declararse en DATOS_ADICIONALES_CLAVES_INDEXADAS
+para tener además un índice B-tree sobre (datos_adicionales->>'clave'); la contención
+de esas claves con un valor de texto agrega la igualdad correspondiente para que el
+planificador pueda usarlo. `python -m datos_adicionales --crear-indices` crea los
+índices en una base existente sin bloquear escrituras.
+"""
+import argparse
+import json
+import os
+import re
+
+from sqlalchemy import cast, literal_column, text
+from sqlalchemy.dialects.postgresql import JSONPATH
+
+from models import db, RegistroProduccion
+
+INDICE_GIN = 'idx_produccion_datos_adicionales'
+CLAVE_VALIDA = re.compile(r'^[A-Za-z0-9_]+$')
+
+def claves_indexadas():
+    """Claves de primer nivel con índice de expresión (DATOS_ADICIONALES_CLAVES_INDEXADAS)"""
+    claves = [c.strip() for c in os.environ.get('DATOS_ADICIONALES_CLAVES_INDEXADAS', '').split(',') if c.strip()]
+    invalidas = [c for c in claves if not CLAVE_VALIDA.match(c)]
+    if invalidas:
+        raise ValueError(f"Claves indexadas inválidas: {', '.join(invalidas)} (solo letras, números y _)")
+    return claves
+
+def _ruta_jsonpath(ruta):
+    partes = ruta.split('.')
+    if not all(partes):
+        raise ValueError(f'Ruta inválida en filtro_datos: {ruta}')
+    return '$' + ''.join('.' + json.dumps(parte) for parte in partes)
+
+def condiciones(filtros):
+    """Condiciones SQL para los valores de filtro_datos; lanza ValueError si alguno es inválido"""
+    columna = RegistroProduccion.datos_adicionales
+    indexadas = set(claves_indexadas())
+    resultado = []
+    for filtro in filtros:
+        filtro = filtro.strip()
+        if filtro.startswith('{'):
+            try:
+                documento = json.loads(filtro)
+            except ValueError:
+                raise ValueError(f'filtro_datos no es un JSON válido: {filtro}')
+            if not isinstance(documento, dict):
+                raise ValueError('filtro_datos de contención debe ser un objeto JSON')
+            for clave, valor in documento.items():
+                # Igualdad sobre la expresión indexada; la contención se verifica igual. La clave
+                # va literal (no como parámetro) para coincidir con la expresión del índice.
+                if clave in indexadas and isinstance(valor, str):
+                    resultado.append(literal_column(f"registros_produccion.datos_adicionales->>'{clave}'") == valor)
+            resultado.append(columna.contains(documento))
+        else:
+            resultado.append(columna.op('@?')(cast(_ruta_jsonpath(filtro), JSONPATH)))
+    return resultado
+
+def _nombre_indice(clave):
+    return f'idx_produccion_datos_{clave.lower()}'
+
+def sentencias_indices():
+    """CREATE INDEX CONCURRENTLY para el índice GIN y las claves indexadas declaradas"""
+    sentencias = [
+        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDICE_GIN} '
+        'ON registros_produccion USING gin (datos_adicionales jsonb_path_ops)'
+    ]
+    for clave in claves_indexadas():
+        sentencias.append(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {_nombre_indice(clave)} '
+            f"ON registros_produccion ((datos_adicionales->>'{clave}'))"
+        )
+    return sentencias
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Índices de datos_adicionales')
+    parser.add_argument('--crear-indices', action='store_true',
+                        help='Crear el índice GIN y los de DATOS_ADICIONALES_CLAVES_INDEXADAS')
+    args = parser.parse_args(argv)
+    if not args.crear_indices:
+        parser.print_help()
+        return
+
+    from app import app
+    with app.app_context():
+        # CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conexion:
+            for sentencia in sentencias_indices():
+                print(sentencia)
+                conexion.execute(text(sentencia))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Escritura agrupada (group commit) de registros de producción.
+
+Con ESCRITURA_AGRUPADA=1, POST /produccion/ valida el registro y lo deja en una cola
+del proceso en lugar de hacer su propio commit. Un hilo vacía la cola cada
+ESCRITURA_AGRUPADA_MS milisegundos, o antes si se juntan ESCRITURA_AGRUPADA_FILAS
+registros, con un único INSERT de varias filas y un solo commit; cada petición
+responde cuando ese commit confirma su registro. Con la cola llena
+(ESCRITURA_AGRUPADA_CAPACIDAD) la petición recibe 503 y Retry-After. Al terminar el
+proceso se escriben los registros pendientes.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import datetime
+
+from ingesta import insertar_filas
+from metricas import registro
+from models import db, RegistroProduccion
+
+logger = logging.getLogger(__name__)
+
+filas_por_lote = registro.histograma(
+    'control_agricola_escritura_lote_filas', 'Registros confirmados en cada commit agrupado',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+duracion_lote = registro.histograma(
+    'control_agricola_escritura_lote_segundos', 'Duración del INSERT y commit de cada lote')
+rechazos_cola = registro.contador(
+    'control_agricola_escritura_rechazos_total', 'Registros rechazados con 503 por cola llena')
+longitud_cola = registro.medidor(
+    'control_agricola_escritura_cola', 'Registros en espera de commit agrupado')
+
+class ColaLlena(Exception):
+    """La cola de escritura agrupada no admite más registros"""
+
+class EscrituraPendiente(Exception):
+    """El registro sigue en la cola tras el tiempo de espera: todavía puede confirmarse"""
+
+def activa():
+    return os.environ.get('ESCRITURA_AGRUPADA', '0') == '1'
+
+class EscrituraAgrupada(threading.Thread):
+    """Hilo que confirma los registros encolados en lotes"""
+
+    def __init__(self, app, intervalo_ms=10, max_filas=200, capacidad=5000):
+        super().__init__(name='escritura-agrupada', daemon=True)
+        self.app = app
+        self.intervalo = intervalo_ms / 1000
+        self.max_filas = max_filas
+        self.cola = queue.Queue(maxsize=capacidad)
+        self._detener = threading.Event()
+        # Encolar y detener se excluyen: tras detener no entra nada que el hilo no vaya a escribir
+        self._lock_encolar = threading.Lock()
+
+    def encolar(self, fila):
+        """Encolar una fila validada; devuelve un Future con el id tras el commit"""
+        futuro = Future()
+        with self._lock_encolar:
+            if self._detener.is_set():
+                raise ColaLlena('El proceso se está deteniendo')
+            try:
+                self.cola.put_nowait((fila, futuro))
+            except queue.Full:
+                rechazos_cola.incrementar()
+                raise ColaLlena('Cola de escritura llena')
+        return futuro
+
+    def _tomar_lote(self):
+        """Esperar el primer registro y juntar los que lleguen durante el intervalo"""
+        try:
+            lote = [self.cola.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        limite = time.monotonic() + self.intervalo
+        while len(lote) < self.max_filas:
+            restante = limite - time.monotonic()
+            try:
+                lote.append(self.cola.get(timeout=restante) if restante > 0 else self.cola.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _escribir(self, lote):
+        inicio = time.perf_counter()
+        filas = [fila for fila, _ in lote]
+        try:
+            ids = insertar_filas(db.session, filas)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception('Falló el commit agrupado de %s registros; se reintentan de a uno', len(lote))
+            self._escribir_individual(lote)
+            return
+        finally:
+            db.session.remove()
+        duracion_lote.observar(time.perf_counter() - inicio)
+        filas_por_lote.observar(len(lote))
+        for id_registro, (_, futuro) in zip(ids, lote):
+            futuro.set_result(id_registro)
+
+    def _escribir_individual(self, lote):
+        # Un registro inválido no debe hacer fallar a los demás del lote
+        for fila, futuro in lote:
+            try:
+                id_registro = insertar_filas(db.session, [fila])[0]
+                db.session.commit()
+                futuro.set_result(id_registro)
+            except Exception as e:
+                db.session.rollback()
+                futuro.set_exception(e)
+            finally:
+                db.session.remove()
+
+    def run(self):
+        with self.app.app_context():
+            while not (self._detener.is_set() and self.cola.empty()):
+                lote = self._tomar_lote()
+                if lote:
+                    self._escribir(lote)
+        # Registros encolados justo al detenerse: se rechazan en lugar de quedar sin respuesta
+        while True:
+            try:
+                _, futuro = self.cola.get_nowait()
+            except queue.Empty:
+                break
+            futuro.set_exception(ColaLlena('El proceso se está deteniendo'))
+
+    def detener(self, timeout=30):
+        """Dejar de aceptar registros y esperar a que se escriban los pendientes"""
+        with self._lock_encolar:
+            self._detener.set()
+        self.join(timeout)
+
+_escritor = None
+_lock = threading.Lock()
+
+def escritor(app):
+    """Hilo de escritura del proceso, iniciado en el primer uso (después del fork)"""
+    global _escritor
+    with _lock:
+        if _escritor is None or not _escritor.is_alive():
+            _escritor = EscrituraAgrupada(
+                app,
+                intervalo_ms=int(os.environ.get('ESCRITURA_AGRUPADA_MS', 10)),
+                max_filas=int(os.environ.get('ESCRITURA_AGRUPADA_FILAS', 200)),
+                capacidad=int(os.environ.get('ESCRITURA_AGRUPADA_CAPACIDAD', 5000))
+            )
+            _escritor.start()
+        return _escritor
+
+def crear_registro(app, fila, timeout=30):
+    """Encolar un registro validado y esperar su commit; devuelve el registro creado.
+
+    Lanza ColaLlena si no se encoló, y EscrituraPendiente si se encoló pero el commit no
+    llegó en `timeout` segundos (el registro puede guardarse igual).
+    """
+    fila = dict(fila, fecha_creacion=datetime.utcnow())
+    # No retener una conexión del pool mientras se espera al lote
+    db.session.close()
+    try:
+        id_registro = escritor(app).encolar(fila).result(timeout)
+    except FutureTimeout:
+        raise EscrituraPendiente(
+            'El registro sigue en cola y puede guardarse: antes de reintentar, comprobar que no '
+            'exista (o usar /produccion/ingesta con clave_idempotencia)')
+    return RegistroProduccion(id=id_registro, **fila)
+
+@registro.recolector
+def _recolectar_cola():
+    longitud_cola.establecer(_escritor.cola.qsize() if _escritor is not None else 0)
+
+@atexit.register
+def detener():
+    """Escribir los registros pendientes antes de terminar el proceso"""
+    if _escritor is not None and _escritor.is_alive():
+        _escritor.detener()
@@ -0,0 +1,69 @@
+"""Actualización idempotente del esquema de una base de datos existente.
+
+`db.create_all()` crea las tablas que faltan pero no agrega columnas ni índices a las
+que ya existen. `python -m esquema --actualizar` crea las tablas nuevas y aplica las
+columnas e índices agregados después, con IF NOT EXISTS: puede ejecutarse en cada
+despliegue. Los índices se crean con CONCURRENTLY para no bloquear las escrituras; si
+uno queda inválido por una interrupción, hay que borrarlo y volver a ejecutar.
+"""
+import argparse
+
+from sqlalchemy import text
+
+from models import db
+
+# Columnas agregadas a tablas existentes (ALTER TABLE, dentro de una transacción)
+COLUMNAS = [
+    # Ingesta idempotente (/produccion/ingesta)
+    'ALTER TABLE registros_produccion ADD COLUMN IF NOT EXISTS clave_idempotencia VARCHAR(100)',
+    'ALTER TABLE registros_produccion ADD COLUMN IF NOT EXISTS origen VARCHAR(50)',
+    # Marca de agua por transacción de /sync y del stream de anomalías
+    'ALTER TABLE cambios ADD COLUMN IF NOT EXISTS xid BIGINT NOT NULL DEFAULT 0',
+    'ALTER TABLE eventos_anomalia ADD COLUMN IF NOT EXISTS xid BIGINT NOT NULL DEFAULT 0'
+]
+
+# Índices (CONCURRENTLY, fuera de una transacción). El índice único lleva el nombre
+# que le da create_all a la restricción, así que en una base nueva no hace nada.
+INDICES = [
+    'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS registros_produccion_clave_idempotencia_key '
+    'ON registros_produccion (clave_idempotencia)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_cambios_xid ON cambios (xid, seq)',
+    'DROP INDEX CONCURRENTLY IF EXISTS ix_cambios_seq',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_eventos_anomalia_xid ON eventos_anomalia (xid, id)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_prediccion_ultima ON predicciones_cosecha '
+    '(parcela_id, cultivo_id, temporada_objetivo, fecha_prediccion DESC, id DESC)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_prediccion_historial ON predicciones_cosecha (fecha_prediccion, id)'
+]
+
+def actualizar(mostrar=None):
+    """Crear tablas faltantes y aplicar COLUMNAS e INDICES; requiere contexto de aplicación"""
+    db.create_all()
+    if db.engine.dialect.name != 'postgresql':
+        return
+    with db.engine.begin() as conexion:
+        for sentencia in COLUMNAS:
+            if mostrar:
+                mostrar(sentencia)
+            conexion.execute(text(sentencia))
+    # CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conexion:
+        for sentencia in INDICES:
+            if mostrar:
+                mostrar(sentencia)
+            conexion.execute(text(sentencia))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Actualizar el esquema de una base de datos existente')
+    parser.add_argument('--actualizar', action='store_true',
+                        help='Crear tablas nuevas y agregar las columnas e índices que falten')
+    args = parser.parse_args(argv)
+    if not args.actualizar:
+        parser.print_help()
+        return
+
+    from app import app
+    with app.app_context():
+        actualizar(mostrar=print)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""Stream de anomalías nuevas: tabla de eventos, NOTIFY y difusión en proceso.
+
+Cada flush que crea o actualiza un registro de producción con anomalia_detectada
+inserta una fila en `eventos_anomalia`, con el xid de su transacción, y publica un
+NOTIFY en la misma transacción. El NOTIFY solo despierta al hilo de escucha de cada
+proceso (ver invalidacion.escuchar_canal), que lee de la tabla los eventos nuevos en
+orden (xid, id) por debajo del horizonte de transacciones: como todas las anteriores ya
+terminaron, ese orden no cambia después y los escritores no se esperan entre sí. Los
+eventos quedan en un buffer circular en memoria y los clientes SSE abiertos esperan en
+una condición sin consultar la base de datos. El id SSE de cada evento es "xid-id"; un
+cliente que reconecta con Last-Event-ID recibe lo que se perdió, desde el buffer o
+desde la tabla.
+
+En gunicorn (gthread) cada stream abierto retiene un hilo del worker: por proceso se
+admiten como máximo ANOMALIAS_MAX_STREAMS (por defecto la mitad de GUNICORN_THREADS,
+para dejar hilos a las rutas CRUD) y los siguientes reciben 503. Para muchos paneles
+abiertos la ruta se sirve con servidor_stream.py, un proceso asyncio que atiende miles
+de conexiones sin un hilo por cliente.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import orjson
+from sqlalchemy import event, insert, literal_column, select, text, tuple_
+from sqlalchemy.orm import Session
+
+from invalidacion import XID_ACTUAL, escucha_activa, escuchar_canal, horizonte_transacciones
+from metricas import registro
+from models import db, RegistroProduccion, EventoAnomalia
+
+logger = logging.getLogger(__name__)
+
+CANAL = 'control_agricola_anomalias'
+CAPACIDAD_BUFFER = 1000
+# Eventos por consulta al leer de la tabla
+LOTE_REPOSICION = 500
+
+# Orden de las columnas del evento publicado (stream y reposición)
+COLUMNAS = ('id', 'registro_id', 'parcela_id', 'cultivo_id', 'fecha_registro',
+            'rendimiento_hectarea', 'desviacion_esperada', 'tipo', 'fecha_evento')
+
+streams_abiertos = registro.medidor(
+    'control_agricola_anomalias_streams', 'Streams SSE de anomalías abiertos en el proceso')
+streams_rechazados = registro.contador(
+    'control_agricola_anomalias_streams_rechazados_total', 'Streams SSE rechazados con 503 por superar el máximo')
+
+def intervalo_ping():
+    return float(os.environ.get('ANOMALIAS_PING', 15))
+
+def intervalo_sondeo():
+    return float(os.environ.get('ANOMALIAS_SONDEO', 5))
+
+def max_streams():
+    return int(os.environ.get('ANOMALIAS_MAX_STREAMS', max(1, int(os.environ.get('GUNICORN_THREADS', 4)) // 2)))
+
+def codificar(fila):
+    """Evento compacto en JSON a partir de una fila con el orden de COLUMNAS"""
+    return orjson.dumps(dict(zip(COLUMNAS, fila))).decode()
+
+def formatear_cursor(cursor):
+    return f'{cursor[0]}-{cursor[1]}'
+
+def leer_cursor(texto):
+    """Cursor (xid, id) desde un id SSE; lanza ValueError si no es válido.
+
+    Un número solo es un id de evento anterior al cursor por transacción: se busca su xid.
+    Devuelve None si ese evento ya no existe (el stream empieza desde ahora).
+    """
+    if '-' in texto:
+        xid, id_evento = texto.split('-', 1)
+        return int(xid), int(id_evento)
+    id_evento = int(texto)
+    xid = db.session.execute(select(EventoAnomalia.xid).where(EventoAnomalia.id == id_evento)).scalar()
+    db.session.remove()
+    return (xid, id_evento) if xid is not None else None
+
+class Difusor:
+    """Buffer circular de eventos recientes con espera para los suscriptores del proceso.
+
+    Los eventos se identifican por su cursor (xid, id). El buffer contiene todos los
+    posteriores a `base`; los anteriores solo están en la tabla. `base` es None hasta
+    la primera conexión de escucha.
+    """
+
+    def __init__(self, capacidad=CAPACIDAD_BUFFER):
+        self._condicion = threading.Condition()
+        self._eventos = deque()
+        self._capacidad = capacidad
+        self.base = None
+        self.ultimo = None
+        self._oyentes = []
+
+    def al_publicar(self, funcion):
+        """Registrar una función sin argumentos que se llama tras cada evento nuevo (debe ser rápida)"""
+        self._oyentes.append(funcion)
+
+    def iniciar(self, cursor):
+        with self._condicion:
+            if self.base is None:
+                self.base = self.ultimo = cursor
+
+    def publicar(self, cursor, datos):
+        with self._condicion:
+            # Los eventos llegan en orden de cursor; se descartan los repetidos
+            if self.base is None or cursor <= self.ultimo:
+                return
+            self._eventos.append((cursor, datos))
+            if len(self._eventos) > self._capacidad:
+                self.base = self._eventos.popleft()[0]
+            self.ultimo = cursor
+            self._condicion.notify_all()
+        for funcion in self._oyentes:
+            funcion()
+
+    def desde(self, cursor):
+        """Eventos posteriores al cursor, o None si ya salieron del buffer"""
+        with self._condicion:
+            if self.base is None or cursor < self.base:
+                return None
+            return [(c, datos) for c, datos in self._eventos if c > cursor]
+
+    def esperar(self, cursor, timeout):
+        """Bloquear hasta que haya un evento posterior al cursor o venza el timeout"""
+        with self._condicion:
+            return self._condicion.wait_for(
+                lambda: self.ultimo is not None and self.ultimo > cursor, timeout)
+
+difusor = Difusor()
+
+_SQL_SIGUIENTES = (
+    f"SELECT xid, {', '.join(COLUMNAS)} FROM eventos_anomalia "
+    'WHERE (xid, id) > (%s, %s) AND xid < pg_snapshot_xmin(pg_current_snapshot())::text::bigint '
+    'ORDER BY xid, id LIMIT %s'
+)
+
+def _sincronizar(conexion):
+    """En el hilo de escucha: fijar el punto de partida o leer los eventos nuevos ya definitivos"""
+    with conexion.cursor() as cursor:
+        if difusor.base is None:
+            cursor.execute('SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint')
+            difusor.iniciar((cursor.fetchone()[0], 0))
+            return
+        while True:
+            cursor.execute(_SQL_SIGUIENTES, (*difusor.ultimo, LOTE_REPOSICION))
+            filas = cursor.fetchall()
+            for fila in filas:
+                difusor.publicar((fila[0], fila[1]), codificar(fila[1:]))
+            if len(filas) < LOTE_REPOSICION:
+                break
+
+escuchar_canal(CANAL, _sincronizar)
+
+# Columnas del registro copiadas al evento
+CAMPOS_REGISTRO = ('parcela_id', 'cultivo_id', 'fecha_registro', 'rendimiento_hectarea', 'desviacion_esperada')
+
+def fila_evento(registro, registro_id, tipo):
+    """Valores del evento a partir de un dict con las columnas del registro"""
+    fila = {nombre: registro[nombre] for nombre in CAMPOS_REGISTRO}
+    fila.update(registro_id=registro_id, tipo=tipo)
+    return fila
+
+def registrar(session, filas):
+    """Insertar eventos en la transacción actual y avisar a los procesos tras el commit.
+
+    Se llama desde el after_flush; las escrituras masivas que no pasan por el ORM
+    deben llamarla con los registros anómalos que crean.
+    """
+    if not filas:
+        return
+    conexion = session.connection()
+    tabla = EventoAnomalia.__table__
+    if conexion.dialect.name != 'postgresql':
+        conexion.execute(insert(tabla), filas)
+        return
+    conexion.execute(insert(tabla).values(xid=literal_column(XID_ACTUAL)), filas)
+    # NOTIFY es transaccional y se entrega tras el commit; el mismo payload se envía una vez
+    conexion.execute(text("SELECT pg_notify(:canal, '')"), {'canal': CANAL})
+
+@event.listens_for(Session, 'after_flush')
+def _despues_flush(session, flush_context):
+    filas = []
+    ahora = datetime.utcnow()
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, RegistroProduccion) or not obj.anomalia_detectada:
+            continue
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        tipo = 'creado' if obj in session.new else 'actualizado'
+        valores = {nombre: getattr(obj, nombre) for nombre in CAMPOS_REGISTRO}
+        filas.append(dict(fila_evento(valores, obj.id, tipo), fecha_evento=ahora))
+    registrar(session, filas)
+
+def leer_tabla(cursor, limite=LOTE_REPOSICION):
+    tabla = EventoAnomalia.__table__
+    consulta = select(tabla.c.xid, *[tabla.c[nombre] for nombre in COLUMNAS]).where(
+        tuple_(tabla.c.xid, tabla.c.id) > tuple_(*cursor))
+    horizonte = horizonte_transacciones(db.session.connection())
+    if horizonte is not None:
+        consulta = consulta.where(tabla.c.xid < horizonte)
+    filas = db.session.execute(consulta.order_by(tabla.c.xid, tabla.c.id).limit(limite)).all()
+    # No retener una conexión del pool mientras el cliente espera
+    db.session.remove()
+    return [((fila[0], fila[1]), codificar(fila[1:])) for fila in filas]
+
+def inicio_tabla():
+    """Cursor desde el que empieza un stream nuevo cuando no hay escucha activa"""
+    conexion = db.session.connection()
+    horizonte = horizonte_transacciones(conexion)
+    if horizonte is not None:
+        cursor = (horizonte, 0)
+    else:
+        cursor = (0, conexion.execute(select(db.func.coalesce(db.func.max(EventoAnomalia.id), 0))).scalar())
+    db.session.remove()
+    return cursor
+
+_streams = 0
+_lock_streams = threading.Lock()
+
+def reservar_stream():
+    """Ocupar un lugar para un stream nuevo; False si el proceso ya tiene el máximo"""
+    global _streams
+    with _lock_streams:
+        if _streams >= max_streams():
+            streams_rechazados.incrementar()
+            return False
+        _streams += 1
+        return True
+
+def liberar_stream():
+    global _streams
+    with _lock_streams:
+        _streams -= 1
+
+@registro.recolector
+def _recolectar_streams():
+    streams_abiertos.establecer(_streams)
+
+def mensaje(cursor, datos):
+    return f'id: {formatear_cursor(cursor)}\nevent: anomalia\ndata: {datos}\n\n'
+
+def flujo(cursor=None):
+    """Generador de mensajes SSE desde el cursor (xid, id) (o desde ahora, si es None).
+
+    Con la escucha activa los eventos salen del buffer del proceso; sin ella (sin
+    PostgreSQL o detrás de un pooler sin DATABASE_URL_DIRECTA) se consulta la tabla
+    cada ANOMALIAS_SONDEO segundos.
+    """
+    yield 'retry: 5000\n\n'
+    if cursor is None:
+        cursor = difusor.ultimo if escucha_activa() and difusor.base is not None else inicio_tabla()
+
+    ultimo_envio = time.monotonic()
+    while True:
+        escuchando = escucha_activa()
+        eventos = difusor.desde(cursor) if escuchando else None
+        if eventos is None:
+            eventos = leer_tabla(cursor)
+        for cursor_evento, datos in eventos:
+            yield mensaje(cursor_evento, datos)
+            cursor = cursor_evento
+        if eventos:
+            ultimo_envio = time.monotonic()
+            continue
+
+        if escuchando:
+            hay_eventos = difusor.esperar(cursor, intervalo_ping())
+        else:
+            time.sleep(intervalo_sondeo())
+            hay_eventos = False
+        if not hay_eventos and time.monotonic() - ultimo_envio >= intervalo_ping():
+            # Comentario SSE: mantiene viva la conexión a través de proxies
+            yield ': ping\n\n'
+            ultimo_envio = time.monotonic()
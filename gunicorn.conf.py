@@ -0,0 +1,61 @@
+"""Configuración de gunicorn para producción: gunicorn -c gunicorn.conf.py wsgi:app
+
+Variables de entorno:
+    PORT / GUNICORN_BIND      dirección de escucha (por defecto 0.0.0.0:$PORT o :8000)
+    GUNICORN_WORKERS          procesos (por defecto, uno por núcleo)
+    GUNICORN_THREADS          hilos por proceso (por defecto 4)
+    GUNICORN_WORKER_CLASS     clase de worker (por defecto gthread)
+    GUNICORN_TIMEOUT          segundos antes de reiniciar un worker bloqueado (120)
+    GUNICORN_MAX_REQUESTS     reciclar cada worker tras N peticiones (0 = nunca)
+
+Cada worker abre hasta DB_POOL_SIZE + DB_MAX_OVERFLOW conexiones a la base de datos más
+una para LISTEN: workers * (pool + overflow + 1) debe quedar por debajo de max_connections
+(o usar un pooler externo, ver conexiones.py).
+
+Cada stream SSE abierto (/produccion/anomalias/stream) retiene un hilo del worker mientras
+espera eventos, sin conexión a la base de datos. Cada proceso admite ANOMALIAS_MAX_STREAMS
+(por defecto la mitad de GUNICORN_THREADS) y rechaza el resto con 503; los paneles se
+sirven con `python -m servidor_stream`, enrutado aparte en el proxy (ver README).
+"""
+import multiprocessing
+import os
+
+# Las rutas de análisis son intensivas en CPU: un proceso por núcleo evita que el GIL
+# serialice las predicciones, y los hilos cubren la espera de E/S de las rutas CRUD
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', 8000)}")
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Cargar la aplicación y las librerías pesadas antes del fork
+preload_app = True
+
+# numpy/scikit-learn abren un hilo por núcleo en cada worker; con un worker por núcleo
+# eso sobresuscribe la CPU. Debe fijarse antes de importar numpy (es decir, antes de la precarga).
+for variable in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(variable, '1')
+
+accesslog = '-'
+errorlog = '-'
+
+def post_fork(server, worker):
+    from app import app, iniciar_servicios
+    from models import db
+
+    # Las conexiones heredadas del maestro (si la carga de la aplicación abrió alguna) no deben usarse
+    # en el hijo: se descartan sin cerrarlas, porque el socket sigue siendo del maestro
+    with app.app_context():
+        db.engine.dispose(close=False)
+    iniciar_servicios(app)
+
+def worker_exit(server, worker):
+    # Confirmar los registros que esperan en la cola de escritura agrupada
+    from escritura_agrupada import detener
+    detener()
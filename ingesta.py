@@ -0,0 +1,201 @@
+"""Ingesta idempotente de registros de producción desde balanzas y monitores de rendimiento.
+
+Los equipos de campo reintentan los envíos cuando la conexión falla. Cada registro
+lleva una clave de idempotencia (propia del cliente o derivada de origen + parcela +
+fecha) y el lote se inserta con INSERT ... ON CONFLICT DO NOTHING: un reintento no
+crea filas nuevas y devuelve el id del registro que ya existía.
+"""
+from datetime import datetime
+
+from sqlalchemy import String
+from sqlalchemy.dialects.postgresql import insert
+
+import eventos_anomalia
+import sincronizacion
+from invalidacion import registrar_cambios
+from models import db, RegistroProduccion
+from referencias import referencia_parcela, referencia_cultivo
+from telemetria import completar_clima
+
+MAX_LOTE = 1000
+
+class RegistroInvalido(ValueError):
+    """Datos de un registro que no pueden guardarse"""
+
+# Longitud máxima de las columnas de texto de RegistroProduccion
+LONGITUDES = {
+    columna.name: columna.type.length for columna in RegistroProduccion.__table__.columns
+    if isinstance(columna.type, String) and columna.type.length
+}
+
+def validar_longitudes(valores):
+    """Lanzar RegistroInvalido si un texto supera la longitud de su columna (PostgreSQL rechazaría el INSERT)"""
+    for campo, longitud in LONGITUDES.items():
+        valor = valores.get(campo)
+        if isinstance(valor, str) and len(valor) > longitud:
+            raise RegistroInvalido(f'{campo} supera los {longitud} caracteres')
+
+def preparar_registro(data):
+    """Validar un registro y calcular rendimiento, desviación y anomalía.
+
+    Devuelve los valores de las columnas de RegistroProduccion; lanza RegistroInvalido
+    si la parcela o el cultivo no existen o no están activos, o si un texto no entra en
+    su columna.
+    """
+    # Validar que existan la parcela y el cultivo (cache de referencia en memoria)
+    parcela = referencia_parcela(data['parcela_id'])
+    if not parcela or not parcela.activa:
+        raise RegistroInvalido('La parcela especificada no existe o no está activa')
+
+    cultivo = referencia_cultivo(data['cultivo_id'])
+    if not cultivo or not cultivo.activo:
+        raise RegistroInvalido('El cultivo especificado no existe o no está activo')
+
+    # Calcular rendimiento por hectárea
+    rendimiento_hectarea = data['cantidad_kg'] / parcela.area_hectareas
+
+    # Calcular desviación del rendimiento esperado
+    desviacion_esperada = rendimiento_hectarea - cultivo.rendimiento_esperado
+
+    # Detectar anomalías (desviación mayor al 20% del rendimiento esperado)
+    umbral_anomalia = cultivo.rendimiento_esperado * 0.2
+    anomalia_detectada = abs(desviacion_esperada) > umbral_anomalia
+
+    valores = {
+        'parcela_id': data['parcela_id'],
+        'cultivo_id': data['cultivo_id'],
+        'fecha_registro': datetime.strptime(data['fecha_registro'], '%Y-%m-%d').date(),
+        'temporada': data['temporada'],
+        'cantidad_kg': data['cantidad_kg'],
+        'rendimiento_hectarea': rendimiento_hectarea,
+        'calidad': data.get('calidad'),
+        'temperatura_promedio': data.get('temperatura_promedio'),
+        'precipitacion_mm': data.get('precipitacion_mm'),
+        'humedad_relativa': data.get('humedad_relativa'),
+        'desviacion_esperada': desviacion_esperada,
+        'anomalia_detectada': anomalia_detectada,
+        'notas_anomalia': data.get('notas_anomalia'),
+        'datos_adicionales': data.get('datos_adicionales')
+    }
+    validar_longitudes(valores)
+    return valores
+
+def clave_idempotencia(data):
+    """Clave enviada por el cliente o, si falta, la clave natural origen:parcela:fecha"""
+    clave = data.get('clave_idempotencia')
+    if clave:
+        return str(clave)
+    if data.get('origen'):
+        return f"{data['origen']}:{data['parcela_id']}:{data['fecha_registro']}"
+    raise RegistroInvalido('Se requiere clave_idempotencia u origen')
+
+def preparar_lote(registros):
+    """Validar un lote. Devuelve (filas por clave, resultados por índice).
+
+    Los registros inválidos y las claves repetidas dentro del lote quedan resueltos en
+    los resultados; el resto espera a la inserción.
+    """
+    filas = {}
+    resultados = [None] * len(registros)
+    for indice, data in enumerate(registros):
+        try:
+            clave = clave_idempotencia(data)
+            if clave in filas:
+                resultados[indice] = {'indice': indice, 'estado': 'duplicado', 'clave_idempotencia': clave}
+                continue
+            fila = preparar_registro(data)
+            fila['clave_idempotencia'] = clave
+            fila['origen'] = data.get('origen')
+            validar_longitudes(fila)
+        except (RegistroInvalido, KeyError, TypeError, ValueError, ZeroDivisionError) as e:
+            error = f'Falta el campo {e}' if isinstance(e, KeyError) else str(e)
+            resultados[indice] = {'indice': indice, 'estado': 'rechazado', 'error': error}
+            continue
+        fila['fecha_creacion'] = datetime.utcnow()
+        filas[clave] = fila
+        resultados[indice] = {'indice': indice, 'estado': None, 'clave_idempotencia': clave}
+    return filas, resultados
+
+def sin_clima(valores):
+    """Si al registro le falta alguna condición ambiental (se completa con telemetría)"""
+    return any(valores[campo] is None for campo in ('temperatura_promedio', 'precipitacion_mm', 'humedad_relativa'))
+
+def _completar_clima(session, creados):
+    """Completar desde la telemetría el clima de las filas creadas: (id, valores) por fila"""
+    por_id = {id_registro: fila for id_registro, fila in creados if sin_clima(fila)}
+    for id_registro, clima in completar_clima(session, list(por_id)).items():
+        por_id[id_registro].update(zip(('temperatura_promedio', 'precipitacion_mm', 'humedad_relativa'), clima))
+
+def _publicar_creados(session, creados):
+    """Publicar las filas creadas por un INSERT masivo: (id, valores) por fila.
+
+    El INSERT masivo no pasa por el flush del ORM: publica a mano la invalidación, el
+    registro de cambios de /sync y los eventos de anomalía.
+    """
+    if not creados:
+        return
+    tabla = RegistroProduccion.__tablename__
+    ids = sorted(id_registro for id_registro, _ in creados)
+    registrar_cambios(session, tabla, ids)
+    sincronizacion.registrar(session, tabla, ids)
+    ahora = datetime.utcnow()
+    eventos_anomalia.registrar(session, [
+        dict(eventos_anomalia.fila_evento(fila, id_registro, 'creado'), fecha_evento=ahora)
+        for id_registro, fila in creados if fila['anomalia_detectada']
+    ])
+
+def insertar_lote(session, filas):
+    """Insertar las filas ignorando las claves existentes. Devuelve {clave: id} de las creadas"""
+    if not filas:
+        return {}
+    tabla = RegistroProduccion.__table__
+    sentencia = insert(tabla).values(list(filas.values())).on_conflict_do_nothing(
+        index_elements=[tabla.c.clave_idempotencia]
+    ).returning(tabla.c.id, tabla.c.clave_idempotencia)
+    creados = {clave: id_registro for id_registro, clave in session.execute(sentencia)}
+    filas_creadas = [(id_registro, filas[clave]) for clave, id_registro in creados.items()]
+    _completar_clima(session, filas_creadas)
+    _publicar_creados(session, filas_creadas)
+    return creados
+
+def insertar_filas(session, filas):
+    """Insertar filas sin clave de idempotencia en INSERT de varias filas; devuelve los ids en orden"""
+    if not filas:
+        return []
+    tabla = RegistroProduccion.__table__
+    sentencia = insert(tabla).returning(tabla.c.id, sort_by_parameter_order=True)
+    ids = list(session.execute(sentencia, filas).scalars())
+    _completar_clima(session, list(zip(ids, filas)))
+    _publicar_creados(session, list(zip(ids, filas)))
+    return ids
+
+def ids_existentes(session, claves):
+    """Ids de los registros ya guardados con estas claves"""
+    if not claves:
+        return {}
+    return dict(session.query(RegistroProduccion.clave_idempotencia, RegistroProduccion.id).filter(
+        RegistroProduccion.clave_idempotencia.in_(claves)
+    ))
+
+def ingerir(registros):
+    """Validar e insertar un lote en una transacción; devuelve el resultado por registro"""
+    filas, resultados = preparar_lote(registros)
+    creados = insertar_lote(db.session, filas)
+    existentes = ids_existentes(db.session, [c for c in filas if c not in creados] +
+                                [r['clave_idempotencia'] for r in resultados if r['estado'] == 'duplicado'])
+    db.session.commit()
+
+    for resultado in resultados:
+        clave = resultado.get('clave_idempotencia')
+        if resultado['estado'] is None:
+            resultado['estado'] = 'creado' if clave in creados else 'duplicado'
+        if clave is not None:
+            resultado['id'] = creados.get(clave) or existentes.get(clave)
+
+    return {
+        'recibidos': len(registros),
+        'creados': sum(1 for r in resultados if r['estado'] == 'creado'),
+        'duplicados': sum(1 for r in resultados if r['estado'] == 'duplicado'),
+        'rechazados': sum(1 for r in resultados if r['estado'] == 'rechazado'),
+        'resultados': resultados
+    }
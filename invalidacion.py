@@ -0,0 +1,268 @@
+"""Bus de invalidación de caches entre procesos mediante LISTEN/NOTIFY de PostgreSQL.
+
+Cada commit que modifica cultivos, parcelas o registros de producción publica un
+NOTIFY dentro de la misma transacción (se entrega solo si el commit tiene éxito).
+Cada proceso ejecuta un hilo que escucha el canal y desaloja las claves afectadas
+de sus caches locales; el propio proceso invalida sus caches en el after_commit.
+Otros módulos pueden atender canales propios con la misma conexión (escuchar_canal).
+"""
+import json
+import logging
+import os
+import select
+import socket
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from conexiones import pooler_externo, url_directa
+from models import db, Cultivo, Parcela, RegistroProduccion
+
+logger = logging.getLogger(__name__)
+
+CANAL = 'control_agricola_invalidacion'
+
+# xid de la transacción actual como bigint, para anotar filas de los registros de eventos
+XID_ACTUAL = 'pg_current_xact_id()::text::bigint'
+
+# Límite de payload de NOTIFY (8000 bytes); por encima se invalida la tabla completa
+MAX_PAYLOAD = 7900
+
+# Modelos cuyos cambios se publican en el bus
+MODELOS_OBSERVADOS = (Cultivo, Parcela, RegistroProduccion)
+
+# Manejadores locales por tabla: manejador(evento)
+_manejadores = defaultdict(list)
+
+# Funciones que se ejecutan dentro de la transacción al registrar cambios: funcion(session, tabla)
+_observadores_transaccion = []
+
+# Canales adicionales atendidos por el mismo hilo de escucha: canal -> sincronizar(conexion)
+_canales = {}
+
+_escucha = None
+
+def origen_proceso():
+    """Identificador del proceso actual (cambia tras un fork)"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def suscribir(tabla, manejador):
+    """Registrar una función que recibe los eventos de invalidación de una tabla.
+
+    El evento es un dict con 'tabla', 'ids' y 'codigos', o con 'todo': True cuando
+    deben descartarse todas las entradas derivadas de la tabla.
+    """
+    _manejadores[tabla].append(manejador)
+
+def escuchar_canal(canal, sincronizar):
+    """Atender otro canal NOTIFY con la conexión de escucha de este proceso.
+
+    sincronizar(conexion) recibe la conexión DBAPI en autocommit y lee lo nuevo de la
+    base de datos; el payload de la notificación solo despierta al hilo. Se llama al
+    quedar escuchando (también tras una reconexión), tras cada lote de notificaciones
+    del canal y en cada intervalo de sondeo sin ellas, para recoger lo que quedó detrás
+    del horizonte de transacciones. Debe registrarse antes de iniciar la escucha.
+    """
+    _canales[canal] = sincronizar
+
+def escucha_activa():
+    return _escucha is not None and _escucha.is_alive()
+
+def al_registrar_cambios(funcion):
+    """Registrar una función a ejecutar dentro de la transacción que modifica una tabla"""
+    _observadores_transaccion.append(funcion)
+    return funcion
+
+def despachar(evento):
+    """Entregar un evento a los manejadores locales de su tabla"""
+    for manejador in _manejadores.get(evento['tabla'], []):
+        try:
+            manejador(evento)
+        except Exception:
+            logger.exception('Error en manejador de invalidación para %s', evento['tabla'])
+
+def _despachar_todo():
+    """Invalidar todas las tablas suscritas (p. ej. tras perder eventos por una reconexión)"""
+    for tabla in list(_manejadores):
+        despachar({'tabla': tabla, 'todo': True})
+
+def _recolectar(session):
+    """Obtener las claves afectadas por el flush agrupadas por tabla"""
+    cambios = {}
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, MODELOS_OBSERVADOS):
+            continue
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        claves = cambios.setdefault(obj.__tablename__, {'ids': set(), 'codigos': set()})
+        if obj.id is not None:
+            claves['ids'].add(obj.id)
+        if isinstance(obj, Parcela):
+            # Incluir el código anterior si la parcela cambió de código
+            historial = inspect(obj).attrs.codigo.history
+            claves['codigos'].update(c for c in historial.deleted if c)
+            if obj.codigo:
+                claves['codigos'].add(obj.codigo)
+    return cambios
+
+def horizonte_transacciones(conexion):
+    """xid desde el que puede haber transacciones sin terminar (None sin PostgreSQL).
+
+    Toda transacción con xid menor ya terminó, así que las filas anotadas con su xid
+    (XID_ACTUAL) por debajo del horizonte son definitivas: un lector puede avanzar su
+    marca hasta aquí sin saltarse un commit más lento y sin bloquear a los escritores.
+    Una transacción larga (o abierta sin actividad) retiene el horizonte mientras dure.
+    """
+    if conexion.dialect.name != 'postgresql':
+        return None
+    return conexion.execute(text('SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint')).scalar()
+
+def registrar_cambios(session, tabla, ids=(), codigos=()):
+    """Acumular claves modificadas en la transacción actual y publicarlas en el bus"""
+    pendientes = session.info.setdefault('invalidacion_pendiente', {})
+    claves = pendientes.setdefault(tabla, {'ids': set(), 'codigos': set()})
+    claves['ids'].update(ids)
+    claves['codigos'].update(codigos)
+
+    for observador in _observadores_transaccion:
+        observador(session, tabla)
+
+    conexion = session.connection()
+    if conexion.dialect.name != 'postgresql':
+        return
+
+    evento = {
+        'origen': origen_proceso(),
+        'tabla': tabla,
+        'ids': sorted(ids),
+        'codigos': sorted(codigos)
+    }
+    payload = json.dumps(evento)
+    if len(payload) > MAX_PAYLOAD:
+        payload = json.dumps({'origen': evento['origen'], 'tabla': tabla, 'todo': True})
+
+    # NOTIFY es transaccional: se entrega al resto de procesos solo tras el commit
+    conexion.execute(text('SELECT pg_notify(:canal, :payload)'), {'canal': CANAL, 'payload': payload})
+
+def notificar_todo(conexion, tabla):
+    """Publicar en la transacción de `conexion` que toda la tabla cambió (TRUNCATE, COPY)"""
+    if conexion.dialect.name != 'postgresql':
+        return
+    payload = json.dumps({'origen': origen_proceso(), 'tabla': tabla, 'todo': True})
+    conexion.execute(text('SELECT pg_notify(:canal, :payload)'), {'canal': CANAL, 'payload': payload})
+
+@event.listens_for(Session, 'after_flush')
+def _despues_flush(session, flush_context):
+    for tabla, claves in _recolectar(session).items():
+        registrar_cambios(session, tabla, claves['ids'], claves['codigos'])
+
+@event.listens_for(Session, 'after_commit')
+def _despues_commit(session):
+    pendientes = session.info.pop('invalidacion_pendiente', None)
+    if not pendientes:
+        return
+    for tabla, claves in pendientes.items():
+        despachar({'tabla': tabla, 'ids': sorted(claves['ids']), 'codigos': sorted(claves['codigos'])})
+
+@event.listens_for(Session, 'after_rollback')
+def _despues_rollback(session):
+    session.info.pop('invalidacion_pendiente', None)
+
+class EscuchaInvalidacion(threading.Thread):
+    """Hilo que escucha el canal de invalidación y desaloja las claves en este proceso"""
+
+    def __init__(self, engine, intervalo_sondeo=5.0):
+        super().__init__(name='escucha-invalidacion', daemon=True)
+        self.engine = engine
+        self.intervalo_sondeo = intervalo_sondeo
+        self._detener = threading.Event()
+        # Se activa con la primera conexión escuchando, tras vaciar las caches
+        self.conectada = threading.Event()
+
+    def detener(self):
+        self._detener.set()
+
+    def _conectar(self):
+        # Conexión dedicada fuera del pool: LISTEN requiere una sesión persistente
+        conexion_pool = self.engine.raw_connection()
+        conexion = conexion_pool.dbapi_connection
+        conexion_pool.detach()
+        conexion.autocommit = True
+        with conexion.cursor() as cursor:
+            for canal in (CANAL, *_canales):
+                cursor.execute(f'LISTEN {canal}')
+        return conexion
+
+    def _sincronizar(self, conexion, canales):
+        for canal in canales:
+            try:
+                _canales[canal](conexion)
+            except Exception:
+                logger.exception('Error al sincronizar el canal %s', canal)
+
+    def run(self):
+        espera_reintento = 1
+        while not self._detener.is_set():
+            conexion = None
+            try:
+                conexion = self._conectar()
+                # Pudieron perderse eventos mientras no había conexión; en la primera, las
+                # caches pueden venir del proceso maestro (fork) sin haber escuchado nada
+                _despachar_todo()
+                self.conectada.set()
+                self._sincronizar(conexion, list(_canales))
+                espera_reintento = 1
+                while not self._detener.is_set():
+                    if select.select([conexion], [], [], self.intervalo_sondeo) == ([], [], []):
+                        self._sincronizar(conexion, list(_canales))
+                        continue
+                    conexion.poll()
+                    avisados = set()
+                    while conexion.notifies:
+                        notificacion = conexion.notifies.pop(0)
+                        if notificacion.channel != CANAL:
+                            avisados.add(notificacion.channel)
+                            continue
+                        evento = json.loads(notificacion.payload)
+                        if evento.pop('origen', None) == origen_proceso():
+                            continue
+                        despachar(evento)
+                    self._sincronizar(conexion, [canal for canal in avisados if canal in _canales])
+            except Exception:
+                logger.exception('Conexión de escucha de invalidación perdida; reintentando en %ss', espera_reintento)
+                time.sleep(espera_reintento)
+                espera_reintento = min(espera_reintento * 2, 30)
+            finally:
+                if conexion is not None:
+                    try:
+                        conexion.close()
+                    except Exception:
+                        pass
+
+def iniciar_escucha(app):
+    """Iniciar el hilo de escucha de este proceso (solo con PostgreSQL).
+
+    Se puede desactivar con INVALIDACION_ESCUCHA=0. Detrás de un pooler externo la
+    escucha usa DATABASE_URL_DIRECTA y, si no está definida, no se inicia.
+    """
+    global _escucha
+    if os.environ.get('INVALIDACION_ESCUCHA', '1') == '0':
+        return None
+    if _escucha is not None and _escucha.is_alive():
+        return _escucha
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        return None
+    directa = url_directa()
+    if directa:
+        engine = create_engine(directa, poolclass=NullPool)
+    elif pooler_externo():
+        return None
+    _escucha = EscuchaInvalidacion(engine)
+    _escucha.start()
+    return _escucha
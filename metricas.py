@@ -0,0 +1,238 @@
+"""Métricas de la API en formato de texto de Prometheus, expuestas en /metrics.
+
+Registra por endpoint: latencia (histograma), número de consultas SQL y tiempo en base
+de datos por petición, además de métricas de negocio como el tiempo de entrenamiento
+de modelos. Las métricas son por proceso: con varios workers, Prometheus debe
+recolectar cada uno o agregarlas por instancia.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from cache import estadisticas_caches
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+def _formatear_etiquetas(nombres, valores, extra=None):
+    pares = list(zip(nombres, valores))
+    if extra:
+        pares.append(extra)
+    if not pares:
+        return ''
+    contenido = ','.join(
+        '{}="{}"'.format(nombre, str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for nombre, valor in pares
+    )
+    return '{' + contenido + '}'
+
+def _formatear_numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor))
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nombre, descripcion, etiquetas=()):
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def _clave(self, etiquetas):
+        return tuple(str(etiquetas.get(nombre, '')) for nombre in self.etiquetas)
+
+    def exponer(self):
+        lineas = [f'# HELP {self.nombre} {self.descripcion}', f'# TYPE {self.nombre} {self.tipo}']
+        with self._lock:
+            lineas.extend(self._lineas())
+        return lineas
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def incrementar(self, cantidad=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def _lineas(self):
+        return [
+            f'{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {_formatear_numero(valor)}'
+            for clave, valor in self._valores.items()
+        ]
+
+class Medidor(_Metrica):
+    tipo = 'gauge'
+
+    def establecer(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = valor
+
+    _lineas = Contador._lineas
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nombre, descripcion, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        super().__init__(nombre, descripcion, etiquetas)
+        self.buckets = tuple(buckets)
+
+    def observar(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            estado = self._valores.get(clave)
+            if estado is None:
+                estado = self._valores[clave] = {'buckets': [0] * len(self.buckets), 'suma': 0.0, 'cantidad': 0}
+            indice = bisect_left(self.buckets, valor)
+            if indice < len(self.buckets):
+                estado['buckets'][indice] += 1
+            estado['suma'] += valor
+            estado['cantidad'] += 1
+
+    def _lineas(self):
+        lineas = []
+        for clave, estado in self._valores.items():
+            acumulado = 0
+            for limite, cantidad in zip(self.buckets, estado['buckets']):
+                acumulado += cantidad
+                etiquetas = _formatear_etiquetas(self.etiquetas, clave, ('le', _formatear_numero(limite)))
+                lineas.append(f'{self.nombre}_bucket{etiquetas} {acumulado}')
+            etiquetas = _formatear_etiquetas(self.etiquetas, clave, ('le', '+Inf'))
+            lineas.append(f'{self.nombre}_bucket{etiquetas} {estado["cantidad"]}')
+            etiquetas = _formatear_etiquetas(self.etiquetas, clave)
+            lineas.append(f'{self.nombre}_sum{etiquetas} {_formatear_numero(estado["suma"])}')
+            lineas.append(f'{self.nombre}_count{etiquetas} {estado["cantidad"]}')
+        return lineas
+
+class RegistroMetricas:
+    """Conjunto de métricas del proceso y recolectores que se evalúan al exponer"""
+
+    def __init__(self):
+        self._metricas = {}
+        self._recolectores = []
+        self._lock = threading.Lock()
+
+    def _registrar(self, metrica):
+        with self._lock:
+            return self._metricas.setdefault(metrica.nombre, metrica)
+
+    def contador(self, nombre, descripcion, etiquetas=()):
+        return self._registrar(Contador(nombre, descripcion, etiquetas))
+
+    def medidor(self, nombre, descripcion, etiquetas=()):
+        return self._registrar(Medidor(nombre, descripcion, etiquetas))
+
+    def histograma(self, nombre, descripcion, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        return self._registrar(Histograma(nombre, descripcion, etiquetas, buckets))
+
+    def recolector(self, funcion):
+        """Registrar una función que actualiza medidores justo antes de exponer"""
+        self._recolectores.append(funcion)
+        return funcion
+
+    def exponer(self):
+        for recolector in self._recolectores:
+            try:
+                recolector()
+            except Exception:
+                logger.exception('Error en recolector de métricas')
+        lineas = []
+        with self._lock:
+            metricas = list(self._metricas.values())
+        for metrica in metricas:
+            lineas.extend(metrica.exponer())
+        return '\n'.join(lineas) + '\n'
+
+registro = RegistroMetricas()
+
+peticiones_total = registro.contador(
+    'control_agricola_peticiones_total', 'Peticiones HTTP atendidas', ('endpoint', 'metodo', 'estado'))
+duracion_peticion = registro.histograma(
+    'control_agricola_peticion_duracion_segundos', 'Latencia de las peticiones HTTP', ('endpoint', 'metodo'))
+consultas_por_peticion = registro.histograma(
+    'control_agricola_consultas_sql_por_peticion', 'Consultas SQL ejecutadas por petición',
+    ('endpoint', 'metodo'), buckets=BUCKETS_CONSULTAS)
+tiempo_bd_peticion = registro.histograma(
+    'control_agricola_tiempo_bd_segundos', 'Tiempo en base de datos por petición', ('endpoint', 'metodo'))
+peticiones_consultas_excesivas = registro.contador(
+    'control_agricola_peticiones_consultas_excesivas_total',
+    'Peticiones que superaron el umbral de consultas SQL (posible N+1)', ('endpoint', 'metodo'))
+entrenamiento_modelo = registro.histograma(
+    'control_agricola_entrenamiento_modelo_segundos', 'Tiempo de entrenamiento de modelos de predicción', ('modelo',))
+cache_entradas = registro.medidor(
+    'control_agricola_cache_entradas', 'Entradas en cada cache en memoria', ('cache',))
+cache_aciertos = registro.medidor(
+    'control_agricola_cache_aciertos', 'Aciertos acumulados de cada cache en memoria', ('cache',))
+cache_fallos = registro.medidor(
+    'control_agricola_cache_fallos', 'Fallos acumulados de cada cache en memoria', ('cache',))
+
+@registro.recolector
+def _recolectar_caches():
+    for estadisticas in estadisticas_caches():
+        cache_entradas.establecer(estadisticas['entradas'], cache=estadisticas['nombre'])
+        cache_aciertos.establecer(estadisticas['aciertos'], cache=estadisticas['nombre'])
+        cache_fallos.establecer(estadisticas['fallos'], cache=estadisticas['nombre'])
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    context.metricas_inicio = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _despues_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'metricas_consultas' in g:
+        g.metricas_consultas += 1
+        g.metricas_tiempo_bd += time.perf_counter() - context.metricas_inicio
+
+def _endpoint_actual():
+    # Se usa la regla de la ruta (no la URL) para acotar la cardinalidad de etiquetas
+    return request.url_rule.rule if request.url_rule else 'sin_ruta'
+
+def instrumentar_app(app):
+    """Registrar hooks de métricas por petición y el endpoint /metrics.
+
+    METRICAS_MAX_CONSULTAS define a partir de cuántas consultas SQL se registra una advertencia.
+    """
+    max_consultas = int(os.environ.get('METRICAS_MAX_CONSULTAS', 20))
+
+    @app.before_request
+    def _iniciar_medicion():
+        g.metricas_inicio = time.perf_counter()
+        g.metricas_consultas = 0
+        g.metricas_tiempo_bd = 0.0
+
+    @app.after_request
+    def _registrar_medicion(response):
+        if 'metricas_inicio' not in g or request.path == '/metrics':
+            return response
+        endpoint = _endpoint_actual()
+        metodo = request.method
+        duracion = time.perf_counter() - g.metricas_inicio
+
+        peticiones_total.incrementar(endpoint=endpoint, metodo=metodo, estado=response.status_code)
+        duracion_peticion.observar(duracion, endpoint=endpoint, metodo=metodo)
+        consultas_por_peticion.observar(g.metricas_consultas, endpoint=endpoint, metodo=metodo)
+        tiempo_bd_peticion.observar(g.metricas_tiempo_bd, endpoint=endpoint, metodo=metodo)
+
+        if g.metricas_consultas > max_consultas:
+            peticiones_consultas_excesivas.incrementar(endpoint=endpoint, metodo=metodo)
+            logger.warning(
+                '%s %s ejecutó %d consultas SQL (umbral %d, %.1f ms en BD)',
+                metodo, request.path, g.metricas_consultas, max_consultas, g.metricas_tiempo_bd * 1000
+            )
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registro.exponer(), mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -3,7 +3,7 @@ from flask_sqlalchemy import SQLAlchemy
 # Crear instancia de db que será inicializada por la app
 db = SQLAlchemy()
 from datetime import datetime
-from sqlalchemy import Index
+from sqlalchemy import Index, REAL
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 import uuid
 
@@ -107,6 +107,10 @@ class RegistroProduccion(db.Model):
     datos_adicionales = db.Column(JSONB)  # Para datos flexibles
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Ingesta idempotente desde equipos de campo (balanzas, monitores de rendimiento)
+    clave_idempotencia = db.Column(db.String(100), unique=True)
+    origen = db.Column(db.String(50))
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -173,7 +177,103 @@ class PrediccionCosecha(db.Model):
             'fecha_creacion': self.fecha_creacion.isoformat()
         }
 
+class VersionTabla(db.Model):
+    """Contador de versión por tabla, usado para respuestas condicionales (ETag)"""
+    __tablename__ = 'versiones_tabla'
+    
+    tabla = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class InstantaneaDashboard(db.Model):
+    """Documento JSON precalculado del dashboard, listo para enviarse"""
+    __tablename__ = 'instantaneas_dashboard'
+    
+    nombre = db.Column(db.String(50), primary_key=True)
+    documento = db.Column(db.Text, nullable=False)  # JSON serializado
+    fecha_generacion = db.Column(db.DateTime, nullable=False)
+    duracion_ms = db.Column(db.Float)
+
+class EventoAnomalia(db.Model):
+    """Registro creado o actualizado con anomalía, en orden de commit (para el stream SSE)"""
+    __tablename__ = 'eventos_anomalia'
+    
+    id = db.Column(db.BigInteger, primary_key=True)
+    registro_id = db.Column(db.Integer, nullable=False, index=True)  # Sin FK: el evento sobrevive al registro
+    parcela_id = db.Column(db.Integer, nullable=False)
+    cultivo_id = db.Column(db.Integer, nullable=False)
+    fecha_registro = db.Column(db.Date, nullable=False)
+    rendimiento_hectarea = db.Column(db.Float)
+    desviacion_esperada = db.Column(db.Float)
+    tipo = db.Column(db.String(20), nullable=False)  # creado, actualizado
+    fecha_evento = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    xid = db.Column(db.BigInteger, nullable=False, default=0)  # Transacción que lo creó: orden del stream
+
+class Cambio(db.Model):
+    """Último cambio de cada fila sincronizable, con su número de secuencia (delta-sync)"""
+    __tablename__ = 'cambios'
+    
+    tabla = db.Column(db.String(50), primary_key=True)
+    fila_id = db.Column(db.Integer, primary_key=True)
+    seq = db.Column(db.BigInteger, db.Sequence('cambios_seq'), nullable=False, unique=True)  # Orden dentro de la transacción
+    xid = db.Column(db.BigInteger, nullable=False, default=0)  # Transacción que anotó el cambio (marca de agua de /sync)
+    eliminado = db.Column(db.Boolean, nullable=False, default=False)  # Borrado físico de la fila
+    fecha_cambio = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class LecturaTelemetria(db.Model):
+    """Lectura cruda de un sensor de campo: una métrica de una parcela en un instante"""
+    __tablename__ = 'telemetria'
+    
+    parcela_id = db.Column(db.Integer, db.ForeignKey('parcelas.id'), primary_key=True)
+    metrica = db.Column(db.SmallInteger, primary_key=True)  # código en telemetria.METRICAS
+    momento = db.Column(db.DateTime, primary_key=True)  # UTC
+    valor = db.Column(REAL, nullable=False)
+
+class ResumenTelemetria(db.Model):
+    """Agregado por hora o por día de las lecturas de telemetría, mantenido al ingerir"""
+    __tablename__ = 'telemetria_resumen'
+    
+    parcela_id = db.Column(db.Integer, db.ForeignKey('parcelas.id'), primary_key=True)
+    metrica = db.Column(db.SmallInteger, primary_key=True)
+    granularidad = db.Column(db.String(4), primary_key=True)  # hora, dia
+    inicio = db.Column(db.DateTime, primary_key=True)
+    cantidad = db.Column(db.Integer, nullable=False)
+    suma = db.Column(db.Float, nullable=False)
+    minimo = db.Column(db.Float, nullable=False)
+    maximo = db.Column(db.Float, nullable=False)
+
+class BacktestingTemporada(db.Model):
+    """Errores de las predicciones de una temporada contra la producción real, por modelo y cultivo.
+
+    Se guardan sumas (no promedios) para combinar temporadas: MAE = suma_error_absoluto /
+    predicciones, RMSE = sqrt(suma_error_cuadratico / predicciones).
+    """
+    __tablename__ = 'backtesting_predicciones'
+    
+    modelo = db.Column(db.String(50), primary_key=True)
+    cultivo_id = db.Column(db.Integer, db.ForeignKey('cultivos.id'), primary_key=True)
+    temporada = db.Column(db.String(20), primary_key=True)
+    predicciones = db.Column(db.Integer, nullable=False)
+    suma_error_absoluto = db.Column(db.Float, nullable=False)
+    suma_error_cuadratico = db.Column(db.Float, nullable=False)
+    con_rango = db.Column(db.Integer, nullable=False)  # predicciones con rango_minimo y rango_maximo
+    dentro_rango = db.Column(db.Integer, nullable=False)  # de ellas, con el valor real dentro del rango
+    fecha_calculo = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
 # Índices compuestos para optimizar consultas de series temporales
 Index('idx_produccion_temporal', RegistroProduccion.parcela_id, RegistroProduccion.fecha_registro)
 Index('idx_produccion_temporada', RegistroProduccion.cultivo_id, RegistroProduccion.temporada)
 Index('idx_parcela_codigo_hash', Parcela.codigo)  # Índice hash para acceso rápido
+# GIN jsonb_path_ops para filtros @> y @? sobre datos_adicionales (ver datos_adicionales.py)
+Index('idx_produccion_datos_adicionales', RegistroProduccion.datos_adicionales,
+      postgresql_using='gin', postgresql_ops={'datos_adicionales': 'jsonb_path_ops'})
+# Última predicción por parcela/cultivo/temporada (DISTINCT ON) e historial paginado por fecha
+Index('idx_prediccion_ultima', PrediccionCosecha.parcela_id, PrediccionCosecha.cultivo_id,
+      PrediccionCosecha.temporada_objetivo, PrediccionCosecha.fecha_prediccion.desc(), PrediccionCosecha.id.desc())
+Index('idx_prediccion_historial', PrediccionCosecha.fecha_prediccion, PrediccionCosecha.id)
+# Stream de anomalías en orden de transacción
+Index('idx_eventos_anomalia_xid', EventoAnomalia.xid, EventoAnomalia.id)
+# Páginas de /sync en orden de transacción
+Index('idx_cambios_xid', Cambio.xid, Cambio.seq)
+# BRIN sobre el instante: la telemetría llega casi en orden y la retención borra por fecha
+Index('idx_telemetria_momento_brin', LecturaTelemetria.momento, postgresql_using='brin')
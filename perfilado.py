@@ -0,0 +1,83 @@
+"""Perfilado por fases de los endpoints de análisis.
+
+Cada fase (consulta, DataFrame, entrenamiento, escritura...) se mide con perf_counter y
+se acumula siempre en el histograma de métricas por operación y fase. Con ?profile=1
+el desglose se devuelve junto al resultado; con ?profile=1&memoria=1 además se mide el
+pico de memoria de cada fase con tracemalloc, que solo se activa para esa petición.
+"""
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from flask import has_request_context, request
+
+from metricas import registro
+
+duracion_fase = registro.histograma(
+    'control_agricola_fase_analisis_segundos', 'Duración de cada fase de los endpoints de análisis',
+    ('operacion', 'fase'))
+
+# tracemalloc es global al proceso: solo una petición a la vez puede medir memoria
+_lock_memoria = threading.Lock()
+
+def perfil_solicitado():
+    return has_request_context() and request.args.get('profile') in ('1', 'true')
+
+class PerfilFases:
+    """Cronómetro de fases de una operación"""
+
+    def __init__(self, operacion, memoria=None):
+        self.operacion = operacion
+        self.solicitado = perfil_solicitado()
+        if memoria is None:
+            memoria = self.solicitado and request.args.get('memoria') in ('1', 'true')
+        self.fases = []
+        self._inicio = time.perf_counter()
+        self._memoria = memoria and not tracemalloc.is_tracing() and _lock_memoria.acquire(blocking=False)
+        if self._memoria:
+            tracemalloc.start()
+
+    @contextmanager
+    def fase(self, nombre):
+        if self._memoria:
+            tracemalloc.reset_peak()
+            memoria_inicial = tracemalloc.get_traced_memory()[0]
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            duracion = time.perf_counter() - inicio
+            duracion_fase.observar(duracion, operacion=self.operacion, fase=nombre)
+            medicion = {'fase': nombre, 'duracion_ms': round(duracion * 1000, 3)}
+            if self._memoria:
+                medicion['pico_memoria_kb'] = round((tracemalloc.get_traced_memory()[1] - memoria_inicial) / 1024, 1)
+            self.fases.append(medicion)
+
+    def finalizar(self):
+        if self._memoria:
+            tracemalloc.stop()
+            _lock_memoria.release()
+            self._memoria = False
+
+    def resumen(self):
+        """Desglose de tiempos; detiene la medición de memoria si estaba activa"""
+        memoria = self._memoria
+        self.finalizar()
+        total = (time.perf_counter() - self._inicio) * 1000
+        medido = sum(f['duracion_ms'] for f in self.fases)
+        return {
+            'operacion': self.operacion,
+            'total_ms': round(total, 3),
+            'sin_fase_ms': round(total - medido, 3),
+            'memoria_medida': memoria,
+            'fases': self.fases
+        }
+
+    def adjuntar(self, resultado):
+        """Agregar el desglose a la respuesta si se pidió con ?profile=1"""
+        if self.solicitado:
+            resultado['perfil'] = self.resumen()
+        else:
+            self.finalizar()
+        return resultado
@@ -0,0 +1,76 @@
+"""Cache de referencia de Cultivo/Parcela para validar escrituras sin consultar la base de datos.
+
+Guarda solo los campos que usan los handlers de escritura (estado activo, área y
+rendimiento esperado). Se invalida por el bus de invalidación ante cualquier
+escritura en cultivos o parcelas y puede precargarse al iniciar la aplicación. Si el
+proceso no tiene escucha activa, las entradas vencen a los 5 segundos.
+"""
+import logging
+from collections import namedtuple
+
+from cache import crear_cache
+from invalidacion import suscribir
+from models import db, Cultivo, Parcela
+
+logger = logging.getLogger(__name__)
+
+ReferenciaParcela = namedtuple('ReferenciaParcela', ['id', 'activa', 'area_hectareas'])
+ReferenciaCultivo = namedtuple('ReferenciaCultivo', ['id', 'activo', 'rendimiento_esperado'])
+
+# Sin escucha de invalidación, 5 s como red de seguridad (igual que versiones_tabla)
+cache_ref_parcelas = crear_cache('referencias_parcelas', maxsize=100000, ttl=3600, ttl_sin_escucha=5)
+cache_ref_cultivos = crear_cache('referencias_cultivos', maxsize=10000, ttl=3600, ttl_sin_escucha=5)
+
+def _manejador(cache):
+    def invalidar(evento):
+        if evento.get('todo'):
+            cache.limpiar()
+        else:
+            cache.invalidar(*evento['ids'])
+    return invalidar
+
+suscribir('parcelas', _manejador(cache_ref_parcelas))
+suscribir('cultivos', _manejador(cache_ref_cultivos))
+
+def referencia_parcela(parcela_id):
+    """Referencia de la parcela o None si no existe"""
+    referencia = cache_ref_parcelas.obtener(parcela_id)
+    if referencia is None:
+        generacion = cache_ref_parcelas.generacion()
+        fila = db.session.query(Parcela.id, Parcela.activa, Parcela.area_hectareas).filter(
+            Parcela.id == parcela_id
+        ).first()
+        if fila is None:
+            return None
+        referencia = ReferenciaParcela(*fila)
+        cache_ref_parcelas.guardar(parcela_id, referencia, generacion)
+    return referencia
+
+def referencia_cultivo(cultivo_id):
+    """Referencia del cultivo o None si no existe"""
+    referencia = cache_ref_cultivos.obtener(cultivo_id)
+    if referencia is None:
+        generacion = cache_ref_cultivos.generacion()
+        fila = db.session.query(Cultivo.id, Cultivo.activo, Cultivo.rendimiento_esperado).filter(
+            Cultivo.id == cultivo_id
+        ).first()
+        if fila is None:
+            return None
+        referencia = ReferenciaCultivo(*fila)
+        cache_ref_cultivos.guardar(cultivo_id, referencia, generacion)
+    return referencia
+
+def precargar_referencias(app):
+    """Cargar todas las parcelas y cultivos activos (dos consultas) al iniciar"""
+    try:
+        with app.app_context():
+            generacion = cache_ref_parcelas.generacion()
+            for fila in db.session.query(Parcela.id, Parcela.activa, Parcela.area_hectareas).filter(Parcela.activa == True):
+                cache_ref_parcelas.guardar(fila.id, ReferenciaParcela(*fila), generacion)
+
+            generacion = cache_ref_cultivos.generacion()
+            for fila in db.session.query(Cultivo.id, Cultivo.activo, Cultivo.rendimiento_esperado).filter(Cultivo.activo == True):
+                cache_ref_cultivos.guardar(fila.id, ReferenciaCultivo(*fila), generacion)
+            db.session.remove()
+    except Exception:
+        logger.warning('No se pudo precargar la cache de referencias', exc_info=True)
@@ -0,0 +1,32 @@
+from flask import request
+from flask_restx import Resource, Namespace
+import consultas_lentas
+
+# Namespace para administración y diagnóstico
+admin_ns = Namespace('admin', description='Diagnóstico y administración')
+
+@admin_ns.route('/consultas-lentas')
+class ConsultasLentas(Resource):
+    @admin_ns.doc('listar_consultas_lentas')
+    @admin_ns.param('limite', 'Número máximo de registros a retornar (por defecto 50)')
+    def get(self):
+        """Obtener las consultas lentas más recientes con su plan de ejecución"""
+        registro = consultas_lentas.registro_consultas_lentas
+        if registro is None:
+            return {'error': 'El registro de consultas lentas no está activo (CONSULTAS_LENTAS_UMBRAL_MS)'}, 404
+        
+        limite = request.args.get('limite', 50, type=int)
+        return {
+            'umbral_ms': registro.umbral_ms,
+            'consultas': registro.listar(limite)
+        }, 200
+    
+    @admin_ns.doc('limpiar_consultas_lentas')
+    def delete(self):
+        """Vaciar el registro de consultas lentas"""
+        registro = consultas_lentas.registro_consultas_lentas
+        if registro is None:
+            return {'error': 'El registro de consultas lentas no está activo (CONSULTAS_LENTAS_UMBRAL_MS)'}, 404
+        
+        registro.limpiar()
+        return {'message': 'Registro de consultas lentas vaciado'}, 200
@@ -2,19 +2,29 @@ from flask import request, jsonify
 from flask_restx import Resource, fields, Namespace
 from models import db
 from models import RegistroProduccion, Parcela, Cultivo, PrediccionCosecha
+from metricas import entrenamiento_modelo
+from perfilado import PerfilFases
+from telemetria import clima_registros
+import backtesting
+from seleccion_modelo import MODELOS, crear_modelo, seleccionar
 import pandas as pd
 import numpy as np
 from scipy import stats
 from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import RandomForestRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, r2_score
+from sqlalchemy import func, tuple_
 from datetime import datetime, date, timedelta
 import json
+import time
 
 # Namespace para análisis
 analisis_ns = Namespace('analisis', description='Análisis estadístico y predicciones')
 
+# Historial de predicciones paginado por clave (fecha_prediccion, id)
+LIMITE_PREDICCIONES = 100
+LIMITE_PREDICCIONES_MAXIMO = 1000
+
 # Modelos para documentación automática
 comparacion_variedades_model = analisis_ns.model('ComparacionVariedades', {
     'cultivo_id_1': fields.Integer(required=True, description='ID del primer cultivo'),
@@ -26,7 +36,7 @@ prediccion_model = analisis_ns.model('PrediccionCosecha', {
     'parcela_id': fields.Integer(required=True, description='ID de la parcela'),
     'cultivo_id': fields.Integer(required=True, description='ID del cultivo'),
     'temporada_objetivo': fields.String(required=True, description='Temporada objetivo (ej: 2024-2)'),
-    'modelo': fields.String(description='Tipo de modelo (linear, random_forest)', default='linear')
+    'modelo': fields.String(description='Tipo de modelo (linear, random_forest, xgboost) o auto para elegirlo por validación cruzada temporal', default='linear')
 })
 
 @analisis_ns.route('/estadisticas-generales')
@@ -198,58 +208,67 @@ class CompararVariedades(Resource):
 @analisis_ns.route('/series-temporales/analisis/<int:parcela_id>')
 class AnalisisSeriesTemporales(Resource):
     @analisis_ns.doc('analizar_series_temporales')
+    @analisis_ns.param('profile', 'Incluir desglose de tiempos por fase (1)')
+    @analisis_ns.param('memoria', 'Con profile=1, medir también el pico de memoria por fase (1)')
     def get(self, parcela_id):
         """Análisis de series temporales para detectar tendencias y estacionalidad"""
+        perfil = PerfilFases('series_temporales')
         try:
-            registros = RegistroProduccion.query.filter_by(parcela_id=parcela_id).order_by(
-                RegistroProduccion.fecha_registro.asc()
-            ).all()
+            with perfil.fase('consulta'):
+                registros = RegistroProduccion.query.filter_by(parcela_id=parcela_id).order_by(
+                    RegistroProduccion.fecha_registro.asc()
+                ).all()
             
             if len(registros) < 4:
                 return {'error': 'Se necesitan al menos 4 registros para el análisis de series temporales'}, 400
             
             # Crear DataFrame
-            df = pd.DataFrame([{
-                'fecha': r.fecha_registro,
-                'rendimiento': r.rendimiento_hectarea,
-                'temporada': r.temporada
-            } for r in registros])
-            
-            df['fecha'] = pd.to_datetime(df['fecha'])
-            df = df.sort_values('fecha')
+            with perfil.fase('dataframe'):
+                df = pd.DataFrame([{
+                    'fecha': r.fecha_registro,
+                    'rendimiento': r.rendimiento_hectarea,
+                    'temporada': r.temporada
+                } for r in registros])
+                
+                df['fecha'] = pd.to_datetime(df['fecha'])
+                df = df.sort_values('fecha')
             
             # Análisis de tendencia (regresión lineal simple)
-            X = np.arange(len(df)).reshape(-1, 1)
-            y = df['rendimiento'].values
-            
-            modelo_tendencia = LinearRegression()
-            modelo_tendencia.fit(X, y)
-            
-            tendencia = modelo_tendencia.predict(X)
-            pendiente = modelo_tendencia.coef_[0]
-            
-            # Calcular estadísticas de la serie
-            media_rendimiento = df['rendimiento'].mean()
-            desviacion_estandar = df['rendimiento'].std()
-            coef_variacion = (desviacion_estandar / media_rendimiento) * 100
-            
-            # Detectar valores atípicos (outliers)
-            Q1 = df['rendimiento'].quantile(0.25)
-            Q3 = df['rendimiento'].quantile(0.75)
-            IQR = Q3 - Q1
-            limite_inferior = Q1 - 1.5 * IQR
-            limite_superior = Q3 + 1.5 * IQR
-            
-            outliers = df[(df['rendimiento'] < limite_inferior) | (df['rendimiento'] > limite_superior)]
-            
-            # Análisis por temporadas
-            stats_temporadas = df.groupby('temporada')['rendimiento'].agg([
-                'count', 'mean', 'std', 'min', 'max'
-            ]).to_dict('index')
+            with perfil.fase('tendencia'):
+                X = np.arange(len(df)).reshape(-1, 1)
+                y = df['rendimiento'].values
+                
+                modelo_tendencia = LinearRegression()
+                modelo_tendencia.fit(X, y)
+                
+                tendencia = modelo_tendencia.predict(X)
+                pendiente = modelo_tendencia.coef_[0]
+                r_cuadrado = modelo_tendencia.score(X, y)
+            
+            with perfil.fase('estadisticas'):
+                # Calcular estadísticas de la serie
+                media_rendimiento = df['rendimiento'].mean()
+                desviacion_estandar = df['rendimiento'].std()
+                coef_variacion = (desviacion_estandar / media_rendimiento) * 100
+                
+                # Detectar valores atípicos (outliers)
+                Q1 = df['rendimiento'].quantile(0.25)
+                Q3 = df['rendimiento'].quantile(0.75)
+                IQR = Q3 - Q1
+                limite_inferior = Q1 - 1.5 * IQR
+                limite_superior = Q3 + 1.5 * IQR
+                
+                outliers = df[(df['rendimiento'] < limite_inferior) | (df['rendimiento'] > limite_superior)]
+                
+                # Análisis por temporadas
+                stats_temporadas = df.groupby('temporada')['rendimiento'].agg([
+                    'count', 'mean', 'std', 'min', 'max'
+                ]).to_dict('index')
             
-            parcela = Parcela.query.get(parcela_id)
+            with perfil.fase('consulta_parcela'):
+                parcela = Parcela.query.get(parcela_id)
             
-            return {
+            return perfil.adjuntar({
                 'parcela': {
                     'id': parcela_id,
                     'nombre': parcela.nombre if parcela else 'Desconocida',
@@ -270,7 +289,7 @@ class AnalisisSeriesTemporales(Resource):
                 'analisis_tendencia': {
                     'pendiente': float(pendiente),
                     'interpretacion': 'Tendencia creciente' if pendiente > 0.1 else 'Tendencia decreciente' if pendiente < -0.1 else 'Tendencia estable',
-                    'r_cuadrado': float(modelo_tendencia.score(X, y))
+                    'r_cuadrado': float(r_cuadrado)
                 },
                 'valores_atipicos': {
                     'cantidad': len(outliers),
@@ -285,74 +304,110 @@ class AnalisisSeriesTemporales(Resource):
                         'maximo': float(stats['max'])
                     } for temporada, stats in stats_temporadas.items()
                 }
-            }, 200
+            }), 200
         except Exception as e:
             return {'error': str(e)}, 500
+        finally:
+            perfil.finalizar()
 
 @analisis_ns.route('/predicciones/crear')
 class CrearPrediccion(Resource):
     @analisis_ns.doc('crear_prediccion_cosecha')
     @analisis_ns.expect(prediccion_model)
+    @analisis_ns.param('profile', 'Incluir desglose de tiempos por fase (1)')
+    @analisis_ns.param('memoria', 'Con profile=1, medir también el pico de memoria por fase (1)')
     def post(self):
         """Crear predicción de cosecha usando modelos numéricos"""
+        perfil = PerfilFases('crear_prediccion')
         try:
             data = request.get_json()
             parcela_id = data['parcela_id']
             cultivo_id = data['cultivo_id']
             temporada_objetivo = data['temporada_objetivo']
             tipo_modelo = data.get('modelo', 'linear')
+            if tipo_modelo not in (*MODELOS, 'auto'):
+                return {'error': f"Modelo no válido: use {', '.join(MODELOS)} o auto"}, 400
             
             # Obtener datos históricos
-            registros = RegistroProduccion.query.filter_by(
-                parcela_id=parcela_id,
-                cultivo_id=cultivo_id
-            ).order_by(RegistroProduccion.fecha_registro.asc()).all()
+            with perfil.fase('consulta'):
+                registros = RegistroProduccion.query.filter_by(
+                    parcela_id=parcela_id,
+                    cultivo_id=cultivo_id
+                ).order_by(RegistroProduccion.fecha_registro.asc()).all()
             
             if len(registros) < 5:
                 return {'error': 'Se necesitan al menos 5 registros históricos para crear predicciones'}, 400
             
+            # Clima del ciclo desde la telemetría para los registros sin condiciones ambientales
+            with perfil.fase('clima'):
+                clima = clima_registros([
+                    r.id for r in registros
+                    if r.temperatura_promedio is None or r.precipitacion_mm is None or r.humedad_relativa is None
+                ])
+            
             # Preparar datos para el modelo
-            df = pd.DataFrame([{
-                'fecha': r.fecha_registro,
-                'rendimiento': r.rendimiento_hectarea,
-                'temperatura': r.temperatura_promedio or 20,  # valor por defecto
-                'precipitacion': r.precipitacion_mm or 50,
-                'humedad': r.humedad_relativa or 60,
-                'dias_desde_inicio': (r.fecha_registro - registros[0].fecha_registro).days
-            } for r in registros])
-            
-            # Características (features) para el modelo
-            X = df[['dias_desde_inicio', 'temperatura', 'precipitacion', 'humedad']].values
-            y = df['rendimiento'].values
-            
-            # Dividir datos para entrenamiento y validación
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-            
-            # Entrenar modelo según el tipo especificado
-            if tipo_modelo == 'random_forest':
-                modelo = RandomForestRegressor(n_estimators=100, random_state=42)
-            else:  # linear por defecto
-                modelo = LinearRegression()
-            
-            modelo.fit(X_train, y_train)
-            
-            # Evaluar modelo
-            y_pred_test = modelo.predict(X_test)
-            r2 = r2_score(y_test, y_pred_test)
-            rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
+            with perfil.fase('dataframe'):
+                df = pd.DataFrame([{
+                    'fecha': r.fecha_registro,
+                    'rendimiento': r.rendimiento_hectarea,
+                    'temperatura': r.temperatura_promedio or clima.get(r.id, {}).get('temperatura') or 20,  # valor por defecto
+                    'precipitacion': r.precipitacion_mm or clima.get(r.id, {}).get('precipitacion') or 50,
+                    'humedad': r.humedad_relativa or clima.get(r.id, {}).get('humedad') or 60,
+                    'dias_desde_inicio': (r.fecha_registro - registros[0].fecha_registro).days
+                } for r in registros])
+                
+                # Características (features) para el modelo
+                X = df[['dias_desde_inicio', 'temperatura', 'precipitacion', 'humedad']].values
+                y = df['rendimiento'].values
+            
+            validacion = None
+            if tipo_modelo == 'auto':
+                # Validación cruzada temporal de los candidatos en paralelo; el elegido se entrena con todo
+                with perfil.fase('validacion_cruzada'):
+                    tipo_modelo, validacion = seleccionar(X, y)
+                if tipo_modelo is None and validacion['sin_terminar']:
+                    return {'error': 'Ningún modelo completó la validación cruzada dentro del presupuesto de tiempo'}, 503
+                if tipo_modelo is None:
+                    return {'error': 'Ningún modelo pudo entrenarse con estos registros', 'fallidos': validacion['fallidos']}, 400
+                X_train, y_train = X, y
+            else:
+                # Dividir datos para entrenamiento y validación
+                with perfil.fase('division'):
+                    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+            
+            # Entrenar modelo según el tipo especificado (linear por defecto)
+            modelo = crear_modelo(tipo_modelo)
+            
+            with perfil.fase('entrenamiento'):
+                inicio_entrenamiento = time.perf_counter()
+                modelo.fit(X_train, y_train)
+                # Etiqueta de un conjunto fijo para acotar la cardinalidad de la métrica
+                etiqueta = tipo_modelo if tipo_modelo in MODELOS else 'otro'
+                entrenamiento_modelo.observar(time.perf_counter() - inicio_entrenamiento, modelo=etiqueta)
+            
+            # Evaluar modelo (con auto, el error fuera de muestra de la validación cruzada)
+            if validacion:
+                r2 = validacion['candidatos'][tipo_modelo]['r2']
+                rmse = validacion['candidatos'][tipo_modelo]['rmse']
+            else:
+                with perfil.fase('evaluacion'):
+                    y_pred_test = modelo.predict(X_test)
+                    r2 = r2_score(y_test, y_pred_test)
+                    rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
             
             # Hacer predicción para la temporada objetivo
-            # Usar promedios históricos para las condiciones ambientales
-            temp_promedio = df['temperatura'].mean()
-            precip_promedio = df['precipitacion'].mean()
-            humedad_promedio = df['humedad'].mean()
-            
-            # Estimar días desde inicio para la temporada objetivo
-            ultimo_registro = max(r.fecha_registro for r in registros)
-            dias_futuros = (ultimo_registro - registros[0].fecha_registro).days + 180  # aproximación
-            
-            X_prediccion = np.array([[dias_futuros, temp_promedio, precip_promedio, humedad_promedio]])
-            rendimiento_predicho = modelo.predict(X_prediccion)[0]
+            with perfil.fase('prediccion'):
+                # Usar promedios históricos para las condiciones ambientales
+                temp_promedio = df['temperatura'].mean()
+                precip_promedio = df['precipitacion'].mean()
+                humedad_promedio = df['humedad'].mean()
+                
+                # Estimar días desde inicio para la temporada objetivo
+                ultimo_registro = max(r.fecha_registro for r in registros)
+                dias_futuros = (ultimo_registro - registros[0].fecha_registro).days + 180  # aproximación
+                
+                X_prediccion = np.array([[dias_futuros, temp_promedio, precip_promedio, humedad_promedio]])
+                rendimiento_predicho = float(modelo.predict(X_prediccion)[0])
             
             # Calcular intervalo de confianza (aproximado)
             error_estandar = rmse
@@ -382,17 +437,20 @@ class CrearPrediccion(Resource):
                         'temperatura': float(temp_promedio),
                         'precipitacion': float(precip_promedio),
                         'humedad': float(humedad_promedio)
-                    }
+                    },
+                    'validacion_cruzada': validacion
                 }
             )
             
-            db.session.add(prediccion)
-            db.session.commit()
+            with perfil.fase('escritura'):
+                db.session.add(prediccion)
+                db.session.commit()
             
-            parcela = Parcela.query.get(parcela_id)
-            cultivo = Cultivo.query.get(cultivo_id)
+            with perfil.fase('consulta_referencias'):
+                parcela = Parcela.query.get(parcela_id)
+                cultivo = Cultivo.query.get(cultivo_id)
             
-            return {
+            return perfil.adjuntar({
                 'prediccion_id': prediccion.id,
                 'parcela': {
                     'id': parcela_id,
@@ -413,21 +471,28 @@ class CrearPrediccion(Resource):
                     'tipo': tipo_modelo,
                     'r2_score': float(r2),
                     'rmse': float(rmse),
-                    'registros_utilizados': len(registros)
+                    'registros_utilizados': len(registros),
+                    'validacion_cruzada': validacion
                 },
                 'fecha_prediccion': date.today().isoformat()
-            }, 201
+            }), 201
         except Exception as e:
             db.session.rollback()
             return {'error': str(e)}, 500
+        finally:
+            perfil.finalizar()
 
 @analisis_ns.route('/predicciones')
 class ListarPredicciones(Resource):
     @analisis_ns.doc('listar_predicciones')
     @analisis_ns.param('parcela_id', 'Filtrar por ID de parcela')
     @analisis_ns.param('cultivo_id', 'Filtrar por ID de cultivo')
+    @analisis_ns.param('temporada', 'Filtrar por temporada objetivo')
+    @analisis_ns.param('latest', 'true = solo la predicción más reciente de cada parcela, cultivo y temporada')
+    @analisis_ns.param('limite', f'Paginar el historial con esta cantidad por página (máximo {LIMITE_PREDICCIONES_MAXIMO}); sin limite ni cursor se devuelve completo')
+    @analisis_ns.param('cursor', 'Valor de X-Cursor-Siguiente de la página anterior')
     def get(self):
-        """Obtener todas las predicciones de cosecha"""
+        """Obtener las predicciones de cosecha, de la más reciente a la más antigua"""
         try:
             query = PrediccionCosecha.query
             
@@ -439,9 +504,65 @@ class ListarPredicciones(Resource):
             if cultivo_id:
                 query = query.filter_by(cultivo_id=cultivo_id)
             
-            predicciones = query.order_by(PrediccionCosecha.fecha_prediccion.desc()).all()
-            
-            return [prediccion.to_dict() for prediccion in predicciones], 200
+            temporada = request.args.get('temporada')
+            if temporada:
+                query = query.filter_by(temporada_objetivo=temporada)
+            
+            if request.args.get('latest', '').lower() == 'true':
+                # DISTINCT ON recorre idx_prediccion_ultima y toma la primera fila de cada grupo
+                ultimas = query.distinct(
+                    PrediccionCosecha.parcela_id, PrediccionCosecha.cultivo_id, PrediccionCosecha.temporada_objetivo
+                ).order_by(
+                    PrediccionCosecha.parcela_id, PrediccionCosecha.cultivo_id, PrediccionCosecha.temporada_objetivo,
+                    PrediccionCosecha.fecha_prediccion.desc(), PrediccionCosecha.id.desc()
+                ).all()
+                ultimas.sort(key=lambda p: (p.fecha_prediccion, p.id), reverse=True)
+                return [prediccion.to_dict() for prediccion in ultimas], 200
+            
+            cursor = request.args.get('cursor')
+            if 'limite' not in request.args and not cursor:
+                # Sin paginación pedida se mantiene la respuesta completa de siempre
+                predicciones = query.order_by(
+                    PrediccionCosecha.fecha_prediccion.desc(), PrediccionCosecha.id.desc()
+                ).all()
+                return [prediccion.to_dict() for prediccion in predicciones], 200
+            
+            limite = min(max(request.args.get('limite', LIMITE_PREDICCIONES, type=int), 1), LIMITE_PREDICCIONES_MAXIMO)
+            if cursor:
+                try:
+                    fecha, id_prediccion = cursor.split('_')
+                    fecha, id_prediccion = date.fromisoformat(fecha), int(id_prediccion)
+                except ValueError:
+                    return {'error': f'cursor inválido: {cursor}'}, 400
+                # Paginación por clave: continúa después de la última fila entregada, sin OFFSET
+                query = query.filter(tuple_(PrediccionCosecha.fecha_prediccion, PrediccionCosecha.id) < (fecha, id_prediccion))
+            
+            predicciones = query.order_by(
+                PrediccionCosecha.fecha_prediccion.desc(), PrediccionCosecha.id.desc()
+            ).limit(limite + 1).all()
+            
+            encabezados = {}
+            if len(predicciones) > limite:
+                predicciones = predicciones[:limite]
+                ultima = predicciones[-1]
+                encabezados['X-Cursor-Siguiente'] = f'{ultima.fecha_prediccion.isoformat()}_{ultima.id}'
+            
+            return [prediccion.to_dict() for prediccion in predicciones], 200, encabezados
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@analisis_ns.route('/predicciones/backtesting')
+class BacktestingPredicciones(Resource):
+    @analisis_ns.doc('backtesting_predicciones')
+    @analisis_ns.param('cultivo_id', 'Filtrar por ID de cultivo')
+    @analisis_ns.param('modelo', 'Filtrar por tipo de modelo')
+    def get(self):
+        """Error de las predicciones contra la producción real (MAE, RMSE y cobertura del rango) por modelo y cultivo"""
+        try:
+            return backtesting.metricas(
+                cultivo_id=request.args.get('cultivo_id', type=int),
+                modelo=request.args.get('modelo')
+            ), 200
         except Exception as e:
             return {'error': str(e)}, 500
 
@@ -1,6 +1,9 @@
 from flask import request, jsonify
 from flask_restx import Resource, fields, Namespace
 from models import Cultivo, db
+from versiones import respuesta_condicional
+from busqueda import indice_cultivos
+from serializacion import SerializadorFilas
 
 # Namespace para cultivos
 cultivos_ns = Namespace('cultivos', description='Gestión de cultivos')
@@ -27,15 +30,29 @@ cultivo_response = cultivos_ns.model('CultivoResponse', {
     'fecha_creacion': fields.String(description='Fecha de creación')
 })
 
+# Serializador directo de filas para el listado (mismo formato que cultivo_response)
+serializador_cultivos = SerializadorFilas(cultivo_response, {
+    'id': Cultivo.id,
+    'nombre': Cultivo.nombre,
+    'variedad': Cultivo.variedad,
+    'tipo': Cultivo.tipo,
+    'ciclo_dias': Cultivo.ciclo_dias,
+    'rendimiento_esperado': Cultivo.rendimiento_esperado,
+    'descripcion': Cultivo.descripcion,
+    'activo': Cultivo.activo,
+    'fecha_creacion': Cultivo.fecha_creacion
+})
+
 @cultivos_ns.route('/')
 class CultivosList(Resource):
+    @respuesta_condicional('cultivos')
     @cultivos_ns.doc('listar_cultivos')
-    @cultivos_ns.marshal_list_with(cultivo_response)
+    @cultivos_ns.response(200, 'Lista de cultivos', [cultivo_response])
     def get(self):
         """Obtener todos los cultivos"""
         try:
-            cultivos = Cultivo.query.filter_by(activo=True).all()
-            return [cultivo.to_dict() for cultivo in cultivos], 200
+            filas = db.session.query(*serializador_cultivos.columnas).filter(Cultivo.activo == True).all()
+            return serializador_cultivos.respuesta(filas)
         except Exception as e:
             return {'error': str(e)}, 500
     
@@ -125,6 +142,7 @@ class CultivoDetail(Resource):
 
 @cultivos_ns.route('/tipos')
 class CultivosTipos(Resource):
+    @respuesta_condicional('cultivos')
     @cultivos_ns.doc('obtener_tipos_cultivos')
     def get(self):
         """Obtener tipos de cultivos disponibles"""
@@ -137,23 +155,28 @@ class CultivosTipos(Resource):
 @cultivos_ns.route('/buscar')
 class CultivosBuscar(Resource):
     @cultivos_ns.doc('buscar_cultivos')
-    @cultivos_ns.param('q', 'Término de búsqueda')
+    @cultivos_ns.param('q', 'Término de búsqueda (tolera errores tipográficos)')
     @cultivos_ns.param('tipo', 'Filtrar por tipo de cultivo')
+    @cultivos_ns.param('modo', 'difuso (por defecto) o prefijo para autocompletado')
+    @cultivos_ns.param('limite', 'Número máximo de resultados (por defecto 20, máximo 100)')
     def get(self):
-        """Buscar cultivos por nombre, variedad o tipo"""
+        """Buscar cultivos por nombre o variedad, ordenados por relevancia"""
         try:
             query = request.args.get('q', '')
             tipo = request.args.get('tipo', '')
+            modo = request.args.get('modo', 'difuso')
+            limite = max(1, min(request.args.get('limite', 20, type=int), 100))
             
-            cultivos_query = Cultivo.query.filter_by(activo=True)
+            if modo not in ('difuso', 'prefijo'):
+                return {'error': 'El modo debe ser difuso o prefijo'}, 400
             
             if query:
-                cultivos_query = cultivos_query.filter(
-                    db.or_(
-                        Cultivo.nombre.ilike(f'%{query}%'),
-                        Cultivo.variedad.ilike(f'%{query}%')
-                    )
-                )
+                # Búsqueda sobre el índice de trigramas en memoria (sin recorrer la tabla)
+                if modo == 'prefijo':
+                    return indice_cultivos.autocompletar(query, tipo=tipo or None, limite=limite), 200
+                return indice_cultivos.buscar(query, tipo=tipo or None, limite=limite), 200
+            
+            cultivos_query = Cultivo.query.filter_by(activo=True)
             
             if tipo:
                 cultivos_query = cultivos_query.filter_by(tipo=tipo)
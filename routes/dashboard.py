@@ -0,0 +1,62 @@
+from flask import Response
+from flask_restx import Resource, Namespace
+import dashboard
+
+# Namespace para el dashboard
+dashboard_ns = Namespace('dashboard', description='Resumen precalculado para el dashboard')
+
+def _respuesta(seccion):
+    try:
+        contenido, fecha_generacion = dashboard.obtener(seccion)
+    except Exception as e:
+        return {'error': str(e)}, 500
+    respuesta = Response(contenido, mimetype='application/json')
+    respuesta.headers['X-Dashboard-Generado'] = fecha_generacion.isoformat()
+    return respuesta
+
+@dashboard_ns.route('/')
+class DashboardCompleto(Resource):
+    @dashboard_ns.doc('obtener_dashboard')
+    def get(self):
+        """Obtener el dashboard completo (estadísticas, KPIs, gráficos y alertas)"""
+        return _respuesta('completo')
+
+@dashboard_ns.route('/stats/')
+class DashboardStats(Resource):
+    @dashboard_ns.doc('obtener_dashboard_stats')
+    def get(self):
+        """Obtener las estadísticas generales del dashboard"""
+        return _respuesta('stats')
+
+@dashboard_ns.route('/kpis/')
+class DashboardKPIs(Resource):
+    @dashboard_ns.doc('obtener_dashboard_kpis')
+    def get(self):
+        """Obtener los KPIs con su variación frente a los 30 días anteriores"""
+        return _respuesta('kpis')
+
+@dashboard_ns.route('/graficos/')
+class DashboardGraficos(Resource):
+    @dashboard_ns.doc('obtener_dashboard_graficos')
+    def get(self):
+        """Obtener las series de los gráficos del dashboard"""
+        return _respuesta('graficos')
+
+@dashboard_ns.route('/alertas/')
+class DashboardAlertas(Resource):
+    @dashboard_ns.doc('obtener_dashboard_alertas')
+    def get(self):
+        """Obtener las anomalías más recientes como alertas"""
+        return _respuesta('alertas')
+
+@dashboard_ns.route('/refrescar/')
+class DashboardRefrescar(Resource):
+    @dashboard_ns.doc('refrescar_dashboard')
+    def post(self):
+        """Recalcular la instantánea del dashboard de inmediato"""
+        try:
+            dashboard.refrescar(forzar=True, esperar=True)
+            dashboard.sincronizar()
+            return {'message': 'Instantánea del dashboard recalculada'}, 200
+        except Exception as e:
+            return {'error': str(e)}, 500
@@ -1,11 +1,38 @@
 from flask import request, jsonify
 from flask_restx import Resource, fields, Namespace
 from models import Parcela, Cultivo, db
+from cache import crear_cache
+from invalidacion import suscribir
+from versiones import respuesta_condicional
+from referencias import referencia_cultivo
+from serializacion import SerializadorFilas
+from sqlalchemy import func, tuple_
 from datetime import datetime, date
 
 # Namespace para parcelas
 parcelas_ns = Namespace('parcelas', description='Gestión de parcelas')
 
+# Cache de lectura codigo -> parcela serializada (solo parcelas activas); 5 s sin escucha de invalidación
+cache_parcelas_codigo = crear_cache('parcelas_codigo', maxsize=4096, ttl=300, ttl_sin_escucha=5)
+
+def _invalidar_parcelas(evento):
+    """Desalojar de la cache los códigos modificados (en este u otro proceso)"""
+    if evento.get('todo'):
+        cache_parcelas_codigo.limpiar()
+    else:
+        cache_parcelas_codigo.invalidar(*evento['codigos'])
+
+suscribir('parcelas', _invalidar_parcelas)
+
+# Estadísticas agregadas; cualquier escritura en parcelas o cultivos las invalida
+cache_parcelas_estadisticas = crear_cache('parcelas_estadisticas', maxsize=1, ttl=300)
+
+def _invalidar_estadisticas(evento):
+    cache_parcelas_estadisticas.limpiar()
+
+suscribir('parcelas', _invalidar_estadisticas)
+suscribir('cultivos', _invalidar_estadisticas)
+
 # Modelos para documentación automática
 ubicacion_model = parcelas_ns.model('Ubicacion', {
     'lat': fields.Float(description='Latitud'),
@@ -40,15 +67,32 @@ parcela_response = parcelas_ns.model('ParcelaResponse', {
     'fecha_creacion': fields.String(description='Fecha de creación')
 })
 
+# Serializador directo de filas para los listados (mismo formato que parcela_response)
+serializador_parcelas = SerializadorFilas(parcela_response, {
+    'id': Parcela.id,
+    'codigo': Parcela.codigo,
+    'nombre': Parcela.nombre,
+    'area_hectareas': Parcela.area_hectareas,
+    'ubicacion': {'lat': Parcela.ubicacion_lat, 'lng': Parcela.ubicacion_lng},
+    'tipo_suelo': Parcela.tipo_suelo,
+    'ph_suelo': Parcela.ph_suelo,
+    'cultivo_id': Parcela.cultivo_id,
+    'fecha_siembra': Parcela.fecha_siembra,
+    'fecha_cosecha_estimada': Parcela.fecha_cosecha_estimada,
+    'activa': Parcela.activa,
+    'fecha_creacion': Parcela.fecha_creacion
+})
+
 @parcelas_ns.route('/')
 class ParcelasList(Resource):
+    @respuesta_condicional('parcelas')
     @parcelas_ns.doc('listar_parcelas')
-    @parcelas_ns.marshal_list_with(parcela_response)
+    @parcelas_ns.response(200, 'Lista de parcelas', [parcela_response])
     def get(self):
         """Obtener todas las parcelas activas"""
         try:
-            parcelas = Parcela.query.filter_by(activa=True).all()
-            return [parcela.to_dict() for parcela in parcelas], 200
+            filas = db.session.query(*serializador_parcelas.columnas).filter(Parcela.activa == True).all()
+            return serializador_parcelas.respuesta(filas)
         except Exception as e:
             return {'error': str(e)}, 500
     
@@ -66,7 +110,7 @@ class ParcelasList(Resource):
             
             # Validar cultivo si se proporciona
             if data.get('cultivo_id'):
-                cultivo = Cultivo.query.get(data['cultivo_id'])
+                cultivo = referencia_cultivo(data['cultivo_id'])
                 if not cultivo or not cultivo.activo:
                     return {'error': 'El cultivo especificado no existe o no está activo'}, 400
             
@@ -96,6 +140,89 @@ class ParcelasList(Resource):
             db.session.rollback()
             return {'error': str(e)}, 500
 
+lote_model = parcelas_ns.model('ParcelasLote', {
+    'ids': fields.List(fields.Integer, description='IDs de parcelas a obtener'),
+    'codigos': fields.List(fields.String, description='Códigos de parcelas a obtener')
+})
+
+lote_faltantes_model = parcelas_ns.model('ParcelasLoteFaltantes', {
+    'ids': fields.List(fields.Integer, description='IDs solicitados que no existen'),
+    'codigos': fields.List(fields.String, description='Códigos solicitados que no existen')
+})
+
+lote_response = parcelas_ns.model('ParcelasLoteResponse', {
+    'parcelas': fields.List(fields.Nested(parcela_response)),
+    'faltantes': fields.Nested(lote_faltantes_model)
+})
+
+# Máximo de claves por petición de lote
+MAX_CLAVES_LOTE = 1000
+
+def _buscar_lote(ids, codigos):
+    """Obtener parcelas por IDs y/o códigos en una sola consulta IN (...)"""
+    ids = list(dict.fromkeys(ids))
+    codigos = list(dict.fromkeys(codigos))
+    
+    if not ids and not codigos:
+        return {'error': 'Debe indicar ids o codigos'}, 400
+    if len(ids) + len(codigos) > MAX_CLAVES_LOTE:
+        return {'error': f'Se permiten como máximo {MAX_CLAVES_LOTE} claves por petición'}, 400
+    
+    condiciones = []
+    if ids:
+        condiciones.append(Parcela.id.in_(ids))
+    if codigos:
+        condiciones.append(Parcela.codigo.in_(codigos))
+    
+    parcelas = Parcela.query.filter(db.or_(*condiciones)).all()
+    
+    ids_encontrados = {parcela.id for parcela in parcelas}
+    codigos_encontrados = {parcela.codigo for parcela in parcelas}
+    
+    return {
+        'parcelas': [parcela.to_dict() for parcela in parcelas],
+        'faltantes': {
+            'ids': [i for i in ids if i not in ids_encontrados],
+            'codigos': [c for c in codigos if c not in codigos_encontrados]
+        }
+    }, 200
+
+@parcelas_ns.route('/lote')
+class ParcelasLote(Resource):
+    @parcelas_ns.doc('obtener_parcelas_lote')
+    @parcelas_ns.param('ids', 'IDs separados por coma (ej: 1,2,3)')
+    @parcelas_ns.param('codigos', 'Códigos separados por coma (ej: P001,P002)')
+    @parcelas_ns.response(200, 'Parcelas encontradas', lote_response)
+    def get(self):
+        """Obtener varias parcelas por IDs o códigos en una sola petición"""
+        try:
+            ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+            codigos = [c.strip() for c in request.args.get('codigos', '').split(',') if c.strip()]
+        except ValueError:
+            return {'error': 'Los ids deben ser números enteros'}, 400
+        
+        try:
+            return _buscar_lote(ids, codigos)
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    @parcelas_ns.doc('obtener_parcelas_lote_post')
+    @parcelas_ns.expect(lote_model)
+    @parcelas_ns.response(200, 'Parcelas encontradas', lote_response)
+    def post(self):
+        """Obtener varias parcelas por IDs o códigos (para listas largas)"""
+        try:
+            data = request.get_json() or {}
+            ids = [int(i) for i in data.get('ids') or []]
+            codigos = [str(c) for c in data.get('codigos') or []]
+        except (TypeError, ValueError):
+            return {'error': 'Los ids deben ser números enteros'}, 400
+        
+        try:
+            return _buscar_lote(ids, codigos)
+        except Exception as e:
+            return {'error': str(e)}, 500
+
 @parcelas_ns.route('/<int:parcela_id>')
 class ParcelaDetail(Resource):
     @parcelas_ns.doc('obtener_parcela')
@@ -128,7 +255,7 @@ class ParcelaDetail(Resource):
             
             # Validar cultivo si se proporciona
             if data.get('cultivo_id'):
-                cultivo = Cultivo.query.get(data['cultivo_id'])
+                cultivo = referencia_cultivo(data['cultivo_id'])
                 if not cultivo or not cultivo.activo:
                     return {'error': 'El cultivo especificado no existe o no está activo'}, 400
             
@@ -172,34 +299,53 @@ class ParcelaPorCodigo(Resource):
     @parcelas_ns.doc('obtener_parcela_por_codigo')
     @parcelas_ns.marshal_with(parcela_response)
     def get(self, codigo):
-        """Obtener parcela por código (acceso rápido con índice hash)"""
+        """Obtener parcela por código (acceso rápido con cache en memoria e índice hash)"""
         try:
-            parcela = Parcela.query.filter_by(codigo=codigo, activa=True).first_or_404()
-            return parcela.to_dict(), 200
+            # Un acierto en cache se sirve sin consultar la base de datos
+            parcela_dict = cache_parcelas_codigo.obtener(codigo)
+            if parcela_dict is None:
+                generacion = cache_parcelas_codigo.generacion()
+                parcela = Parcela.query.filter_by(codigo=codigo, activa=True).first_or_404()
+                parcela_dict = parcela.to_dict()
+                cache_parcelas_codigo.guardar(codigo, parcela_dict, generacion)
+            return parcela_dict, 200
         except Exception as e:
             return {'error': str(e)}, 500
 
+@parcelas_ns.route('/cache/estadisticas')
+class ParcelasCacheEstadisticas(Resource):
+    @parcelas_ns.doc('obtener_estadisticas_cache_parcelas')
+    def get(self):
+        """Obtener contadores de aciertos/fallos de la cache de parcelas por código"""
+        return cache_parcelas_codigo.estadisticas(), 200
+
 @parcelas_ns.route('/cultivo/<int:cultivo_id>')
 class ParcelasPorCultivo(Resource):
     @parcelas_ns.doc('obtener_parcelas_por_cultivo')
-    @parcelas_ns.marshal_list_with(parcela_response)
+    @parcelas_ns.response(200, 'Lista de parcelas', [parcela_response])
     def get(self, cultivo_id):
         """Obtener todas las parcelas de un cultivo específico"""
         try:
-            parcelas = Parcela.query.filter_by(cultivo_id=cultivo_id, activa=True).all()
-            return [parcela.to_dict() for parcela in parcelas], 200
+            filas = db.session.query(*serializador_parcelas.columnas).filter(
+                Parcela.cultivo_id == cultivo_id,
+                Parcela.activa == True
+            ).all()
+            return serializador_parcelas.respuesta(filas)
         except Exception as e:
             return {'error': str(e)}, 500
 
 @parcelas_ns.route('/disponibles')
 class ParcelasDisponibles(Resource):
     @parcelas_ns.doc('obtener_parcelas_disponibles')
-    @parcelas_ns.marshal_list_with(parcela_response)
+    @parcelas_ns.response(200, 'Lista de parcelas', [parcela_response])
     def get(self):
         """Obtener parcelas sin cultivo asignado"""
         try:
-            parcelas = Parcela.query.filter_by(cultivo_id=None, activa=True).all()
-            return [parcela.to_dict() for parcela in parcelas], 200
+            filas = db.session.query(*serializador_parcelas.columnas).filter(
+                Parcela.cultivo_id.is_(None),
+                Parcela.activa == True
+            ).all()
+            return serializador_parcelas.respuesta(filas)
         except Exception as e:
             return {'error': str(e)}, 500
 
@@ -207,28 +353,67 @@ class ParcelasDisponibles(Resource):
 class ParcelasEstadisticas(Resource):
     @parcelas_ns.doc('obtener_estadisticas_parcelas')
     def get(self):
-        """Obtener estadísticas generales de parcelas"""
+        """Obtener estadísticas generales de parcelas (una sola consulta, con cache)"""
         try:
-            total_parcelas = Parcela.query.filter_by(activa=True).count()
-            area_total = db.session.query(db.func.sum(Parcela.area_hectareas)).filter_by(activa=True).scalar() or 0
-            parcelas_con_cultivo = Parcela.query.filter(Parcela.cultivo_id.isnot(None), Parcela.activa == True).count()
-            parcelas_disponibles = total_parcelas - parcelas_con_cultivo
-            
-            # Distribución por tipo de suelo
-            tipos_suelo = db.session.query(
-                Parcela.tipo_suelo, 
-                db.func.count(Parcela.id).label('cantidad')
-            ).filter_by(activa=True).group_by(Parcela.tipo_suelo).all()
-            
-            return {
-                'total_parcelas': total_parcelas,
-                'area_total_hectareas': float(area_total),
-                'parcelas_con_cultivo': parcelas_con_cultivo,
-                'parcelas_disponibles': parcelas_disponibles,
-                'distribucion_tipos_suelo': [
-                    {'tipo': tipo[0] or 'No especificado', 'cantidad': tipo[1]} 
-                    for tipo in tipos_suelo
-                ]
-            }, 200
+            estadisticas = cache_parcelas_estadisticas.obtener('general')
+            if estadisticas is None:
+                generacion = cache_parcelas_estadisticas.generacion()
+                estadisticas = _calcular_estadisticas()
+                cache_parcelas_estadisticas.guardar('general', estadisticas, generacion)
+            return estadisticas, 200
         except Exception as e:
             return {'error': str(e)}, 500
+
+def _calcular_estadisticas():
+    """Totales, distribución por suelo y por cultivo en un solo recorrido (GROUPING SETS)"""
+    agrupado_suelo = func.grouping(Parcela.tipo_suelo).label('agrupado_suelo')
+    agrupado_cultivo = func.grouping(Parcela.cultivo_id).label('agrupado_cultivo')
+    
+    filas = db.session.query(
+        agrupado_suelo,
+        agrupado_cultivo,
+        Parcela.tipo_suelo,
+        Parcela.cultivo_id,
+        Cultivo.nombre.label('cultivo_nombre'),
+        func.count(Parcela.id).label('cantidad'),
+        func.count(Parcela.cultivo_id).label('con_cultivo'),
+        func.coalesce(func.sum(Parcela.area_hectareas), 0).label('area')
+    ).outerjoin(Cultivo, Parcela.cultivo_id == Cultivo.id).filter(
+        Parcela.activa == True
+    ).group_by(func.grouping_sets(
+        tuple_(),
+        tuple_(Parcela.tipo_suelo),
+        tuple_(Parcela.cultivo_id, Cultivo.nombre)
+    )).all()
+    
+    total_parcelas = 0
+    area_total = 0
+    parcelas_con_cultivo = 0
+    tipos_suelo = []
+    cultivos = []
+    for fila in filas:
+        if fila.agrupado_suelo and fila.agrupado_cultivo:
+            # Conjunto vacío: totales generales
+            total_parcelas = fila.cantidad
+            area_total = fila.area
+            parcelas_con_cultivo = fila.con_cultivo
+        elif not fila.agrupado_suelo:
+            tipos_suelo.append({'tipo': fila.tipo_suelo or 'No especificado', 'cantidad': fila.cantidad})
+        else:
+            cultivos.append({
+                'cultivo_id': fila.cultivo_id,
+                'cultivo_nombre': fila.cultivo_nombre or 'Sin cultivo',
+                'cantidad': fila.cantidad,
+                'area_hectareas': float(fila.area)
+            })
+    
+    cultivos.sort(key=lambda x: x['area_hectareas'], reverse=True)
+    
+    return {
+        'total_parcelas': total_parcelas,
+        'area_total_hectareas': float(area_total),
+        'parcelas_con_cultivo': parcelas_con_cultivo,
+        'parcelas_disponibles': total_parcelas - parcelas_con_cultivo,
+        'distribucion_tipos_suelo': tipos_suelo,
+        'distribucion_cultivos': cultivos
+    }
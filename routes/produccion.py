@@ -1,7 +1,15 @@
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context, current_app
 from flask_restx import Resource, fields, Namespace
+from werkzeug.exceptions import HTTPException, ServiceUnavailable
 from models import db
 from models import RegistroProduccion, Parcela, Cultivo
+from referencias import referencia_parcela, referencia_cultivo
+from ingesta import preparar_registro, ingerir, sin_clima, RegistroInvalido, MAX_LOTE
+from telemetria import completar_clima
+import escritura_agrupada
+import datos_adicionales
+from serializacion import SerializadorFilas
+import eventos_anomalia
 from datetime import datetime, date
 from sqlalchemy import and_, or_, func
 
@@ -25,7 +33,18 @@ registro_produccion_model = produccion_ns.model('RegistroProduccion', {
     'temperatura_promedio': fields.Float(description='Temperatura promedio en °C'),
     'precipitacion_mm': fields.Float(description='Precipitación en mm'),
     'humedad_relativa': fields.Float(description='Humedad relativa en %'),
-    'notas_anomalia': fields.String(description='Notas sobre anomalías detectadas')
+    'notas_anomalia': fields.String(description='Notas sobre anomalías detectadas'),
+    'datos_adicionales': fields.Raw(description='Datos libres (JSON): tractor, método de riego, lote de fertilizante...')
+})
+
+registro_ingesta_model = produccion_ns.inherit('RegistroIngesta', registro_produccion_model, {
+    'clave_idempotencia': fields.String(description='Clave única del envío; los reintentos con la misma clave no crean registros'),
+    'origen': fields.String(description='Equipo de origen; sin clave, se usa origen + parcela + fecha')
+})
+
+ingesta_model = produccion_ns.model('IngestaProduccion', {
+    'registros': fields.List(fields.Nested(registro_ingesta_model), required=True,
+                             description=f'Registros a ingerir (máximo {MAX_LOTE})')
 })
 
 registro_response = produccion_ns.model('RegistroProduccionResponse', {
@@ -40,9 +59,31 @@ registro_response = produccion_ns.model('RegistroProduccionResponse', {
     'condiciones_ambientales': fields.Nested(condiciones_ambientales_model),
     'anomalia_detectada': fields.Boolean(description='Si se detectó anomalía'),
     'desviacion_esperada': fields.Float(description='Desviación del rendimiento esperado'),
+    'datos_adicionales': fields.Raw(description='Datos libres (JSON)'),
     'fecha_creacion': fields.String(description='Fecha de creación del registro')
 })
 
+# Serializador directo de filas para los listados (mismo formato que registro_response)
+serializador_registros = SerializadorFilas(registro_response, {
+    'id': RegistroProduccion.id,
+    'parcela_id': RegistroProduccion.parcela_id,
+    'cultivo_id': RegistroProduccion.cultivo_id,
+    'fecha_registro': RegistroProduccion.fecha_registro,
+    'temporada': RegistroProduccion.temporada,
+    'cantidad_kg': RegistroProduccion.cantidad_kg,
+    'rendimiento_hectarea': RegistroProduccion.rendimiento_hectarea,
+    'calidad': RegistroProduccion.calidad,
+    'condiciones_ambientales': {
+        'temperatura_promedio': RegistroProduccion.temperatura_promedio,
+        'precipitacion_mm': RegistroProduccion.precipitacion_mm,
+        'humedad_relativa': RegistroProduccion.humedad_relativa
+    },
+    'anomalia_detectada': RegistroProduccion.anomalia_detectada,
+    'desviacion_esperada': RegistroProduccion.desviacion_esperada,
+    'datos_adicionales': RegistroProduccion.datos_adicionales,
+    'fecha_creacion': RegistroProduccion.fecha_creacion
+})
+
 @produccion_ns.route('/')
 class RegistrosProduccionList(Resource):
     @produccion_ns.doc('listar_registros_produccion')
@@ -51,11 +92,12 @@ class RegistrosProduccionList(Resource):
     @produccion_ns.param('temporada', 'Filtrar por temporada')
     @produccion_ns.param('fecha_inicio', 'Fecha de inicio (YYYY-MM-DD)')
     @produccion_ns.param('fecha_fin', 'Fecha de fin (YYYY-MM-DD)')
-    @produccion_ns.marshal_list_with(registro_response)
+    @produccion_ns.param('filtro_datos', 'Filtro sobre datos_adicionales, repetible: objeto JSON (contención) o ruta clave.subclave (existe)')
+    @produccion_ns.response(200, 'Lista de registros', [registro_response])
     def get(self):
         """Obtener registros de producción con filtros opcionales"""
         try:
-            query = RegistroProduccion.query
+            query = db.session.query(*serializador_registros.columnas)
             
             # Aplicar filtros
             parcela_id = request.args.get('parcela_id', type=int)
@@ -80,8 +122,15 @@ class RegistrosProduccionList(Resource):
                 fecha_fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
                 query = query.filter(RegistroProduccion.fecha_registro <= fecha_fin)
             
-            registros = query.order_by(RegistroProduccion.fecha_registro.desc()).all()
-            return [registro.to_dict() for registro in registros], 200
+            filtros_datos = request.args.getlist('filtro_datos')
+            if filtros_datos:
+                try:
+                    query = query.filter(*datos_adicionales.condiciones(filtros_datos))
+                except ValueError as e:
+                    return {'error': str(e)}, 400
+            
+            filas = query.order_by(RegistroProduccion.fecha_registro.desc()).all()
+            return serializador_registros.respuesta(filas)
         except Exception as e:
             return {'error': str(e)}, 500
     
@@ -93,45 +142,53 @@ class RegistrosProduccionList(Resource):
         try:
             data = request.get_json()
             
-            # Validar que existan la parcela y el cultivo
-            parcela = Parcela.query.get(data['parcela_id'])
-            if not parcela or not parcela.activa:
-                return {'error': 'La parcela especificada no existe o no está activa'}, 400
-            
-            cultivo = Cultivo.query.get(data['cultivo_id'])
-            if not cultivo or not cultivo.activo:
-                return {'error': 'El cultivo especificado no existe o no está activo'}, 400
+            # Validar parcela y cultivo y calcular rendimiento, desviación y anomalía
+            try:
+                valores = preparar_registro(data)
+            except RegistroInvalido as e:
+                return {'error': str(e)}, 400
             
-            # Calcular rendimiento por hectárea
-            rendimiento_hectarea = data['cantidad_kg'] / parcela.area_hectareas
-            
-            # Calcular desviación del rendimiento esperado
-            desviacion_esperada = rendimiento_hectarea - cultivo.rendimiento_esperado
-            
-            # Detectar anomalías (desviación mayor al 20% del rendimiento esperado)
-            umbral_anomalia = cultivo.rendimiento_esperado * 0.2
-            anomalia_detectada = abs(desviacion_esperada) > umbral_anomalia
-            
-            registro = RegistroProduccion(
-                parcela_id=data['parcela_id'],
-                cultivo_id=data['cultivo_id'],
-                fecha_registro=datetime.strptime(data['fecha_registro'], '%Y-%m-%d').date(),
-                temporada=data['temporada'],
-                cantidad_kg=data['cantidad_kg'],
-                rendimiento_hectarea=rendimiento_hectarea,
-                calidad=data.get('calidad'),
-                temperatura_promedio=data.get('temperatura_promedio'),
-                precipitacion_mm=data.get('precipitacion_mm'),
-                humedad_relativa=data.get('humedad_relativa'),
-                desviacion_esperada=desviacion_esperada,
-                anomalia_detectada=anomalia_detectada,
-                notas_anomalia=data.get('notas_anomalia')
-            )
+            if escritura_agrupada.activa():
+                # Commit compartido con los registros que llegan en el mismo intervalo
+                try:
+                    registro = escritura_agrupada.crear_registro(current_app._get_current_object(), valores)
+                except escritura_agrupada.ColaLlena as e:
+                    raise ServiceUnavailable(str(e), retry_after=1)
+                except escritura_agrupada.EscrituraPendiente as e:
+                    raise ServiceUnavailable(str(e), retry_after=5)
+                return registro.to_dict(), 201
             
+            registro = RegistroProduccion(**valores)
             db.session.add(registro)
+            if sin_clima(valores):
+                # Condiciones ambientales no informadas: clima del ciclo desde la telemetría
+                db.session.flush()
+                completar_clima(db.session, [registro.id])
             db.session.commit()
             
             return registro.to_dict(), 201
+        except HTTPException:
+            # 503 de la escritura agrupada: mensaje y Retry-After sin pasar por marshal_with
+            raise
+        except Exception as e:
+            db.session.rollback()
+            return {'error': str(e)}, 500
+
+@produccion_ns.route('/ingesta')
+class IngestaProduccion(Resource):
+    @produccion_ns.doc('ingerir_registros_produccion')
+    @produccion_ns.expect(ingesta_model)
+    def post(self):
+        """Ingerir un lote de registros de forma idempotente (los reintentos no duplican)"""
+        try:
+            data = request.get_json() or {}
+            registros = data.get('registros')
+            if not isinstance(registros, list) or not registros:
+                return {'error': 'Se requiere una lista de registros'}, 400
+            if len(registros) > MAX_LOTE:
+                return {'error': f'El lote supera el máximo de {MAX_LOTE} registros'}, 400
+            
+            return ingerir(registros), 200
         except Exception as e:
             db.session.rollback()
             return {'error': str(e)}, 500
@@ -158,11 +215,11 @@ class RegistroProduccionDetail(Resource):
             data = request.get_json()
             
             # Validar parcela y cultivo
-            parcela = Parcela.query.get(data['parcela_id'])
+            parcela = referencia_parcela(data['parcela_id'])
             if not parcela or not parcela.activa:
                 return {'error': 'La parcela especificada no existe o no está activa'}, 400
             
-            cultivo = Cultivo.query.get(data['cultivo_id'])
+            cultivo = referencia_cultivo(data['cultivo_id'])
             if not cultivo or not cultivo.activo:
                 return {'error': 'El cultivo especificado no existe o no está activo'}, 400
             
@@ -186,6 +243,8 @@ class RegistroProduccionDetail(Resource):
             registro.desviacion_esperada = desviacion_esperada
             registro.anomalia_detectada = anomalia_detectada
             registro.notas_anomalia = data.get('notas_anomalia')
+            if 'datos_adicionales' in data:
+                registro.datos_adicionales = data['datos_adicionales']
             
             db.session.commit()
             return registro.to_dict(), 200
@@ -208,17 +267,36 @@ class RegistroProduccionDetail(Resource):
 @produccion_ns.route('/anomalias')
 class RegistrosAnomalias(Resource):
     @produccion_ns.doc('obtener_registros_con_anomalias')
-    @produccion_ns.marshal_list_with(registro_response)
+    @produccion_ns.response(200, 'Lista de registros', [registro_response])
     def get(self):
         """Obtener todos los registros con anomalías detectadas"""
         try:
-            registros = RegistroProduccion.query.filter_by(anomalia_detectada=True).order_by(
-                RegistroProduccion.fecha_registro.desc()
-            ).all()
-            return [registro.to_dict() for registro in registros], 200
+            filas = db.session.query(*serializador_registros.columnas).filter(
+                RegistroProduccion.anomalia_detectada == True
+            ).order_by(RegistroProduccion.fecha_registro.desc()).all()
+            return serializador_registros.respuesta(filas)
         except Exception as e:
             return {'error': str(e)}, 500
 
+@produccion_ns.route('/anomalias/stream')
+class StreamAnomalias(Resource):
+    @produccion_ns.doc('stream_anomalias', params={'Last-Event-ID': {'in': 'header', 'description': 'Último evento recibido, para reanudar'}})
+    def get(self):
+        """Recibir las anomalías nuevas en tiempo real (Server-Sent Events)"""
+        ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('desde')
+        try:
+            cursor = eventos_anomalia.leer_cursor(ultimo_id) if ultimo_id else None
+        except ValueError:
+            return {'error': 'Last-Event-ID inválido'}, 400
+        # Cada stream retiene un hilo del worker: sin lugar, el cliente reintenta más tarde
+        if not eventos_anomalia.reservar_stream():
+            return {'error': 'Demasiados streams abiertos en este proceso'}, 503, {'Retry-After': '30'}
+        respuesta = Response(stream_with_context(eventos_anomalia.flujo(cursor)), mimetype='text/event-stream')
+        respuesta.call_on_close(eventos_anomalia.liberar_stream)
+        respuesta.headers['Cache-Control'] = 'no-cache'
+        respuesta.headers['X-Accel-Buffering'] = 'no'  # Sin buffer en nginx
+        return respuesta
+
 @produccion_ns.route('/estadisticas/temporada/<string:temporada>')
 class EstadisticasTemporada(Resource):
     @produccion_ns.doc('obtener_estadisticas_temporada')
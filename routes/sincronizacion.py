@@ -0,0 +1,27 @@
+from flask import request
+from flask_restx import Resource, Namespace
+import sincronizacion
+
+# Namespace para la sincronización incremental
+sync_ns = Namespace('sync', description='Sincronización incremental para clientes sin conexión')
+
+@sync_ns.route('')
+class Sincronizacion(Resource):
+    @sync_ns.doc('obtener_cambios')
+    @sync_ns.param('since', 'Marca de agua recibida en la sincronización anterior (0 = desde el inicio)')
+    @sync_ns.param('limite', f'Cambios por página (por defecto {sincronizacion.LIMITE_DEFECTO}, máximo {sincronizacion.LIMITE_MAXIMO})')
+    @sync_ns.param('tablas', 'Tablas a sincronizar separadas por coma (cultivos, parcelas, registros_produccion, predicciones_cosecha)')
+    def get(self):
+        """Obtener las filas cambiadas desde una marca de agua, paginadas"""
+        try:
+            since = request.args.get('since', 0, type=int)
+            limite = min(max(request.args.get('limite', sincronizacion.LIMITE_DEFECTO, type=int), 1),
+                         sincronizacion.LIMITE_MAXIMO)
+            tablas = [t.strip() for t in request.args.get('tablas', '').split(',') if t.strip()]
+            desconocidas = [t for t in tablas if t not in sincronizacion.MODELOS]
+            if desconocidas:
+                return {'error': f'Tablas no sincronizables: {", ".join(desconocidas)}'}, 400
+            
+            return sincronizacion.cambios_desde(since, limite, tablas), 200
+        except Exception as e:
+            return {'error': str(e)}, 500
@@ -0,0 +1,77 @@
+from flask import request
+from flask_restx import Resource, fields, Namespace
+from models import db
+from datetime import datetime
+import telemetria
+
+# Namespace para telemetría ambiental
+telemetria_ns = Namespace('telemetria', description='Telemetría ambiental de sensores de campo')
+
+# Modelos para documentación automática
+lectura_model = telemetria_ns.model('LecturaTelemetria', {
+    'parcela_id': fields.Integer(required=True, description='ID de la parcela'),
+    'momento': fields.String(required=True, description='Instante de la lectura (ISO 8601; sin zona = UTC)'),
+    'metrica': fields.String(required=True, description='temperatura (°C), precipitacion (mm) o humedad (%)'),
+    'valor': fields.Float(required=True, description='Valor medido')
+})
+
+lote_lecturas_model = telemetria_ns.model('LoteLecturas', {
+    'lecturas': fields.List(fields.Nested(lectura_model), required=True,
+                            description=f'Lecturas a ingerir (máximo {telemetria.MAX_LOTE})')
+})
+
+@telemetria_ns.route('/lecturas')
+class LecturasTelemetria(Resource):
+    @telemetria_ns.doc('ingerir_lecturas')
+    @telemetria_ns.expect(lote_lecturas_model)
+    def post(self):
+        """Ingerir un lote de lecturas de sensores (las lecturas repetidas se ignoran)"""
+        try:
+            data = request.get_json() or {}
+            lecturas = data.get('lecturas')
+            if not isinstance(lecturas, list) or not lecturas:
+                return {'error': 'Se requiere una lista de lecturas'}, 400
+            if len(lecturas) > telemetria.MAX_LOTE:
+                return {'error': f'El lote supera el máximo de {telemetria.MAX_LOTE} lecturas'}, 400
+            
+            resultado = telemetria.ingerir(lecturas)
+            # Un lote sin ninguna lectura válida es un error del cliente
+            if resultado['rechazadas'] == resultado['recibidas']:
+                return resultado, 400
+            return resultado, 200
+        except Exception as e:
+            db.session.rollback()
+            return {'error': str(e)}, 500
+
+@telemetria_ns.route('/parcela/<int:parcela_id>')
+class SerieTelemetria(Resource):
+    @telemetria_ns.doc('obtener_serie_telemetria')
+    @telemetria_ns.param('metrica', 'temperatura, precipitacion o humedad', required=True)
+    @telemetria_ns.param('granularidad', 'hora o dia (por defecto dia)')
+    @telemetria_ns.param('desde', 'Fecha de inicio (YYYY-MM-DD)')
+    @telemetria_ns.param('hasta', 'Fecha de fin, excluida (YYYY-MM-DD)')
+    def get(self, parcela_id):
+        """Obtener la serie agregada de una métrica de la parcela"""
+        try:
+            metrica = request.args.get('metrica')
+            if metrica not in telemetria.METRICAS:
+                return {'error': f"Métrica inválida (válidas: {', '.join(telemetria.METRICAS)})"}, 400
+            granularidad = request.args.get('granularidad', 'dia')
+            if granularidad not in telemetria.GRANULARIDADES:
+                return {'error': 'Granularidad inválida (válidas: hora, dia)'}, 400
+            
+            desde = request.args.get('desde')
+            hasta = request.args.get('hasta')
+            desde = datetime.strptime(desde, '%Y-%m-%d') if desde else None
+            hasta = datetime.strptime(hasta, '%Y-%m-%d') if hasta else None
+            
+            return {
+                'parcela_id': parcela_id,
+                'metrica': metrica,
+                'granularidad': granularidad,
+                'serie': telemetria.serie(parcela_id, metrica, granularidad, desde, hasta)
+            }, 200
+        except ValueError:
+            return {'error': 'Formato de fecha inválido. Use YYYY-MM-DD'}, 400
+        except Exception as e:
+            return {'error': str(e)}, 500
@@ -0,0 +1,129 @@
+"""Selección automática del modelo de predicción con validación cruzada temporal.
+
+Con `modelo='auto'`, /analisis/predicciones/crear evalúa cada candidato con
+TimeSeriesSplit sobre los registros en orden de fecha: cada pliegue entrena con el
+pasado y predice el período siguiente, sin mezclar el futuro en el entrenamiento.
+Los pliegues de todos los candidatos se reparten entre procesos (pool reutilizable de
+joblib/loky) y se espera como máximo SELECCION_MODELO_PRESUPUESTO_S segundos; los
+candidatos que no terminan a tiempo, o con algún pliegue que falla, quedan fuera. Gana
+el de menor RMSE fuera de muestra.
+
+El pool es uno por worker de gunicorn y lo comparten sus hilos. Con GUNICORN_WORKERS
+definido tiene núcleos // GUNICORN_WORKERS procesos (al menos 1), para que entre todos
+los workers no haya más procesos que núcleos; sin ella (servidor de desarrollo, un solo
+proceso) usa todos los núcleos. SELECCION_MODELO_PROCESOS lo fija a mano. Un pliegue que
+sigue en curso al agotarse el presupuesto no se interrumpe: ocupa su proceso hasta
+terminar y las peticiones siguientes esperan por ese hueco.
+
+Con 5 a 10 registros cada pliegue prueba uno o dos puntos, por eso MAE, RMSE y R²
+se calculan sobre todas las predicciones fuera de muestra juntas y no por pliegue.
+"""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import numpy as np
+from joblib.externals.loky import get_reusable_executor
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from sklearn.model_selection import TimeSeriesSplit
+from xgboost import XGBRegressor
+
+# Tipos de modelo: el orden define la preferencia ante empates
+MODELOS = {
+    'linear': lambda: LinearRegression(),
+    'random_forest': lambda: RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=1),
+    'xgboost': lambda: XGBRegressor(n_estimators=100, max_depth=3, learning_rate=0.1, random_state=42, n_jobs=1)
+}
+
+def crear_modelo(tipo):
+    """Instancia sin entrenar del tipo de modelo (linear si el tipo es desconocido)"""
+    return MODELOS.get(tipo, MODELOS['linear'])()
+
+def pliegues(cantidad, maximo=None):
+    """Divisiones TimeSeriesSplit para `cantidad` filas en orden temporal (al menos 2 de entrenamiento)"""
+    maximo = maximo or int(os.environ.get('SELECCION_MODELO_PLIEGUES', 5))
+    n_splits = max(1, min(maximo, cantidad - 2))
+    return list(TimeSeriesSplit(n_splits=n_splits).split(np.arange(cantidad)))
+
+def procesos_defecto():
+    """Procesos del pool por worker: núcleos repartidos entre GUNICORN_WORKERS, al menos 1"""
+    nucleos = os.cpu_count() or 1
+    workers = os.environ.get('GUNICORN_WORKERS')
+    if not workers:
+        return nucleos
+    return max(1, nucleos // max(1, int(workers)))
+
+def _evaluar_pliegue(tipo, X, y, entrenamiento, prueba):
+    # Se ejecuta en un proceso del pool: solo recibe y devuelve datos serializables
+    inicio = time.perf_counter()
+    modelo = crear_modelo(tipo)
+    modelo.fit(X[entrenamiento], y[entrenamiento])
+    return tipo, prueba, modelo.predict(X[prueba]), time.perf_counter() - inicio
+
+def _metricas(y, indices, predicciones):
+    reales = y[indices]
+    return {
+        'rmse': float(np.sqrt(mean_squared_error(reales, predicciones))),
+        'mae': float(mean_absolute_error(reales, predicciones)),
+        'r2': float(r2_score(reales, predicciones)) if len(reales) > 1 else None
+    }
+
+def seleccionar(X, y, candidatos=None, presupuesto=None, procesos=None):
+    """Evaluar los candidatos con CV temporal en paralelo y elegir el de menor RMSE.
+
+    Devuelve (tipo elegido o None si ninguno terminó sin errores, resumen para parametros_modelo).
+    """
+    candidatos = list(candidatos or MODELOS)
+    presupuesto = presupuesto or float(os.environ.get('SELECCION_MODELO_PRESUPUESTO_S', 10))
+    procesos = procesos or int(os.environ.get('SELECCION_MODELO_PROCESOS', procesos_defecto()))
+    X, y = np.asarray(X, dtype=float), np.asarray(y, dtype=float)
+    divisiones = pliegues(len(y))
+
+    inicio = time.perf_counter()
+    executor = get_reusable_executor(max_workers=procesos)
+    tipo_de = {executor.submit(_evaluar_pliegue, tipo, X, y, entrenamiento, prueba): tipo
+               for tipo in candidatos for entrenamiento, prueba in divisiones}
+    pendientes = set(tipo_de)
+    resultados = {tipo: [] for tipo in candidatos}
+    fallidos = {}
+    limite = inicio + presupuesto
+    while pendientes:
+        restante = limite - time.perf_counter()
+        if restante <= 0:
+            break
+        terminados, pendientes = wait(pendientes, timeout=restante, return_when=FIRST_COMPLETED)
+        for futuro in terminados:
+            try:
+                tipo, prueba, predicciones, segundos = futuro.result()
+            except Exception as e:
+                # Un candidato que falla (p. ej. con una serie corta) no descarta al resto
+                mensaje = str(e).splitlines()[0] if str(e) else ''
+                fallidos.setdefault(tipo_de[futuro], f'{type(e).__name__}: {mensaje}')
+                continue
+            resultados[tipo].append((prueba, predicciones, segundos))
+    # Los pliegues sin empezar se descartan; los que están en curso terminan sin esperarlos
+    for futuro in pendientes:
+        futuro.cancel()
+
+    evaluados = {}
+    for tipo in candidatos:
+        if tipo in fallidos or len(resultados[tipo]) < len(divisiones):
+            continue
+        indices = np.concatenate([prueba for prueba, _, _ in resultados[tipo]])
+        predicciones = np.concatenate([p for _, p, _ in resultados[tipo]])
+        evaluados[tipo] = dict(_metricas(y, indices, predicciones),
+                               segundos=round(sum(s for _, _, s in resultados[tipo]), 4))
+
+    elegido = min(evaluados, key=lambda tipo: evaluados[tipo]['rmse']) if evaluados else None
+    return elegido, {
+        'metodo': 'time_series_split',
+        'pliegues': len(divisiones),
+        'presupuesto_s': presupuesto,
+        'duracion_s': round(time.perf_counter() - inicio, 4),
+        'candidatos': evaluados,
+        'sin_terminar': [tipo for tipo in candidatos if tipo not in evaluados and tipo not in fallidos],
+        'fallidos': fallidos,
+        'seleccionado': elegido
+    }
@@ -0,0 +1,46 @@
+"""Serialización rápida de listados: de tuplas de columnas a JSON sin pasar por to_dict() + marshal.
+
+Cada serializador se construye a partir del modelo de respuesta de flask-restx (el mismo
+que documenta Swagger) y de un mapeo campo -> columna. Al crearse genera una función
+que arma el dict directamente por posición de columna, y el resultado se codifica con
+orjson, que serializa fechas en formato ISO de forma nativa.
+"""
+import orjson
+from flask import Response
+from flask_restx import fields
+
+class SerializadorFilas:
+    """Serializador precompilado para un modelo de respuesta de flask-restx"""
+
+    def __init__(self, modelo_respuesta, mapeo):
+        self.modelo_respuesta = modelo_respuesta
+        self.columnas = []
+        expresion = self._compilar(modelo_respuesta, mapeo)
+        codigo = f'def construir(f):\n    return {expresion}\n'
+        espacio = {}
+        exec(compile(codigo, f'<serializador {modelo_respuesta.name}>', 'exec'), espacio)
+        self.construir = espacio['construir']
+
+    def _compilar(self, modelo, mapeo):
+        # Todos los campos documentados deben tener origen, para que Swagger y la salida coincidan
+        faltantes = set(modelo) - set(mapeo)
+        if faltantes:
+            raise ValueError(f'Campos sin columna en {modelo.name}: {sorted(faltantes)}')
+
+        partes = []
+        for nombre, campo in modelo.items():
+            origen = mapeo[nombre]
+            if isinstance(campo, fields.Nested):
+                partes.append(f'{nombre!r}: {self._compilar(campo.nested, origen)}')
+            else:
+                partes.append(f'{nombre!r}: f[{len(self.columnas)}]')
+                self.columnas.append(origen)
+        return '{' + ', '.join(partes) + '}'
+
+    def serializar(self, filas):
+        """Bytes JSON de una lista de filas (tuplas en el orden de self.columnas)"""
+        construir = self.construir
+        return orjson.dumps([construir(fila) for fila in filas])
+
+    def respuesta(self, filas, status=200):
+        return Response(self.serializar(filas), status=status, mimetype='application/json')
@@ -0,0 +1,186 @@
+"""Servidor asyncio dedicado al stream de anomalías (/produccion/anomalias/stream).
+
+En gunicorn (gthread) cada stream SSE abierto retiene un hilo del worker. Este proceso
+sirve la misma ruta con una corrutina por cliente: un panel abierto cuesta un socket y
+unos KB de memoria, así que una instancia atiende cientos o miles de paneles sin
+quitarle hilos al CRUD. Comparte con la aplicación el hilo de escucha LISTEN y el buffer
+de eventos (eventos_anomalia.difusor); solo consulta la base de datos al reanudar desde
+un cursor que ya salió del buffer, o cada ANOMALIAS_SONDEO segundos si no hay escucha.
+
+    python -m servidor_stream --puerto 8001
+
+El proxy reverso enruta la ruta del stream a este puerto y el resto a gunicorn (ver
+README). Responde GET /health para el balanceador.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+import eventos_anomalia
+from app import app, allowed_origins
+from invalidacion import escucha_activa, iniciar_escucha
+
+logger = logging.getLogger(__name__)
+
+RUTA = '/produccion/anomalias/stream'
+MAX_CABECERAS = 16 * 1024
+
+_aviso = None
+
+def max_clientes():
+    return int(os.environ.get('ANOMALIAS_STREAM_MAX_CLIENTES', 5000))
+
+def _en_contexto(funcion, *args):
+    # Lecturas de la tabla en el pool de hilos del loop, con su propia sesión
+    with app.app_context():
+        return funcion(*args)
+
+async def _consultar(funcion, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, partial(_en_contexto, funcion, *args))
+
+def _renovar_aviso():
+    """En el loop: despertar a los clientes que esperan y preparar el aviso siguiente"""
+    global _aviso
+    aviso, _aviso = _aviso, asyncio.Event()
+    aviso.set()
+
+def _respuesta(escritor, estado, cabeceras=(), cuerpo=b''):
+    lineas = [f'HTTP/1.1 {estado}', *[f'{nombre}: {valor}' for nombre, valor in cabeceras]]
+    if cuerpo:
+        lineas.append(f'Content-Length: {len(cuerpo)}')
+    escritor.write(('\r\n'.join(lineas) + '\r\n\r\n').encode() + cuerpo)
+
+async def _leer_peticion(lector):
+    """(ruta, query, cabeceras en minúsculas) de la petición, o None si no es válida"""
+    try:
+        datos = await asyncio.wait_for(lector.readuntil(b'\r\n\r\n'), 10)
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        return None
+    lineas = datos.decode('latin-1').split('\r\n')
+    partes = lineas[0].split(' ')
+    if len(partes) != 3 or partes[0] != 'GET':
+        return None
+    url = urlsplit(partes[1])
+    cabeceras = {}
+    for linea in lineas[1:]:
+        nombre, _, valor = linea.partition(':')
+        if nombre:
+            cabeceras[nombre.strip().lower()] = valor.strip()
+    return url.path, parse_qs(url.query), cabeceras
+
+async def _flujo(escritor, cursor):
+    """Enviar los eventos desde el cursor hasta que el cliente cierre la conexión"""
+    escritor.write(b'retry: 5000\n\n')
+    if cursor is None:
+        if escucha_activa() and eventos_anomalia.difusor.base is not None:
+            cursor = eventos_anomalia.difusor.ultimo
+        else:
+            cursor = await _consultar(eventos_anomalia.inicio_tabla)
+    await escritor.drain()
+
+    ping = eventos_anomalia.intervalo_ping()
+    while True:
+        # Tomar el aviso antes de mirar el buffer para no perder un evento intermedio
+        aviso = _aviso
+        escuchando = escucha_activa()
+        eventos = eventos_anomalia.difusor.desde(cursor) if escuchando else None
+        if eventos is None:
+            eventos = await _consultar(eventos_anomalia.leer_tabla, cursor)
+        for cursor_evento, datos in eventos:
+            escritor.write(eventos_anomalia.mensaje(cursor_evento, datos).encode())
+            cursor = cursor_evento
+        if eventos:
+            await escritor.drain()
+            continue
+
+        try:
+            if escuchando:
+                await asyncio.wait_for(aviso.wait(), ping)
+            else:
+                await asyncio.sleep(eventos_anomalia.intervalo_sondeo())
+                raise asyncio.TimeoutError
+        except asyncio.TimeoutError:
+            # Comentario SSE: mantiene viva la conexión y detecta clientes que se fueron
+            escritor.write(b': ping\n\n')
+            await escritor.drain()
+
+class ServidorStream:
+    """Acepta conexiones HTTP y atiende cada stream en una corrutina"""
+
+    def __init__(self):
+        self.clientes = 0
+
+    async def atender(self, lector, escritor):
+        try:
+            peticion = await _leer_peticion(lector)
+            if peticion is None:
+                _respuesta(escritor, '400 Bad Request', [('Connection', 'close')])
+                return
+            ruta, query, cabeceras = peticion
+            if ruta == '/health':
+                _respuesta(escritor, '200 OK', [('Content-Type', 'application/json'), ('Connection', 'close')],
+                           b'{"status": "healthy"}')
+                return
+            if ruta != RUTA:
+                _respuesta(escritor, '404 Not Found', [('Connection', 'close')])
+                return
+
+            cors = []
+            if cabeceras.get('origin') in allowed_origins:
+                cors = [('Access-Control-Allow-Origin', cabeceras['origin']),
+                        ('Access-Control-Allow-Credentials', 'true'), ('Vary', 'Origin')]
+            ultimo_id = cabeceras.get('last-event-id') or query.get('desde', [None])[0]
+            try:
+                cursor = await _consultar(eventos_anomalia.leer_cursor, ultimo_id) if ultimo_id else None
+            except ValueError:
+                _respuesta(escritor, '400 Bad Request', [*cors, ('Connection', 'close')],
+                           b'{"error": "Last-Event-ID inv\\u00e1lido"}')
+                return
+            if self.clientes >= max_clientes():
+                eventos_anomalia.streams_rechazados.incrementar()
+                _respuesta(escritor, '503 Service Unavailable', [*cors, ('Retry-After', '30'), ('Connection', 'close')])
+                return
+
+            self.clientes += 1
+            try:
+                _respuesta(escritor, '200 OK', [
+                    ('Content-Type', 'text/event-stream'), ('Cache-Control', 'no-cache'),
+                    ('X-Accel-Buffering', 'no'), ('Connection', 'close'), *cors
+                ])
+                await _flujo(escritor, cursor)
+            finally:
+                self.clientes -= 1
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception:
+            logger.exception('Error en el stream de anomalías')
+        finally:
+            escritor.close()
+
+async def servir(host, puerto):
+    global _aviso
+    loop = asyncio.get_running_loop()
+    _aviso = asyncio.Event()
+    # El hilo de escucha publica en el difusor; los clientes esperan en el loop
+    eventos_anomalia.difusor.al_publicar(lambda: loop.call_soon_threadsafe(_renovar_aviso))
+    if iniciar_escucha(app) is None:
+        logger.warning('Sin escucha LISTEN: el stream consultará la tabla cada %ss',
+                       eventos_anomalia.intervalo_sondeo())
+    servidor = ServidorStream()
+    async with await asyncio.start_server(servidor.atender, host, puerto, limit=MAX_CABECERAS) as socket_servidor:
+        logger.info('Stream de anomalías en %s:%s', host, puerto)
+        await socket_servidor.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Servidor asyncio del stream de anomalías')
+    parser.add_argument('--host', default=os.environ.get('ANOMALIAS_STREAM_HOST', '0.0.0.0'))
+    parser.add_argument('--puerto', type=int, default=int(os.environ.get('ANOMALIAS_STREAM_PUERTO', 8001)))
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(servir(args.host, args.puerto))
+
+if __name__ == '__main__':
+    main()
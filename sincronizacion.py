@@ -0,0 +1,153 @@
+"""Registro de cambios para la sincronización incremental de clientes sin conexión.
+
+Cada flush que crea, modifica o borra cultivos, parcelas, registros de producción o
+predicciones anota la fila en `cambios` con un número de secuencia nuevo, dentro de la
+misma transacción. Solo se conserva el último cambio de cada fila, así que la tabla
+crece con el número de filas y no con el de escrituras. Las bajas lógicas
+(activo/activa = False) son modificaciones normales; los borrados físicos quedan
+marcados como eliminados. Un cliente pide /sync?since=<marca> y recibe las filas
+cambiadas desde entonces junto con la nueva marca de agua.
+
+La marca de agua es un xid de PostgreSQL: cada anotación guarda el xid de su
+transacción y /sync solo entrega las de transacciones por debajo del horizonte
+(invalidacion.horizonte_transacciones), que ya terminaron todas. Así una transacción
+lenta no queda detrás de la marca de un cliente y los escritores no se bloquean entre
+sí; a cambio, una transacción abierta mucho tiempo demora /sync mientras dure.
+
+Las filas existentes antes de activar el registro (o cargadas con COPY) se anotan con
+`python -m sincronizacion --inicializar`.
+"""
+import argparse
+from datetime import datetime
+
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import Session
+
+from invalidacion import XID_ACTUAL, horizonte_transacciones
+from models import db, Cultivo, Parcela, RegistroProduccion, PrediccionCosecha, Cambio
+
+# Modelos sincronizables por nombre de tabla
+MODELOS = {modelo.__tablename__: modelo for modelo in (Cultivo, Parcela, RegistroProduccion, PrediccionCosecha)}
+
+LIMITE_DEFECTO = 500
+LIMITE_MAXIMO = 5000
+
+_SQL_REGISTRAR = text(
+    'INSERT INTO cambios (tabla, fila_id, seq, xid, eliminado, fecha_cambio) '
+    f"VALUES (:tabla, :fila_id, nextval('cambios_seq'), {XID_ACTUAL}, :eliminado, :fecha) "
+    'ON CONFLICT (tabla, fila_id) DO UPDATE SET seq = EXCLUDED.seq, xid = EXCLUDED.xid, '
+    'eliminado = EXCLUDED.eliminado, fecha_cambio = EXCLUDED.fecha_cambio'
+)
+
+def registrar(session, tabla, ids=(), eliminados=()):
+    """Anotar filas modificadas y borradas en la transacción actual.
+
+    Se llama desde el after_flush; las escrituras masivas que no pasan por el ORM
+    (INSERT ... ON CONFLICT, COPY) deben llamarla con los ids afectados.
+    """
+    fecha = datetime.utcnow()
+    parametros = [{'tabla': tabla, 'fila_id': i, 'eliminado': False, 'fecha': fecha} for i in ids]
+    parametros += [{'tabla': tabla, 'fila_id': i, 'eliminado': True, 'fecha': fecha} for i in eliminados]
+    if not parametros:
+        return
+    session.connection().execute(_SQL_REGISTRAR, parametros)
+
+@event.listens_for(Session, 'after_flush')
+def _despues_flush(session, flush_context):
+    if session.connection().dialect.name != 'postgresql':
+        return
+    modificados = {}
+    eliminados = {}
+    for obj in list(session.new) + list(session.dirty):
+        if getattr(obj, '__tablename__', None) not in MODELOS:
+            continue
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        modificados.setdefault(obj.__tablename__, set()).add(obj.id)
+    for obj in session.deleted:
+        if getattr(obj, '__tablename__', None) in MODELOS:
+            eliminados.setdefault(obj.__tablename__, set()).add(obj.id)
+
+    for tabla in sorted(set(modificados) | set(eliminados)):
+        registrar(session, tabla, modificados.get(tabla, ()), eliminados.get(tabla, ()))
+
+def cambios_desde(since, limite=LIMITE_DEFECTO, tablas=None):
+    """Página de cambios de transacciones con xid >= since ya terminadas, en orden de xid.
+
+    Devuelve las filas actuales agrupadas por tabla, los ids eliminados, la marca de
+    agua para la próxima petición y si quedan más cambios por pedir. Una página no
+    parte nunca una transacción; si una sola supera el límite, se entrega completa.
+    """
+    horizonte = horizonte_transacciones(db.session.connection())
+    consulta = select(Cambio.tabla, Cambio.fila_id, Cambio.xid, Cambio.eliminado).where(Cambio.xid >= since)
+    if horizonte is not None:
+        consulta = consulta.where(Cambio.xid < horizonte)
+    if tablas:
+        consulta = consulta.where(Cambio.tabla.in_(tablas))
+    pagina = db.session.execute(consulta.order_by(Cambio.xid, Cambio.seq).limit(limite + 1)).all()
+    hay_mas = len(pagina) > limite
+    if not hay_mas:
+        hasta = max(since, horizonte) if horizonte is not None else (pagina[-1].xid + 1 if pagina else since)
+    elif pagina[limite].xid != pagina[0].xid:
+        # Cortar antes de la transacción que no entra completa
+        hasta = pagina[limite].xid
+        pagina = [cambio for cambio in pagina if cambio.xid < hasta]
+    else:
+        hasta = pagina[0].xid + 1
+        pagina = db.session.execute(consulta.where(Cambio.xid == pagina[0].xid).order_by(Cambio.seq)).all()
+
+    ids_por_tabla = {}
+    eliminados = {}
+    for cambio in pagina:
+        if cambio.eliminado:
+            eliminados.setdefault(cambio.tabla, []).append(cambio.fila_id)
+        else:
+            ids_por_tabla.setdefault(cambio.tabla, []).append(cambio.fila_id)
+
+    filas = {}
+    for tabla, ids in ids_por_tabla.items():
+        modelo = MODELOS[tabla]
+        encontrados = {fila.id: fila for fila in modelo.query.filter(modelo.id.in_(ids))}
+        filas[tabla] = [encontrados[i].to_dict() for i in ids if i in encontrados]
+        # Una fila anotada y borrada sin pasar por el registro se informa como eliminada
+        faltantes = [i for i in ids if i not in encontrados]
+        if faltantes:
+            eliminados.setdefault(tabla, []).extend(faltantes)
+
+    return {
+        'since': since,
+        'hasta': hasta,
+        'hay_mas': hay_mas,
+        'cambios': filas,
+        'eliminados': eliminados
+    }
+
+def inicializar(conexion):
+    """Anotar las filas que todavía no figuran en `cambios` (datos previos o cargas masivas)"""
+    total = 0
+    for tabla in MODELOS:
+        resultado = conexion.execute(text(
+            'INSERT INTO cambios (tabla, fila_id, seq, xid, eliminado, fecha_cambio) '
+            f"SELECT :tabla, t.id, nextval('cambios_seq'), {XID_ACTUAL}, false, CURRENT_TIMESTAMP FROM {tabla} t "
+            'WHERE NOT EXISTS (SELECT 1 FROM cambios c WHERE c.tabla = :tabla AND c.fila_id = t.id)'
+        ), {'tabla': tabla})
+        total += resultado.rowcount
+    return total
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Registro de cambios para /sync')
+    parser.add_argument('--inicializar', action='store_true',
+                        help='Anotar en cambios las filas existentes que aún no figuran')
+    args = parser.parse_args(argv)
+    if not args.inicializar:
+        parser.print_help()
+        return
+
+    from app import app
+    with app.app_context():
+        total = inicializar(db.session)
+        db.session.commit()
+    print(f'{total} filas anotadas en cambios')
+
+if __name__ == '__main__':
+    main()
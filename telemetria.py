@@ -0,0 +1,214 @@
+"""Telemetría ambiental de sensores de campo y agregados por hora y por día.
+
+Las lecturas crudas (parcela, instante, métrica, valor) se guardan en `telemetria` y,
+en la misma sentencia que las inserta, se suman a los agregados por hora y por día de
+`telemetria_resumen` (cantidad, suma, mínimo y máximo). Una lectura repetida por un
+reintento del sensor se ignora y no altera los agregados.
+
+Los registros de producción sin condiciones ambientales toman el clima del ciclo del
+cultivo (los `ciclo_dias` anteriores a la fecha del registro) desde los agregados
+diarios: temperatura y humedad promedio, precipitación acumulada.
+
+La retención (`python -m telemetria --depurar`, p. ej. desde cron) borra las lecturas
+crudas con más de TELEMETRIA_RETENCION_DIAS días y los agregados por hora con más de
+TELEMETRIA_RETENCION_HORAS_DIAS; los agregados diarios se conservan.
+"""
+import argparse
+import math
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from models import db
+from referencias import referencia_parcela
+
+# Código de cada métrica en la columna metrica (smallint)
+METRICAS = {'temperatura': 1, 'precipitacion': 2, 'humedad': 3}
+GRANULARIDADES = {'hora': 'hour', 'dia': 'day'}
+
+MAX_LOTE = 5000
+LOTE_BORRADO = 50000
+
+class LecturaInvalida(ValueError):
+    """Lectura de telemetría que no puede guardarse"""
+
+def _agregar(granularidad):
+    unidad = GRANULARIDADES[granularidad]
+    return (
+        'INSERT INTO telemetria_resumen (parcela_id, metrica, granularidad, inicio, cantidad, suma, minimo, maximo) '
+        f"SELECT parcela_id, metrica, '{granularidad}', date_trunc('{unidad}', momento), "
+        # real -> numeric conserva el valor decimal enviado (0.1 y no 0.100000001)
+        'count(*), sum(valor::numeric)::float8, min(valor)::numeric::float8, max(valor)::numeric::float8 '
+        'FROM nuevas GROUP BY 1, 2, 4 ORDER BY 1, 2, 4 '
+        'ON CONFLICT (parcela_id, metrica, granularidad, inicio) DO UPDATE SET '
+        'cantidad = telemetria_resumen.cantidad + EXCLUDED.cantidad, '
+        'suma = telemetria_resumen.suma + EXCLUDED.suma, '
+        'minimo = LEAST(telemetria_resumen.minimo, EXCLUDED.minimo), '
+        'maximo = GREATEST(telemetria_resumen.maximo, EXCLUDED.maximo)'
+    )
+
+# Inserta el lote y suma a los agregados solo las lecturas nuevas, en una sentencia.
+# Los agregados se actualizan en orden de clave para que dos lotes no se interbloqueen.
+_SQL_INGESTA = text(
+    'WITH nuevas AS ('
+    'INSERT INTO telemetria (parcela_id, metrica, momento, valor) '
+    'SELECT * FROM unnest(CAST(:parcelas AS integer[]), CAST(:metricas AS smallint[]), '
+    'CAST(:momentos AS timestamp[]), CAST(:valores AS real[])) '
+    'ON CONFLICT DO NOTHING RETURNING parcela_id, metrica, momento, valor'
+    f'), por_hora AS ({_agregar("hora")} RETURNING 1) '
+    f'{_agregar("dia")} RETURNING (SELECT count(*) FROM nuevas)'
+)
+
+# Clima del ciclo de cada registro desde los agregados diarios
+_SQL_CLIMA_CICLO = '''
+    SELECT r.id,
+           SUM(t.suma) FILTER (WHERE t.metrica = 1) / NULLIF(SUM(t.cantidad) FILTER (WHERE t.metrica = 1), 0) AS temperatura,
+           SUM(t.suma) FILTER (WHERE t.metrica = 2) AS precipitacion,
+           SUM(t.suma) FILTER (WHERE t.metrica = 3) / NULLIF(SUM(t.cantidad) FILTER (WHERE t.metrica = 3), 0) AS humedad
+    FROM registros_produccion r
+    JOIN cultivos c ON c.id = r.cultivo_id
+    JOIN telemetria_resumen t ON t.parcela_id = r.parcela_id AND t.granularidad = 'dia'
+         AND t.inicio > r.fecha_registro - c.ciclo_dias AND t.inicio < r.fecha_registro + 1
+    WHERE r.id = ANY(CAST(:ids AS integer[]))
+    GROUP BY r.id
+'''
+
+_SQL_COMPLETAR_CLIMA = text(
+    'UPDATE registros_produccion r SET '
+    'temperatura_promedio = COALESCE(r.temperatura_promedio, c.temperatura), '
+    'precipitacion_mm = COALESCE(r.precipitacion_mm, c.precipitacion), '
+    'humedad_relativa = COALESCE(r.humedad_relativa, c.humedad) '
+    f'FROM ({_SQL_CLIMA_CICLO}) c WHERE r.id = c.id '
+    'AND (r.temperatura_promedio IS NULL OR r.precipitacion_mm IS NULL OR r.humedad_relativa IS NULL) '
+    'RETURNING r.id, r.temperatura_promedio, r.precipitacion_mm, r.humedad_relativa'
+)
+
+def _momento(valor):
+    """Instante ISO 8601 a datetime UTC sin zona horaria"""
+    momento = datetime.fromisoformat(str(valor).replace('Z', '+00:00'))
+    if momento.tzinfo is not None:
+        momento = momento.astimezone(timezone.utc).replace(tzinfo=None)
+    return momento
+
+def preparar_lectura(data):
+    parcela_id = int(data['parcela_id'])
+    parcela = referencia_parcela(parcela_id)
+    if not parcela:
+        raise LecturaInvalida('La parcela especificada no existe')
+    metrica = METRICAS.get(data['metrica'])
+    if metrica is None:
+        raise LecturaInvalida(f"Métrica desconocida: {data['metrica']} (válidas: {', '.join(METRICAS)})")
+    valor = float(data['valor'])
+    # float() acepta "NaN" e "Infinity", que corromperían la suma y los extremos de los agregados
+    if not math.isfinite(valor):
+        raise LecturaInvalida('El valor debe ser un número finito')
+    return parcela_id, metrica, _momento(data['momento']), valor
+
+def ingerir(lecturas):
+    """Validar e insertar un lote de lecturas actualizando los agregados; requiere contexto de aplicación"""
+    validas = []
+    errores = []
+    for indice, data in enumerate(lecturas):
+        try:
+            validas.append(preparar_lectura(data))
+        except (LecturaInvalida, KeyError, TypeError, ValueError) as e:
+            error = f'Falta el campo {e}' if isinstance(e, KeyError) else str(e)
+            errores.append({'indice': indice, 'error': error})
+
+    insertadas = 0
+    if validas:
+        parcelas, metricas, momentos, valores = (list(columna) for columna in zip(*validas))
+        insertadas = db.session.execute(_SQL_INGESTA, {
+            'parcelas': parcelas, 'metricas': metricas, 'momentos': momentos, 'valores': valores
+        }).scalar() or 0
+        db.session.commit()
+
+    return {
+        'recibidas': len(lecturas),
+        'insertadas': insertadas,
+        'duplicadas': len(validas) - insertadas,
+        'rechazadas': len(errores),
+        'errores': errores
+    }
+
+def serie(parcela_id, metrica, granularidad='dia', desde=None, hasta=None):
+    """Serie agregada de una métrica de la parcela"""
+    condiciones = ['parcela_id = :parcela_id', 'metrica = :metrica', 'granularidad = :granularidad']
+    parametros = {'parcela_id': parcela_id, 'metrica': METRICAS[metrica], 'granularidad': granularidad}
+    if desde is not None:
+        condiciones.append('inicio >= :desde')
+        parametros['desde'] = desde
+    if hasta is not None:
+        condiciones.append('inicio < :hasta')
+        parametros['hasta'] = hasta
+    filas = db.session.execute(text(
+        'SELECT inicio, cantidad, suma, minimo, maximo FROM telemetria_resumen '
+        f"WHERE {' AND '.join(condiciones)} ORDER BY inicio"
+    ), parametros)
+    return [{
+        'inicio': fila.inicio.isoformat(),
+        'lecturas': fila.cantidad,
+        'promedio': fila.suma / fila.cantidad,
+        'suma': fila.suma,
+        'minimo': fila.minimo,
+        'maximo': fila.maximo
+    } for fila in filas]
+
+def clima_registros(ids):
+    """Clima del ciclo de cada registro: {id: {'temperatura', 'precipitacion', 'humedad'}}"""
+    if not ids:
+        return {}
+    filas = db.session.execute(text(_SQL_CLIMA_CICLO), {'ids': list(ids)})
+    return {fila.id: {'temperatura': fila.temperatura, 'precipitacion': fila.precipitacion,
+                      'humedad': fila.humedad} for fila in filas}
+
+def completar_clima(session, ids):
+    """Completar con telemetría las condiciones ambientales vacías de los registros.
+
+    Devuelve {id: (temperatura, precipitacion, humedad)} de los registros modificados.
+    """
+    if not ids:
+        return {}
+    filas = session.execute(_SQL_COMPLETAR_CLIMA, {'ids': list(ids)})
+    return {fila[0]: tuple(fila[1:]) for fila in filas}
+
+def depurar(dias_crudos=None, dias_horas=None, ahora=None):
+    """Borrar lecturas crudas y agregados por hora vencidos, en lotes. Devuelve las filas borradas"""
+    ahora = ahora or datetime.utcnow()
+    dias_crudos = dias_crudos or int(os.environ.get('TELEMETRIA_RETENCION_DIAS', 30))
+    dias_horas = dias_horas or int(os.environ.get('TELEMETRIA_RETENCION_HORAS_DIAS', 400))
+    borradas = {'telemetria': 0, 'telemetria_resumen': 0}
+
+    objetivos = (
+        ('telemetria', 'momento < :limite', ahora - timedelta(days=dias_crudos)),
+        ('telemetria_resumen', "granularidad = 'hora' AND inicio < :limite", ahora - timedelta(days=dias_horas))
+    )
+    for tabla, condicion, limite in objetivos:
+        # Lotes cortos: cada commit libera bloqueos y permite a autovacuum avanzar
+        while True:
+            cantidad = db.session.execute(text(
+                f'DELETE FROM {tabla} WHERE ctid IN (SELECT ctid FROM {tabla} WHERE {condicion} LIMIT :lote)'
+            ), {'limite': limite, 'lote': LOTE_BORRADO}).rowcount
+            db.session.commit()
+            borradas[tabla] += cantidad
+            if cantidad < LOTE_BORRADO:
+                break
+    return borradas
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mantenimiento de la telemetría ambiental')
+    parser.add_argument('--depurar', action='store_true',
+                        help='Borrar lecturas crudas y agregados por hora fuera de la retención')
+    args = parser.parse_args(argv)
+    if not args.depurar:
+        parser.print_help()
+        return
+
+    from app import app
+    with app.app_context():
+        borradas = depurar()
+    print(f"{borradas['telemetria']} lecturas crudas y {borradas['telemetria_resumen']} agregados por hora borrados")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Versiones por tabla y respuestas condicionales (ETag / If-None-Match).
+
+Cada transacción que modifica una tabla versionada incrementa su contador en
+`versiones_tabla` dentro de la misma transacción. Los endpoints de catálogo usan
+ese contador como ETag fuerte, de modo que una petición con If-None-Match vigente
+se responde con 304 sin leer las filas de la entidad.
+"""
+from functools import wraps
+
+from flask import request, Response
+from flask_restx.utils import unpack
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from werkzeug.http import quote_etag
+
+from cache import crear_cache
+from invalidacion import al_registrar_cambios, suscribir
+from models import db, VersionTabla
+
+TABLAS_VERSIONADAS = ('cultivos', 'parcelas')
+
+# TTL corto como red de seguridad si el hilo de escucha no está activo
+cache_versiones = crear_cache('versiones_tabla', maxsize=len(TABLAS_VERSIONADAS), ttl=5)
+
+_SQL_INCREMENTAR = text(
+    'INSERT INTO versiones_tabla (tabla, version, fecha_actualizacion) '
+    'VALUES (:tabla, 1, CURRENT_TIMESTAMP) '
+    'ON CONFLICT (tabla) DO UPDATE SET version = versiones_tabla.version + 1, '
+    'fecha_actualizacion = CURRENT_TIMESTAMP'
+)
+
+def incrementar_version(conexion, tabla):
+    """Incrementar la versión en la transacción de `conexion` (cargas que no pasan por el ORM)"""
+    conexion.execute(_SQL_INCREMENTAR, {'tabla': tabla})
+
+@al_registrar_cambios
+def _incrementar_version(session, tabla):
+    """Incrementar la versión de la tabla una sola vez por transacción"""
+    if tabla not in TABLAS_VERSIONADAS:
+        return
+    incrementadas = session.info.setdefault('versiones_incrementadas', set())
+    if tabla in incrementadas:
+        return
+    incrementadas.add(tabla)
+    incrementar_version(session.connection(), tabla)
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _limpiar_incrementadas(session):
+    session.info.pop('versiones_incrementadas', None)
+
+def _invalidar_version(evento):
+    cache_versiones.invalidar(evento['tabla'])
+
+for _tabla in TABLAS_VERSIONADAS:
+    suscribir(_tabla, _invalidar_version)
+
+def version_tabla(tabla):
+    """Versión actual de una tabla (memoria o una lectura por clave primaria)"""
+    version = cache_versiones.obtener(tabla)
+    if version is None:
+        generacion = cache_versiones.generacion()
+        fila = db.session.get(VersionTabla, tabla)
+        version = fila.version if fila else 0
+        cache_versiones.guardar(tabla, version, generacion)
+    return version
+
+def etag_tablas(*tablas):
+    """ETag fuerte (sin comillas) derivado de las versiones de las tablas indicadas"""
+    return '-'.join(f'{tabla}.v{version_tabla(tabla)}' for tabla in tablas)
+
+def respuesta_condicional(*tablas, cache_control='no-cache'):
+    """Decorador para GET de catálogos: agrega ETag/Cache-Control y responde 304 si no hubo cambios.
+
+    Debe aplicarse por fuera de marshal_with / marshal_list_with.
+    """
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            # La versión se lee antes que los datos: si cambian entre medias el ETag queda obsoleto, nunca adelantado
+            etag = etag_tablas(*tablas)
+            cabeceras = {'ETag': quote_etag(etag), 'Cache-Control': cache_control}
+
+            if request.if_none_match.contains(etag):
+                respuesta = Response(status=304)
+                respuesta.headers.update(cabeceras)
+                return respuesta
+
+            resultado = funcion(*args, **kwargs)
+            if isinstance(resultado, Response):
+                if resultado.status_code == 200:
+                    resultado.headers.update(cabeceras)
+                return resultado
+
+            data, code, headers = unpack(resultado)
+            if code != 200:
+                return resultado
+            headers = dict(headers or {})
+            headers.update(cabeceras)
+            return data, code, headers
+        return envoltura
+    return decorador
@@ -0,0 +1,14 @@
+"""Punto de entrada WSGI para producción.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Con preload_app la aplicación (y pandas, scipy y scikit-learn, que importan las rutas)
+se carga una sola vez en el proceso maestro y los workers la comparten por
+copy-on-write. Los servicios por proceso (hilo de escucha de invalidación) se inician
+en cada worker tras el fork desde gunicorn.conf.py.
+"""
+from app import app, iniciar_servicios
+
+application = app
+
+__all__ = ['app', 'application', 'iniciar_servicios']